@@ -82,4 +82,10 @@ class DeliveryAdmin(admin.ModelAdmin):
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ("payment_id", "provider", "amount", "currency", "status", "order")
     search_fields = ("provider_order_id", "provider_payment_id")
-    list_filter = ("provider", "status")
\ No newline at end of file
+    list_filter = ("provider", "status")
+
+@admin.register(models.PaymentWebhookEvent)
+class PaymentWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ("id", "provider", "event_type", "event_id", "status", "attempts", "received_at", "processed_at")
+    search_fields = ("event_id",)
+    list_filter = ("provider", "event_type", "status")
@@ -3,10 +3,11 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from . import models
 from .authentication import CustomTokenAuthentication
+from .audit import log_event
 from django.contrib.auth.hashers import make_password
 from django.core.mail import send_mail
 from django.conf import settings
-import random, traceback, sys, json
+import random, traceback, sys
 
 
 @api_view(["POST"])
@@ -31,10 +32,7 @@ def register_agent(request):
     partner = models.DeliveryPartner.objects.create(name=name, email=email, location_lat=None, location_long=None, availability=True, approved=False)
 
     # Log registration event for admins
-    try:
-        models.AnalyticsLog.objects.create(admin=None, action_type='partner_registered', details=json.dumps({'partner_id': partner.partner_id, 'email': email}))
-    except Exception:
-        pass
+    log_event('partner_registered', {'partner_id': partner.partner_id, 'email': email})
 
     return Response({'registered': True, 'partner_id': partner.partner_id, 'message': 'Registration submitted — pending admin approval'})
 
@@ -80,10 +78,7 @@ def admin_approve_agent(request, agent_id):
         print(f"[admin_approve_agent] failed to send OTP to {p.email}: {e}")
         traceback.print_exc(file=sys.stdout)
 
-    try:
-        models.AnalyticsLog.objects.create(admin=None, action_type='partner_approved', details=json.dumps({'partner_id': p.partner_id}))
-    except Exception:
-        pass
+    log_event('partner_approved', {'partner_id': p.partner_id})
 
     return Response({'approved': True, 'partner_id': p.partner_id})
 
@@ -100,8 +95,5 @@ def admin_reject_agent(request, agent_id):
         return Response({'error': 'Partner not found'}, status=404)
     # delete/cleanup
     p.delete()
-    try:
-        models.AnalyticsLog.objects.create(admin=None, action_type='partner_rejected', details=json.dumps({'partner_id': agent_id}))
-    except Exception:
-        pass
+    log_event('partner_rejected', {'partner_id': agent_id})
     return Response({'rejected': True})
@@ -0,0 +1,161 @@
+# api/audit.py
+"""
+Buffered AnalyticsLog writer.
+
+Views call ``log_event(...)`` instead of ``AnalyticsLog.objects.create(...)``.
+Events are queued in-process and written with ``bulk_create`` by a background
+thread once ``AUDIT_LOG_BATCH_SIZE`` events are waiting or every
+``AUDIT_LOG_FLUSH_INTERVAL`` seconds, whichever comes first.
+
+The queue is bounded (``AUDIT_LOG_MAX_QUEUE``); when it is full, or when
+buffering is disabled (``AUDIT_LOG_BUFFERED = False``), the event is written
+synchronously so nothing is silently dropped.
+
+``partner_id`` / ``delivery_id`` / ``order_id`` keys in ``details`` are also
+stored in their own indexed columns so admin queries don't scan JSON text.
+"""
+import atexit
+import json
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import models
+
+# keys in `details` that are copied to their own indexed AnalyticsLog columns
+ENTITY_FIELDS = ("partner_id", "delivery_id", "order_id")
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class AuditLogWriter:
+    def __init__(self):
+        self._queue = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    # ---------- public API ----------
+    def log(self, action_type, details=None, admin=None):
+        """Record one event. Never raises: audit logging must not break the request."""
+        try:
+            entry = self._build(action_type, details, admin)
+        except Exception as e:
+            print(f"[audit] could not build log entry {action_type}: {e}")
+            return
+
+        if not _setting("AUDIT_LOG_BUFFERED", True):
+            self._write([entry])
+            return
+
+        q = self._get_queue()
+        try:
+            q.put_nowait(entry)
+        except queue.Full:
+            # bounded queue: fall back to a synchronous write instead of dropping
+            self._write([entry])
+            return
+
+        if _setting("AUDIT_LOG_FLUSH_INTERVAL", 2.0) <= 0:
+            # no background worker configured: flush inline once a batch is ready
+            if q.qsize() >= _setting("AUDIT_LOG_BATCH_SIZE", 200):
+                self.flush()
+            return
+
+        self._ensure_worker()
+        if q.qsize() >= _setting("AUDIT_LOG_BATCH_SIZE", 200):
+            self._wake.set()
+
+    def flush(self):
+        """Drain the queue and write everything in ``bulk_create`` batches. Returns rows written."""
+        if self._queue is None:
+            return 0
+        batch_size = _setting("AUDIT_LOG_BATCH_SIZE", 200)
+        written = 0
+        while True:
+            batch = []
+            while len(batch) < batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                return written
+            written += self._write(batch)
+
+    def pending(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    # ---------- internals ----------
+    def _build(self, action_type, details, admin):
+        entry = models.AnalyticsLog(admin=admin, action_type=action_type, timestamp=timezone.now())
+        if isinstance(details, dict):
+            # lift well-known entity ids into indexed columns
+            for field in ENTITY_FIELDS:
+                value = details.get(field)
+                if value is not None:
+                    try:
+                        setattr(entry, field, int(value))
+                    except (TypeError, ValueError):
+                        pass
+        if details is not None and not isinstance(details, str):
+            details = json.dumps(details, default=str)
+        entry.details = details
+        return entry
+
+    def _get_queue(self):
+        if self._queue is None:
+            with self._lock:
+                if self._queue is None:
+                    self._queue = queue.Queue(maxsize=_setting("AUDIT_LOG_MAX_QUEUE", 10000))
+        return self._queue
+
+    def _write(self, entries):
+        try:
+            if len(entries) == 1:
+                entries[0].save(force_insert=True)
+            else:
+                models.AnalyticsLog.objects.bulk_create(entries)
+            return len(entries)
+        except Exception as e:
+            print(f"[audit] failed to write {len(entries)} log entries: {e}")
+            return 0
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="audit-log-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=_setting("AUDIT_LOG_FLUSH_INTERVAL", 2.0))
+            self._wake.clear()
+            try:
+                self.flush()
+            finally:
+                # worker thread owns its own DB connection; don't let it go stale
+                close_old_connections()
+
+
+writer = AuditLogWriter()
+
+
+def log_event(action_type, details=None, admin=None):
+    """Queue an AnalyticsLog event. ``details`` may be a dict (JSON-encoded here) or a string."""
+    writer.log(action_type, details=details, admin=admin)
+
+
+def flush():
+    return writer.flush()
+
+
+atexit.register(flush)
@@ -1,10 +1,87 @@
 # api/authentication.py
+import hashlib
 from datetime import timedelta
+from django.core.cache import cache
 from django.utils import timezone
 from django.conf import settings
+from django.db.models import Q
 from rest_framework.authentication import BaseAuthentication, get_authorization_header
 from rest_framework import exceptions
-from .models import UserToken, DeliveryAgentToken, DeliveryAgent, DeliveryPartnerToken, DeliveryPartner
+from .models import Admin, Mart, UserToken, DeliveryAgentToken, DeliveryAgent, DeliveryPartnerToken, DeliveryPartner
+
+
+class AdminPrincipal:
+    """
+    The Admin row behind a staff User and the marts it manages. Attached to the user at
+    authentication time as ``user.admin_principal`` so permission checks are set lookups.
+    """
+    __slots__ = ("admin_id", "mart_ids")
+
+    def __init__(self, admin_id, mart_ids):
+        self.admin_id = admin_id
+        self.mart_ids = frozenset(mart_ids)
+
+    @property
+    def admin(self):
+        # unsaved instance carrying only the pk; enough to assign to a ForeignKey
+        return Admin(pk=self.admin_id)
+
+    def manages(self, mart_id):
+        return mart_id in self.mart_ids
+
+
+_PRINCIPAL_GEN_KEY = "auth:admin-principal:gen"
+
+
+def invalidate_admin_principals():
+    """
+    Called when Admin or Mart rows change (api/signals.py); cached principals are rebuilt on
+    next use. The generation lives in the default cache, so this reaches other processes only
+    when that cache is shared (CACHE_URL); otherwise they catch up within ADMIN_PRINCIPAL_CACHE_TTL.
+    """
+    if not cache.add(_PRINCIPAL_GEN_KEY, 1, None):
+        try:
+            cache.incr(_PRINCIPAL_GEN_KEY)
+        except ValueError:
+            cache.add(_PRINCIPAL_GEN_KEY, 1, None)
+
+
+def _match_admin_id(user):
+    email = getattr(user, "email", None) or None
+    username = getattr(user, "username", None) or None
+    if not email and not username:
+        return None
+    exact = Q(email=email) if email else Q(pk__in=[])
+    if username:
+        exact |= Q(username=username)
+    # exact matches use the unique indexes; the case-insensitive match is only the fallback
+    rows = list(Admin.objects.filter(exact).values_list("admin_id", "email"))
+    if not rows:
+        loose = Q(email__iexact=email) if email else Q(pk__in=[])
+        if username:
+            loose |= Q(username__iexact=username)
+        rows = list(Admin.objects.filter(loose).values_list("admin_id", "email")[:1])
+    if not rows:
+        return None
+    rows.sort(key=lambda r: r[1] != email)  # an email match wins over a username match
+    return rows[0][0]
+
+
+def resolve_admin_principal(user):
+    """
+    AdminPrincipal for a staff user, or None. Cached for ADMIN_PRINCIPAL_CACHE_TTL seconds under
+    the user's id, email and username, so editing the User row itself never serves a stale match.
+    """
+    gen = cache.get(_PRINCIPAL_GEN_KEY, 0)
+    ident = hashlib.sha1(f"{user.email or ''}\0{user.username or ''}".encode()).hexdigest()[:16]
+    key = f"auth:admin-principal:{gen}:{user.user_id}:{ident}"
+    hit = cache.get(key)
+    if hit is None:
+        admin_id = _match_admin_id(user)
+        mart_ids = list(Mart.objects.filter(admin_id=admin_id).values_list("mart_id", flat=True)) if admin_id else []
+        hit = (admin_id, mart_ids)
+        cache.set(key, hit, int(getattr(settings, "ADMIN_PRINCIPAL_CACHE_TTL", 300)))
+    return AdminPrincipal(*hit) if hit[0] is not None else None
 
 class CustomTokenAuthentication(BaseAuthentication):
     """
@@ -41,6 +118,8 @@ class CustomTokenAuthentication(BaseAuthentication):
 
             user = token.user
             user.is_authenticated = True
+            if user.is_staff or user.is_superuser:
+                user.admin_principal = resolve_admin_principal(user)
             print(f"[CustomTokenAuthentication] Authenticated user {user.username} (id={user.user_id})")
             return (user, None)
         except UserToken.DoesNotExist:
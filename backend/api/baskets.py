@@ -0,0 +1,165 @@
+# api/baskets.py
+"""
+The user's active basket as rows in ``basket_lines``.
+
+Every user has at most one ``Basket`` with ``is_active``, created on first use
+under a lock on the user's row (MySQL ignores the partial unique constraint, so
+that is what keeps two first requests from both creating one). Edits touch only
+the changed line: the basket
+row is locked (``SELECT ... FOR UPDATE``) so concurrent edits of one basket
+serialize, the line is inserted / updated / deleted, and the cached ``total`` /
+``item_count`` on the basket move by the line's delta in the same statement that
+bumps ``updated_at``. Reading a basket is two queries (basket, lines + products)
+whatever its size.
+
+``unit_price`` is the product price when the line was last written; the
+serializer shows the current price next to it so clients can flag changes, and
+``optimize_basket`` / checkout always price from the catalog.
+"""
+from decimal import Decimal
+from typing import Dict, Iterable, Optional
+
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.utils import timezone
+
+from . import models
+
+
+class BasketError(Exception):
+    """A basket edit that can't be applied (unknown or unlisted product, bad quantity)."""
+
+
+class ProductNotFound(BasketError):
+    pass
+
+
+def active_basket(user, create: bool = True) -> Optional[models.Basket]:
+    basket = models.Basket.objects.filter(user=user, is_active=True).first()
+    if basket is None and create:
+        with transaction.atomic():
+            list(models.User.objects.select_for_update().filter(pk=user.pk).values_list("pk"))
+            # locking read: sees a basket another request committed while we waited
+            basket = models.Basket.objects.select_for_update().filter(user=user, is_active=True).first()
+            if basket is None:
+                basket = models.Basket.objects.create(user=user, is_active=True, items=[])
+    return basket
+
+
+def load(user) -> Optional[models.Basket]:
+    """Active basket with lines and their products prefetched, or None."""
+    return (
+        models.Basket.objects.filter(user=user, is_active=True)
+        .prefetch_related(Prefetch(
+            "lines", queryset=models.BasketLine.objects.select_related("product").order_by("line_id"),
+        ))
+        .first()
+    )
+
+
+def _locked(user) -> models.Basket:
+    basket = active_basket(user)
+    return models.Basket.objects.select_for_update().get(pk=basket.pk)
+
+
+def _bump(basket: models.Basket, amount: Decimal, count: int):
+    models.Basket.objects.filter(pk=basket.pk).update(
+        total=F("total") + amount, item_count=F("item_count") + count, updated_at=timezone.now(),
+    )
+
+
+def _product(product_id) -> models.Product:
+    try:
+        product = models.Product.objects.filter(pk=int(product_id), is_active=True).first()
+    except (TypeError, ValueError):
+        product = None
+    if product is None:
+        raise ProductNotFound("Product not found")
+    return product
+
+
+def _quantity(value) -> int:
+    try:
+        qty = int(value)
+    except (TypeError, ValueError):
+        raise BasketError("quantity must be an integer")
+    if qty < 0:
+        raise BasketError("quantity must be >= 0")
+    return qty
+
+
+def set_quantity(user, product_id, quantity, add: bool = False) -> models.Basket:
+    """
+    Set a line's quantity (``add=True``: increase it by ``quantity``). Zero removes the line.
+    One line write and one basket update, in one transaction.
+    """
+    qty = _quantity(quantity)
+    product = _product(product_id)
+    with transaction.atomic():
+        basket = _locked(user)
+        line = models.BasketLine.objects.filter(basket=basket, product=product).first()
+        old_amount = line.quantity * line.unit_price if line else Decimal("0")
+        old_qty = line.quantity if line else 0
+        new_qty = old_qty + qty if add else qty
+        if new_qty == 0:
+            if line:
+                line.delete()
+            new_amount = Decimal("0")
+        elif line:
+            line.quantity, line.unit_price = new_qty, product.price
+            line.save(update_fields=["quantity", "unit_price", "updated_at"])
+            new_amount = new_qty * product.price
+        else:
+            models.BasketLine.objects.create(basket=basket, product=product, quantity=new_qty, unit_price=product.price)
+            new_amount = new_qty * product.price
+        if new_qty != old_qty or new_amount != old_amount:
+            _bump(basket, new_amount - old_amount, new_qty - old_qty)
+    return basket
+
+
+def remove(user, product_id) -> bool:
+    """Delete one line; False when the basket has no such line."""
+    basket = active_basket(user, create=False)
+    if basket is None:
+        return False
+    with transaction.atomic():
+        basket = models.Basket.objects.select_for_update().get(pk=basket.pk)
+        line = models.BasketLine.objects.filter(basket=basket, product_id=product_id).first()
+        if line is None:
+            return False
+        line.delete()
+        _bump(basket, -(line.quantity * line.unit_price), -line.quantity)
+    return True
+
+
+def replace(user, items: Iterable[Dict], optimized_cost=None) -> models.Basket:
+    """Replace the active basket's lines with ``items`` ([{product_id, quantity}]) in bulk."""
+    wanted: Dict[int, int] = {}
+    for item in items:
+        if not isinstance(item, dict):
+            raise BasketError("items must be objects with product_id and quantity")
+        try:
+            pid = int(item.get("product_id"))
+        except (TypeError, ValueError):
+            raise BasketError("product_id must be an integer")
+        qty = _quantity(item.get("quantity", 1))
+        if qty:
+            wanted[pid] = wanted.get(pid, 0) + qty
+    prices = dict(models.Product.objects.filter(pk__in=list(wanted), is_active=True).values_list("product_id", "price"))
+    missing = sorted(set(wanted) - set(prices))
+    if missing:
+        raise BasketError(f"Products not found: {missing}")
+    with transaction.atomic():
+        basket = _locked(user)
+        models.BasketLine.objects.filter(basket=basket).delete()
+        lines = [models.BasketLine(basket=basket, product_id=pid, quantity=qty, unit_price=prices[pid]) for pid, qty in wanted.items()]
+        models.BasketLine.objects.bulk_create(lines)
+        basket.total = sum((line.quantity * line.unit_price for line in lines), Decimal("0"))
+        basket.item_count = sum(wanted.values())
+        basket.optimized_cost = optimized_cost
+        basket.save(update_fields=["total", "item_count", "optimized_cost", "updated_at"])
+    return basket
+
+
+def clear(user):
+    replace(user, [])
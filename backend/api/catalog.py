@@ -0,0 +1,304 @@
+# api/catalog.py
+"""
+In-process catalog snapshot for pricing and basket optimization.
+
+Products are held column-wise in ``array`` columns (ids, price in paise, stock,
+unit weight in grams, mart id, listed flag, quality) with small object columns for name, category,
+image and ``updated_at``, a ``product_id -> row`` map and a ``name -> rows``
+index for swap candidates. Marts are kept whole (there are few of them).
+
+``CheckoutContext.load_products`` reads from here instead of the database, so
+``optimize_basket`` / ``checkout`` compute plans without product or mart queries.
+Order creation still reloads the rows it writes (``create_orders``), so prices and
+stock that end up on an order always come from the database.
+
+Full loads never run on a request: the first one starts in a background thread at
+startup (``backend_project/wsgi.py``) or on first use, and until it finishes
+``enabled()`` is False so callers query the database. A full load builds new
+tables without holding the read lock and swaps them in when done; one runs again
+in the background every ``CATALOG_FULL_RELOAD_SECONDS`` to drop rows deleted in
+other processes (this process drops them via the post_delete signal).
+
+Between full loads, refreshes are incremental: at most every
+``CATALOG_REFRESH_INTERVAL`` seconds, rows with ``updated_at`` at or after the
+last watermark (minus a small overlap for late commits; ``products.updated_at`` is
+indexed) are read without the lock and upserted under it. With
+``CATALOG_REFRESH_ASYNC`` that read runs in a background thread too and readers keep
+the current rows meanwhile; otherwise (tests) it runs inline. Local saves mark the
+snapshot dirty so the next read triggers a refresh.
+Quality (``ratings.quality``) only breaks price ties, so review changes, which don't
+touch ``updated_at``, are picked up by the full reload.
+"""
+import threading
+import time
+from array import array
+from datetime import timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from . import models
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def enabled() -> bool:
+    """True once the snapshot is on and loaded; until the first load finishes callers read the database."""
+    if not _setting("CATALOG_SNAPSHOT", True):
+        return False
+    if not snapshot.loaded():
+        snapshot.start()
+        return False
+    return True
+
+
+def warm():
+    """Start the first full load in the background (called from wsgi.py at startup)."""
+    if _setting("CATALOG_SNAPSHOT", True):
+        snapshot.start()
+
+
+_PRODUCT_FIELDS = ("product_id", "mart_id", "name", "category", "price", "stock", "unit_weight_kg", "image_url", "updated_at", "is_active",
+                   "quality_score", "rating__review_count", "rating__rating_sum")
+
+
+class _Tables:
+    """One generation of the column store; built off-lock by a full load, then swapped in."""
+
+    def __init__(self):
+        self.ids = array("q")
+        self.price_paise = array("q")
+        self.stock = array("q")
+        self.weight_g = array("q")
+        self.mart_ids = array("q")
+        self.active = array("b")
+        self.quality = array("d")
+        self.names: List[str] = []
+        self.categories: List[str] = []
+        self.images: List[Optional[str]] = []
+        self.updated: List[object] = []
+        self.row: Dict[int, int] = {}
+        self.by_name: Dict[str, set] = {}
+        self.marts: Dict[int, models.Mart] = {}
+        self.watermark = None
+        self.mart_watermark = None
+
+    def put_mart(self, m: models.Mart):
+        self.marts[m.mart_id] = m
+        if self.mart_watermark is None or m.updated_at > self.mart_watermark:
+            self.mart_watermark = m.updated_at
+
+    def upsert(self, pid, mart_id, name, category, price, stock, weight, image_url, updated_at, is_active,
+               quality_score, review_count, rating_sum):
+        price_paise = int((price or 0) * 100)
+        quality = rating_sum / review_count if review_count else float(quality_score or 0)
+        weight_g = int(Decimal(weight if weight is not None else 1) * 1000)
+        i = self.row.get(pid)
+        if i is None:
+            i = self.row[pid] = len(self.ids)
+            self.ids.append(pid)
+            self.price_paise.append(price_paise)
+            self.stock.append(stock)
+            self.weight_g.append(weight_g)
+            self.mart_ids.append(mart_id)
+            self.active.append(1 if is_active else 0)
+            self.quality.append(quality)
+            self.names.append(name)
+            self.categories.append(category)
+            self.images.append(image_url)
+            self.updated.append(updated_at)
+        else:
+            if self.names[i] != name:
+                self.by_name.get(self.names[i], set()).discard(i)
+            self.price_paise[i] = price_paise
+            self.stock[i] = stock
+            self.weight_g[i] = weight_g
+            self.mart_ids[i] = mart_id
+            self.active[i] = 1 if is_active else 0
+            self.quality[i] = quality
+            self.names[i] = name
+            self.categories[i] = category
+            self.images[i] = image_url
+            self.updated[i] = updated_at
+        self.by_name.setdefault(name, set()).add(i)
+        if self.watermark is None or updated_at > self.watermark:
+            self.watermark = updated_at
+
+    def discard(self, product_id: int):
+        i = self.row.pop(product_id, None)
+        if i is not None:
+            # the row stays in the arrays as a tombstone until the next full reload
+            self.by_name.get(self.names[i], set()).discard(i)
+
+
+class CatalogSnapshot:
+    def __init__(self):
+        self._lock = threading.RLock()   # guards reads and in-place upserts of ``_t``
+        self._refresh_lock = threading.Lock()
+        self._t = _Tables()
+        self._checked = 0.0    # monotonic time of the last refresh check
+        self._dirty = False
+        self._loaded_at = 0.0  # monotonic time of the last full load
+        self._loader = None    # background full-load thread
+        self._refresher = None  # background incremental-refresh thread
+        self._discarded = set()  # deletes seen while a full load was running
+
+    # ---------- loading ----------
+    def loaded(self) -> bool:
+        return bool(self._loaded_at)
+
+    def start(self):
+        """Run a full load in a background thread unless one is already running."""
+        with self._lock:
+            if self._loader is not None and self._loader.is_alive():
+                return
+            self._loader = threading.Thread(target=self._load_in_background, name="catalog-snapshot-loader", daemon=True)
+            self._loader.start()
+
+    def _load_in_background(self):
+        try:
+            self.load()
+        except Exception as e:
+            print(f"[catalog] full load failed: {e}")
+        finally:
+            close_old_connections()
+
+    def load(self):
+        """Full load into fresh tables (no lock held while reading), then swap them in."""
+        started = time.monotonic()
+        with self._lock:
+            self._dirty = False
+            self._discarded = set()
+        t = _Tables()
+        for m in models.Mart.objects.all():
+            t.put_mart(m)
+        for values in models.Product.objects.values_list(*_PRODUCT_FIELDS).iterator(chunk_size=2000):
+            t.upsert(*values)
+        with self._lock:
+            for pid in self._discarded:
+                t.discard(pid)
+            self._t = t
+            self._loaded_at = started
+            self._checked = time.monotonic()
+
+    def refresh(self, force: bool = False):
+        """
+        ``force`` reloads everything in this thread. Otherwise: start the first / periodic
+        full load in the background and, when one is due, the incremental refresh.
+        """
+        if force:
+            self.load()
+            return
+        if not self._loaded_at:
+            self.start()
+            return
+        now = time.monotonic()
+        if now - self._loaded_at > _setting("CATALOG_FULL_RELOAD_SECONDS", 300):
+            self.start()  # readers keep the current tables meanwhile
+        if not (self._dirty or now - self._checked >= _setting("CATALOG_REFRESH_INTERVAL", 5.0)):
+            return
+        if not _setting("CATALOG_REFRESH_ASYNC", True):
+            self._apply_changes()
+            return
+        with self._lock:
+            if self._refresher is not None and self._refresher.is_alive():
+                return
+            self._refresher = threading.Thread(target=self._refresh_in_background, name="catalog-snapshot-refresher", daemon=True)
+            self._refresher.start()
+
+    def _refresh_in_background(self):
+        try:
+            self._apply_changes()
+        except Exception as e:
+            print(f"[catalog] incremental refresh failed: {e}")
+        finally:
+            close_old_connections()
+
+    def _apply_changes(self):
+        """Read rows changed since the watermark (no lock held) and upsert them."""
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # another thread is already refreshing
+        try:
+            self._dirty = False
+            t = self._t
+            overlap = timedelta(seconds=_setting("CATALOG_REFRESH_OVERLAP", 2.0))
+            marts = models.Mart.objects.all()
+            if t.mart_watermark is not None:
+                marts = marts.filter(updated_at__gte=t.mart_watermark - overlap)
+            products = models.Product.objects.all()
+            if t.watermark is not None:
+                products = products.filter(updated_at__gte=t.watermark - overlap)
+            marts, rows = list(marts), list(products.values_list(*_PRODUCT_FIELDS))
+            with self._lock:
+                for m in marts:
+                    t.put_mart(m)
+                for values in rows:
+                    t.upsert(*values)
+            self._checked = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    def mark_dirty(self):
+        self._dirty = True
+
+    def discard(self, product_id: int):
+        with self._lock:
+            self._t.discard(product_id)
+            self._discarded.add(product_id)
+
+    # ---------- reads ----------
+    @staticmethod
+    def _product(t: _Tables, i: int) -> Optional[models.Product]:
+        mart = t.marts.get(t.mart_ids[i])
+        if mart is None:
+            return None
+        p = models.Product(
+            product_id=t.ids[i],
+            mart_id=t.mart_ids[i],
+            name=t.names[i],
+            category=t.categories[i],
+            price=Decimal(t.price_paise[i]) / 100,
+            stock=t.stock[i],
+            unit_weight_kg=Decimal(t.weight_g[i]) / 1000,
+            image_url=t.images[i],
+            updated_at=t.updated[i],
+            is_active=bool(t.active[i]),
+        )
+        p.mart = mart
+        p.quality = t.quality[i]
+        p.from_snapshot = True
+        return p
+
+    def products(self, product_ids: Iterable[int]) -> Dict[int, models.Product]:
+        self.refresh()
+        out = {}
+        with self._lock:
+            t = self._t
+            for pid in product_ids:
+                i = t.row.get(pid)
+                p = self._product(t, i) if i is not None else None
+                if p is not None:
+                    out[pid] = p
+        return out
+
+    def variants(self, names: Iterable[str]) -> Dict[str, List[models.Product]]:
+        """In-stock, listed products of approved marts, per name."""
+        self.refresh()
+        out = {}
+        with self._lock:
+            t = self._t
+            for name in names:
+                rows = [i for i in t.by_name.get(name, ())
+                        if t.stock[i] > 0 and t.active[i] and getattr(t.marts.get(t.mart_ids[i]), "approved", False)]
+                out[name] = [p for p in (self._product(t, i) for i in rows) if p is not None]
+        return out
+
+    def size(self) -> int:
+        return len(self._t.row)
+
+
+snapshot = CatalogSnapshot()
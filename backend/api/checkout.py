@@ -0,0 +1,514 @@
+# api/checkout.py
+"""
+Basket optimization, order creation and payment intents over one resolved context.
+
+``CheckoutContext`` holds everything a checkout needs to look up more than once:
+the delivery address and its coordinates, the requested products and their
+same-name swap candidates (two queries in total), and a per-mart distance table.
+``optimize_basket``, ``create_order_from_plan`` and the single-round-trip
+``checkout`` view all build one and pass it through ``optimize()``,
+``create_orders()`` and ``create_payment_intent()`` instead of re-reading the
+address and reloading products at every step.
+
+Plans returned by ``optimize_basket`` are also kept server-side for
+``PLAN_CACHE_TTL`` seconds under an opaque, signed ``plan_id`` (``store_plan``).
+Ordering from a ``plan_id`` reloads only the plan's products (one query) and
+compares each one's ``updated_at`` with the version captured at optimize time;
+unchanged products are trusted as-is and only changed ones have their price and
+stock re-checked (``plan_context``).
+"""
+import math
+import uuid
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db.models import prefetch_related_objects, Prefetch
+
+from . import catalog, models, payment_gateway, ratings
+from .geo import distance_km_between, eta_minutes_from_distance
+from .utils import ensure_product_image
+
+PRICING_NOTES = "Pricing: ₹5/km + ₹5/kg. ETA tie-break when costs are equal. Approved marts & in-stock only."
+
+
+PLAN_SALT = "api.checkout.plan"
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class PlanError(Exception):
+    """The request can't produce a plan / orders; message is safe to return as a 400."""
+
+
+class PlanExpired(PlanError):
+    """The plan_id is past its TTL, already used, or was cached by another process."""
+
+
+def calculate_delivery_charge(distance_km: float, total_weight_kg: float) -> int:
+    """
+    Pricing rule:
+      - ₹5 per km
+      - ₹5 per kg
+      - no base
+    """
+    distance_component = 5.0 * max(0.0, float(distance_km or 0.0))
+    weight_component = 5.0 * max(0.0, float(total_weight_kg or 0.0))
+    return int(math.ceil(distance_component + weight_component))
+
+
+def unit_weight(product: models.Product, override=None) -> float:
+    """Per-unit weight: request override > product.unit_weight_kg > 1.0 default."""
+    if override is not None:
+        return float(override)
+    uw = getattr(product, "unit_weight_kg", None)
+    return float(uw) if uw is not None else 1.0
+
+
+class CheckoutContext:
+    def __init__(self, user, address: models.Address, lat: float, lon: float):
+        self.user = user
+        self.address = address
+        self.lat = lat
+        self.lon = lon
+        self.products: Dict[int, models.Product] = {}
+        self.variants_by_name: Dict[str, List[models.Product]] = {}
+        self._distance: Dict[int, float] = {}
+
+    def load_products(self, product_ids: Iterable, with_variants: bool = False, fresh: bool = False):
+        """
+        Load any products not already in the context and, optionally, their swap candidates.
+        Reads the in-memory catalog (api/catalog.py) when enabled, else one query each.
+        ``fresh`` reloads rows that came from the catalog snapshot from the database.
+        """
+        missing = set()
+        for pid in product_ids:
+            try:
+                pid = int(pid)
+            except (TypeError, ValueError):
+                continue
+            p = self.products.get(pid)
+            if p is None or (fresh and getattr(p, "from_snapshot", False)):
+                missing.add(pid)
+        if missing and not fresh and catalog.enabled():
+            self.products.update(catalog.snapshot.products(missing))
+            missing -= set(self.products)
+        if missing:
+            for p in models.Product.objects.filter(pk__in=missing).select_related("mart", "rating"):
+                self.products[p.product_id] = p
+        if with_variants:
+            names = {p.name for p in self.products.values()} - set(self.variants_by_name)
+            if names:
+                if catalog.enabled():
+                    self.variants_by_name.update(catalog.snapshot.variants(names))
+                else:
+                    for nm in names:
+                        self.variants_by_name[nm] = []
+                    qs = models.Product.objects.filter(name__in=names, mart__approved=True, stock__gt=0, is_active=True).select_related("mart", "rating")
+                    for p in qs:
+                        self.variants_by_name[p.name].append(p)
+                for p in (v for group in self.variants_by_name.values() for v in group):
+                    # a variant may be the same row as a requested product; share the instance
+                    self.products.setdefault(p.product_id, p)
+        return self
+
+    def product(self, pid) -> Optional[models.Product]:
+        try:
+            return self.products.get(int(pid))
+        except (TypeError, ValueError):
+            return None
+
+    def distance_km(self, mart: models.Mart) -> float:
+        d = self._distance.get(mart.mart_id)
+        if d is None:
+            try:
+                d = distance_km_between(self.lat, self.lon, float(mart.location_lat), float(mart.location_long))
+            except Exception:
+                d = 0.0
+            self._distance[mart.mart_id] = d
+        return d
+
+    def address_summary(self) -> Dict:
+        addr = self.address
+        return {
+            "id": addr.address_id,
+            "summary": f"{addr.line1}, {addr.city}" + (f" {addr.pincode}" if addr.pincode else ""),
+            "lat": self.lat,
+            "long": self.lon,
+        }
+
+
+# --------------------- optimization ---------------------
+def _price_then_quality(product: models.Product):
+    # equal prices: prefer the better-rated listing (ratings.quality never queries)
+    return (float(product.price), -ratings.quality(product))
+
+
+def _work_items(ctx: CheckoutContext, items: List[Dict], allow_swaps: bool) -> List[Dict]:
+    work_items: List[Dict] = []
+    for it in items:
+        qty = int(it.get("quantity", 1))
+        base = ctx.product(it.get("product_id"))
+        if not base:
+            continue
+        weight_each = unit_weight(base, it.get("weight_kg"))
+
+        # skip non-approved, OOS or delisted, unless we can swap
+        if (not getattr(base.mart, "approved", True)) or (getattr(base, "stock", 0) <= 0) or not getattr(base, "is_active", True):
+            if allow_swaps:
+                alts = ctx.variants_by_name.get(base.name, [])
+                if not alts:
+                    continue
+                base = min(alts, key=_price_then_quality)
+            else:
+                continue
+
+        chosen = base
+        if allow_swaps:
+            cand = ctx.variants_by_name.get(base.name) or [base]
+            if cand:
+                chosen = min(cand, key=_price_then_quality)
+
+        work_items.append({
+            "name": chosen.name,
+            "product": chosen,
+            "qty": qty,
+            "weight_total": weight_each * qty,
+            "unit_price": float(chosen.price),
+        })
+    return work_items
+
+
+def _totals(ctx: CheckoutContext, assign: Dict[int, List[Dict]], with_images: bool = False) -> Dict:
+    total_price = 0.0
+    total_delivery = 0.0
+    total_eta = 0
+    mart_breakdown = []
+
+    for mart_id, its in assign.items():
+        if not its:
+            continue
+        mart = its[0]["product"].mart
+        if not getattr(mart, "approved", True):
+            continue
+
+        mart_weight = sum(i["weight_total"] for i in its)
+        items_price = sum(i["unit_price"] * i["qty"] for i in its)
+        dist = ctx.distance_km(mart)
+        delivery = calculate_delivery_charge(dist, mart_weight)
+        eta = eta_minutes_from_distance(dist)
+
+        total_price += items_price
+        total_delivery += delivery
+        total_eta += eta
+
+        mart_breakdown.append({
+            "mart_id": mart.mart_id,
+            "mart_name": mart.name,
+            "distance_km": round(dist, 3),
+            "eta_min": eta,
+            "weight_kg": round(mart_weight, 3),
+            "delivery_charge": int(delivery),
+            "items": [
+                {
+                    "product_id": i["product"].product_id,
+                    "name": i["name"],
+                    "qty": i["qty"],
+                    "unit_price": i["unit_price"],
+                    "line_price": round(i["unit_price"] * i["qty"], 2),
+                    # images only matter for the returned plan, not for each trial move
+                    "image_url": ensure_product_image(i["product"]).image_url if with_images else None,
+                }
+                for i in its
+            ]
+        })
+
+    return {
+        "items_price": round(total_price, 2),
+        "delivery_total": int(total_delivery),
+        "grand_total": round(total_price + total_delivery, 2),
+        "eta_total_min": int(total_eta),
+        "marts": mart_breakdown,
+    }
+
+
+def optimize(ctx: CheckoutContext, items: List[Dict], allow_swaps: bool = True) -> Dict:
+    """
+    Group items per mart (cheapest same-name variant when swaps are allowed), then greedily
+    move items across marts while that lowers the grand total (ETA breaks ties).
+    Returns {"items_count", "result"}; raises PlanError when nothing is purchasable.
+    """
+    work_items = _work_items(ctx, items, allow_swaps)
+    if not work_items:
+        raise PlanError("No purchasable items (all out-of-stock or unapproved)")
+
+    assignment: Dict[int, List[Dict]] = {}
+    for wi in work_items:
+        if getattr(wi["product"].mart, "approved", True):
+            assignment.setdefault(wi["product"].mart_id, []).append(wi)
+    if not assignment:
+        raise PlanError("No approved marts available for these items")
+
+    best_plan = _totals(ctx, assignment)
+
+    if allow_swaps:
+        improved = True
+        iters = 0
+        while improved and iters < 50:
+            improved = False
+            iters += 1
+
+            for src_mart_id, items_list in list(assignment.items()):
+                for itm in list(items_list):
+                    candidates = [
+                        pr for pr in ctx.variants_by_name.get(itm["name"], [])
+                        if getattr(pr.mart, "approved", True) and getattr(pr, "stock", 0) > 0
+                    ]
+                    for cand_prod in candidates:
+                        tgt_mart_id = cand_prod.mart_id
+                        if tgt_mart_id == src_mart_id:
+                            continue
+                        # ensure current still present (could be moved in same pass)
+                        if src_mart_id not in assignment or itm not in assignment.get(src_mart_id, []):
+                            continue
+
+                        # simulate move
+                        assignment[src_mart_id].remove(itm)
+                        if not assignment.get(src_mart_id):
+                            assignment.pop(src_mart_id, None)
+                        moved = dict(itm)
+                        moved["product"] = cand_prod
+                        moved["unit_price"] = float(cand_prod.price)
+                        assignment.setdefault(tgt_mart_id, []).append(moved)
+
+                        new_plan = _totals(ctx, assignment)
+                        if (new_plan["grand_total"] < best_plan["grand_total"]) or (
+                            new_plan["grand_total"] == best_plan["grand_total"]
+                            and new_plan["eta_total_min"] < best_plan["eta_total_min"]
+                        ):
+                            best_plan = new_plan
+                            improved = True
+                        else:
+                            # revert
+                            assignment[tgt_mart_id].remove(moved)
+                            if not assignment.get(tgt_mart_id):
+                                assignment.pop(tgt_mart_id, None)
+                            assignment.setdefault(src_mart_id, []).append(itm)
+
+                if src_mart_id in assignment and not assignment[src_mart_id]:
+                    assignment.pop(src_mart_id, None)
+
+    return {
+        "items_count": sum(i["qty"] for bucket in assignment.values() for i in bucket),
+        "result": _totals(ctx, assignment, with_images=True),
+    }
+
+
+# --------------------- orders & payment ---------------------
+def create_orders(ctx: CheckoutContext, plan_marts: List[Dict], contact_number: Optional[str],
+                  checkout_payment: Optional[models.Payment] = None) -> List[Dict]:
+    """
+    Create one pending Order per mart entry of an optimizer plan. Call inside a transaction.
+    Unknown, delisted and out-of-stock products and unapproved marts are skipped (an old
+    plan or a direct call may still name them); returns the order payloads.
+    """
+    from .serializers import OrderSerializer
+
+    addr = ctx.address
+    # prices and stock written to orders come from the database, never the catalog snapshot
+    ctx.load_products((it.get("product_id") for m in plan_marts for it in (m.get("items") or [])), fresh=True)
+    mart_ids = {m.get("mart_id") for m in plan_marts if m.get("mart_id")}
+    # marts of already-loaded products come for free (select_related); query only the rest
+    marts = {p.mart_id: p.mart for p in ctx.products.values()
+             if p.mart_id in mart_ids and p.mart.approved and not getattr(p, "from_snapshot", False)}
+    if mart_ids - set(marts):
+        marts.update((m.mart_id, m) for m in models.Mart.objects.filter(mart_id__in=mart_ids - set(marts), approved=True))
+
+    created = []
+    for mart_entry in plan_marts:
+        mart_obj = marts.get(mart_entry.get("mart_id"))
+        items = mart_entry.get("items") or []
+        if not mart_obj or not items:
+            continue
+
+        total_cost = Decimal("0")
+        total_weight = 0.0
+        collected = []
+        for it in items:
+            product = ctx.product(it.get("product_id"))
+            if not product or not product.is_active or product.stock <= 0:
+                continue
+            qty = int(it.get("qty", it.get("quantity", 1)))
+            total_weight += unit_weight(product) * qty
+            total_cost += Decimal(qty) * product.price
+            collected.append((product, qty))
+        if not collected:
+            continue
+
+        dist = ctx.distance_km(mart_obj)
+        delivery_charge = calculate_delivery_charge(dist, total_weight)
+        total_cost += Decimal(delivery_charge)
+
+        order = models.Order.objects.create(
+            user=ctx.user,
+            total_cost=total_cost,
+            status="pending",
+            delivery_address=addr,
+            delivery_address_snapshot=f"{addr.line1}, {addr.city}, {addr.state} {addr.pincode}",
+            delivery_address_lat=addr.location_lat,
+            delivery_address_long=addr.location_long,
+            checkout_payment=checkout_payment,
+        )
+        models.OrderItem.objects.bulk_create([
+            models.OrderItem(order=order, product=product, mart=product.mart, quantity=qty, price_at_purchase=product.price)
+            for product, qty in collected
+        ])
+        created.append((order, {
+            "delivery_address": f"{addr.line1}, {addr.city}",
+            "contact_number": contact_number,
+            "chosen_mart_id": mart_obj.mart_id,
+            "chosen_mart_name": mart_obj.name,
+            "distance_km": round(dist, 3),
+            "delivery_charge": int(delivery_charge),
+            "total_weight_kg": round(total_weight, 3),
+        }))
+
+    orders = [o for o, _ in created]
+    # one query for every order's items (with product, mart + rating) instead of several per item in the serializer
+    prefetch_related_objects(orders, Prefetch("orderitem_set", queryset=models.OrderItem.objects.select_related("product__mart", "product__rating")))
+    out = []
+    for order, extra in created:
+        payload = OrderSerializer(order).data
+        payload.update(extra)
+        out.append(payload)
+    return out
+
+
+def create_payment_intent(payment: models.Payment, receipt: Optional[str] = None, notes: Optional[Dict] = None) -> Dict:
+    """Create the Razorpay order for an existing pending Payment. Raises GatewayError."""
+    client = payment_gateway.get_client()
+    amount_paise = int(round(float(payment.amount) * 100))
+    rz = client.create_order(amount_paise, currency=payment.currency,
+                             receipt=receipt or f"savr_rcpt_{payment.payment_id}", notes=notes)
+    payment.provider_order_id = rz.get("id")
+    payment.raw_payload = {"razorpay_order": rz}
+    payment.save(update_fields=["provider_order_id", "raw_payload", "updated_at"])
+    return {
+        "key_id": client.key_id,
+        "razorpay_order_id": payment.provider_order_id,
+        "payment_id": payment.payment_id,
+        "amount": float(payment.amount),
+        "currency": payment.currency,
+    }
+
+
+# --------------------- server-side plan cache ---------------------
+def _plan_quantities(result: Dict) -> Dict[int, int]:
+    qty: Dict[int, int] = {}
+    for m in result.get("marts", []):
+        for it in m.get("items", []):
+            qty[it["product_id"]] = qty.get(it["product_id"], 0) + int(it["qty"])
+    return qty
+
+
+def plan_snapshot(ctx: CheckoutContext, plan: Dict) -> Dict:
+    """What a plan id needs besides the user/address: the plan, mart distances and product versions."""
+    versions = {}
+    for pid in _plan_quantities(plan["result"]):
+        p = ctx.products[pid]
+        versions[str(pid)] = [p.updated_at.isoformat() if p.updated_at else None, str(p.price)]
+    return {
+        "items_count": plan["items_count"],
+        "result": plan["result"],
+        "distances": {m["mart_id"]: ctx._distance.get(m["mart_id"], m["distance_km"]) for m in plan["result"]["marts"]},
+        "versions": versions,
+    }
+
+
+def store_plan(ctx: CheckoutContext, snapshot: Dict) -> str:
+    """Cache a ``plan_snapshot`` for ctx's user and address and return a signed plan id bound to the user."""
+    key = uuid.uuid4().hex
+    entry = dict(snapshot, user_id=ctx.user.user_id, address_id=ctx.address.address_id, lat=ctx.lat, lon=ctx.lon)
+    cache.set(f"checkout:plan:{key}", entry, _setting("PLAN_CACHE_TTL", 600))
+    return signing.TimestampSigner(salt=PLAN_SALT).sign(f"{ctx.user.user_id}.{key}")
+
+
+def _plan_key(plan_id: str, user) -> str:
+    try:
+        value = signing.TimestampSigner(salt=PLAN_SALT).unsign(plan_id, max_age=_setting("PLAN_CACHE_TTL", 600))
+    except signing.SignatureExpired:
+        raise PlanExpired("Plan expired, please optimize again")
+    except signing.BadSignature:
+        raise PlanError("Invalid plan_id")
+    uid, _, key = value.partition(".")
+    if uid != str(getattr(user, "user_id", "")):
+        raise PlanError("Invalid plan_id")
+    return f"checkout:plan:{key}"
+
+
+def load_plan(plan_id: str, user) -> Dict:
+    entry = cache.get(_plan_key(plan_id, user))
+    if entry is None:
+        raise PlanExpired("Plan expired, please optimize again")
+    return entry
+
+
+def claim_plan(plan_id: str, user):
+    """
+    Plans are single-use: atomically mark one used (``cache.add`` only succeeds for the first
+    caller) before creating its orders, so concurrent submits can't both order. Raises PlanExpired.
+    """
+    if not cache.add(f"{_plan_key(plan_id, user)}:used", 1, _setting("PLAN_CACHE_TTL", 600)):
+        raise PlanExpired("Plan already used, please optimize again")
+
+
+def release_plan(plan_id: str, user):
+    """Undo ``claim_plan`` when no orders were created, so the plan can be retried."""
+    try:
+        cache.delete(f"{_plan_key(plan_id, user)}:used")
+    except PlanError:
+        pass
+
+
+def discard_plan(plan_id: str, user):
+    """Drop a claimed plan once its orders exist (the claim marker expires with the TTL)."""
+    try:
+        cache.delete(_plan_key(plan_id, user))
+    except PlanError:
+        pass
+
+
+def plan_context(user, entry: Dict) -> Tuple[CheckoutContext, List[Dict]]:
+    """
+    Rebuild a context for a cached plan with one product query. Returns (ctx, changes);
+    ``changes`` lists products whose price moved, whose stock no longer covers the plan,
+    or that disappeared. Products whose version (updated_at) is unchanged are not re-checked.
+    """
+    addr = models.Address.objects.filter(pk=entry["address_id"], user=user).first()
+    if addr is None:
+        raise PlanExpired("Plan address no longer exists")
+    ctx = CheckoutContext(user, addr, entry["lat"], entry["lon"])
+    ctx._distance.update(entry["distances"])
+
+    qty = _plan_quantities(entry["result"])
+    ctx.load_products(qty, fresh=True)
+    changes = []
+    for pid, needed in qty.items():
+        version, price = entry["versions"][str(pid)]
+        p = ctx.products.get(pid)
+        if p is None:
+            changes.append({"product_id": pid, "reason": "missing"})
+            continue
+        if (p.updated_at.isoformat() if p.updated_at else None) == version:
+            continue
+        if str(p.price) != price:
+            changes.append({"product_id": pid, "reason": "price_changed", "old_price": price, "price": str(p.price)})
+        elif p.stock < needed:
+            changes.append({"product_id": pid, "reason": "insufficient_stock", "stock": p.stock, "qty": needed})
+        elif not p.mart.approved:
+            changes.append({"product_id": pid, "reason": "mart_unavailable"})
+    return ctx, changes
@@ -0,0 +1,309 @@
+# api/dispatch.py
+"""
+Delivery dispatch: match unassigned deliveries to available partners by distance.
+
+A dispatch batch locks a slice of pending deliveries (``select_for_update(skip_locked=True)``
+so concurrent batches never fight over the same rows) and scores each delivery against
+its nearest partners that still have capacity: partners with a fresh ping are looked
+up in the tracker's live ``GridIndex``, the rest in one built for the batch. Candidate
+pairs are then taken cheapest-first across the whole batch, which avoids the FIFO
+failure mode of handing the oldest delivery to whoever happens to finish next,
+however far away they are.
+
+Deliveries are picked up at the mart of the order's first item and dropped at the
+order's delivery coordinates. A delivery with no pickup point (no mart coordinates)
+can't be matched on distance and falls back to the old oldest-first pick over the
+partners with slots left; one whose pickup has no free partner within
+``DISPATCH_MAX_PICKUP_KM`` stays pending for a later batch.
+
+``assign_next_for_partner`` runs on the request that frees a partner up, so it only
+matches that one partner (their nearest pending delivery) and leaves the rest of
+the backlog to ``manage.py dispatch_deliveries``.
+
+Partner load is read without locks while matching; before the batch is written the
+chosen partners' rows are locked (``SELECT ... FOR UPDATE``, in pk order) and their
+active deliveries recounted, and assignments beyond ``DISPATCH_PARTNER_CAPACITY``
+are dropped. Every assigner (the dispatch command, ``assign_next_for_partner``, the
+post-confirm dispatch) goes through that check, so concurrent batches can't push a
+partner over capacity. Every assignment is inserted into the partner's multi-stop
+route (see ``routing``).
+"""
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from . import events, locations, models, routing
+from .audit import log_event
+from .geo import GridIndex, haversine_km, eta_minutes_from_distance
+
+ACTIVE_STATUSES = ("assigned", "in_transit")
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _to_point(lat, lon) -> Optional[Tuple[float, float]]:
+    if lat is None or lon is None:
+        return None
+    try:
+        return float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+
+
+def pickup_points(order_ids) -> Dict[int, Tuple[float, float]]:
+    """Return {order_id: (lat, lon)} of the mart each order is picked up from (one query)."""
+    out: Dict[int, Tuple[float, float]] = {}
+    rows = (
+        models.OrderItem.objects.filter(order_id__in=list(order_ids))
+        .order_by("item_id")
+        .values_list("order_id", "mart__location_lat", "mart__location_long")
+    )
+    for order_id, lat, lon in rows:
+        if order_id not in out:
+            pt = _to_point(lat, lon)
+            if pt:
+                out[order_id] = pt
+    return out
+
+
+def available_partners(exclude_ids=()) -> Dict[int, Dict]:
+    """
+    Approved, available partners with free capacity.
+    Returns {partner_id: {"partner": obj, "slots": n, "point": (lat, lon) | None}}.
+    """
+    capacity = _setting("DISPATCH_PARTNER_CAPACITY", 3)
+    qs = (
+        models.DeliveryPartner.objects.filter(approved=True, availability=True)
+        .exclude(partner_id__in=list(exclude_ids))
+        .annotate(active=Count("delivery", filter=Q(delivery__status__in=ACTIVE_STATUSES)))
+    )
+    out = {}
+    for p in qs:
+        slots = capacity - p.active
+        if slots > 0:
+            out[p.partner_id] = {"partner": p, "slots": slots, "point": _to_point(p.location_lat, p.location_long)}
+    return out
+
+
+def match(deliveries, pickups: Dict[int, Tuple[float, float]], partners: Dict[int, Dict]) -> List[Tuple[models.Delivery, int, float]]:
+    """
+    Greedy global matching: collect (distance, delivery, partner) candidate edges from the
+    spatial indexes and accept them cheapest-first while both sides still have room.
+    Partners marked ``live`` are looked up in the tracker's index; only the others are
+    indexed here. Leftover deliveries without a pickup point go oldest-first to the partners
+    with the most free slots; ones with a pickup stay unmatched. Returns
+    [(delivery, partner_id, pickup_km)].
+    """
+    k = _setting("DISPATCH_CANDIDATES", 8)
+    max_km = _setting("DISPATCH_MAX_PICKUP_KM", 25.0)
+
+    live = {pid for pid, info in partners.items() if info.get("live")}
+    index = GridIndex(cell_km=_setting("DISPATCH_GRID_CELL_KM", 2.0))
+    for pid, info in partners.items():
+        if info["point"] and pid not in live:
+            index.upsert(pid, *info["point"])
+
+    edges = []
+    for d in deliveries:
+        pt = pickups.get(d.order_id)
+        if not pt:
+            continue
+        found = index.nearest(pt[0], pt[1], k=k, max_km=max_km)
+        if live:
+            found = sorted(found + locations.tracker.nearest(pt[0], pt[1], k=k, max_km=max_km, partner_ids=live))[:k]
+        for dist, pid in found:
+            # ties broken by delivery age so older orders win equal-distance partners
+            edges.append((dist, d.created_at, d.delivery_id, pid, d))
+    edges.sort(key=lambda e: (e[0], e[1], e[2]))
+
+    slots = {pid: info["slots"] for pid, info in partners.items()}
+    taken = set()
+    result = []
+    for dist, _, delivery_id, pid, d in edges:
+        if delivery_id in taken or slots.get(pid, 0) <= 0:
+            continue
+        taken.add(delivery_id)
+        slots[pid] -= 1
+        result.append((d, pid, dist))
+
+    # FIFO fallback for deliveries with nowhere to measure from (``deliveries`` is oldest-first);
+    # out-of-range ones wait for a partner to come near rather than go to whoever is free
+    for d in deliveries:
+        if d.delivery_id in taken or d.order_id in pickups:
+            continue
+        free = [pid for pid, n in slots.items() if n > 0]
+        if not free:
+            break
+        pid = min(free, key=lambda p: (-slots[p], p))
+        taken.add(d.delivery_id)
+        slots[pid] -= 1
+        result.append((d, pid, 0.0))
+    return result
+
+
+def _locked_slots(partner_ids) -> Dict[int, int]:
+    """
+    Lock the partners' rows (pk order) and return their free slots counted under the lock.
+    Call inside the transaction that writes the assignments.
+    """
+    ids = sorted(set(partner_ids))
+    if not ids:
+        return {}
+    capacity = _setting("DISPATCH_PARTNER_CAPACITY", 3)
+    list(models.DeliveryPartner.objects.select_for_update().filter(partner_id__in=ids).order_by("pk").values_list("pk", flat=True))
+    # a locking read sees deliveries committed by batches that held these locks before us
+    active = Counter(
+        models.Delivery.objects.select_for_update()
+        .filter(partner_id__in=ids, status__in=ACTIVE_STATUSES)
+        .values_list("partner_id", flat=True)
+    )
+    return {pid: capacity - active[pid] for pid in ids}
+
+
+def _estimated_minutes(d: models.Delivery, pickup_km: float, pickup: Optional[Tuple[float, float]]) -> int:
+    total = pickup_km
+    drop = _to_point(d.order.delivery_address_lat, d.order.delivery_address_long) if d.order_id else None
+    if pickup and drop:
+        total += haversine_km(pickup[0], pickup[1], drop[0], drop[1])
+    return eta_minutes_from_distance(total)
+
+
+def dispatch_pending(limit: Optional[int] = None, positions: Optional[Dict[int, Tuple[float, float]]] = None,
+                     order_ids: Optional[Iterable[int]] = None) -> List[Tuple[int, int]]:
+    """
+    Run one dispatch batch. ``positions`` overrides partner coordinates (e.g. the drop-off
+    point of the delivery a partner just completed); ``order_ids`` restricts the batch to
+    those orders' deliveries. Returns [(delivery_id, partner_id)].
+    """
+    limit = limit or _setting("DISPATCH_BATCH_SIZE", 200)
+    with transaction.atomic():
+        qs = (
+            models.Delivery.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(partner__isnull=True)
+            .exclude(status="delivered")
+        )
+        if order_ids is not None:
+            qs = qs.filter(order_id__in=list(order_ids))
+        pending = list(qs.select_related("order").order_by("created_at")[:limit])
+        if not pending:
+            return []
+        partners = available_partners()
+        # live pings are fresher than the persisted columns; explicit positions win over both
+        for pid, pt in locations.tracker.positions().items():
+            if pid in partners:
+                partners[pid].update(point=pt, live=True)
+        for pid, pt in (positions or {}).items():
+            if pid in partners and pt:
+                partners[pid].update(point=pt, live=False)
+        if not partners:
+            return []
+
+        pickups = pickup_points({d.order_id for d in pending})
+        matches = match(pending, pickups, partners)
+        slots = _locked_slots(pid for _, pid, _ in matches)
+        checked = []
+        for m in matches:
+            if slots[m[1]] > 0:
+                slots[m[1]] -= 1
+                checked.append(m)
+        matches = checked
+
+        now = timezone.now()
+        changed = []
+        for d, pid, pickup_km in matches:
+            d.partner_id = pid
+            d.status = "assigned"
+            d.estimated_time = _estimated_minutes(d, pickup_km, pickups.get(d.order_id))
+            d.updated_at = now
+            changed.append(d)
+        if changed:
+            models.Delivery.objects.bulk_update(changed, ["partner", "status", "estimated_time", "updated_at"])
+
+    for d, pid, pickup_km in matches:
+        log_event("delivery_auto_assigned", {"delivery_id": d.delivery_id, "partner_id": pid, "order_id": d.order_id, "pickup_km": round(pickup_km, 3)})
+        routing.replan_quietly(routing.add_delivery, partners[pid]["partner"], d.delivery_id, origin=partners[pid]["point"])
+        events.delivery_changed(d, "delivery.assigned")
+    return [(d.delivery_id, pid) for d, pid, _ in matches]
+
+
+def _assign_oldest(partner: models.DeliveryPartner) -> Optional[int]:
+    """Legacy FIFO pick, used when there is no position to match on."""
+    with transaction.atomic():
+        if _locked_slots([partner.partner_id])[partner.partner_id] <= 0:
+            return None
+        next_d = (
+            models.Delivery.objects.select_for_update(skip_locked=True)
+            .filter(partner__isnull=True)
+            .exclude(status="delivered")
+            .order_by("created_at")
+            .first()
+        )
+        if not next_d:
+            return None
+        next_d.partner = partner
+        next_d.status = "assigned"
+        next_d.save(update_fields=["partner", "status", "updated_at"])
+    log_event("delivery_auto_assigned", {"delivery_id": next_d.delivery_id, "partner_id": partner.partner_id})
+    routing.replan_quietly(routing.add_delivery, partner, next_d.delivery_id)
+    events.delivery_changed(next_d, "delivery.assigned")
+    return next_d.delivery_id
+
+
+def assign_next_for_partner(partner: models.DeliveryPartner, origin: Optional[Tuple[float, float]] = None) -> Optional[int]:
+    """
+    Called when ``partner`` frees up. Hands them the pending delivery whose pickup is nearest
+    to ``origin`` (or their live / stored position) within ``DISPATCH_MAX_PICKUP_KM``, else the
+    oldest one without a pickup point. Only the chosen row and the partner are locked.
+    Returns the delivery id, if any.
+    """
+    point = origin or locations.tracker.position(partner.partner_id) or _to_point(partner.location_lat, partner.location_long)
+    if not point:
+        return _assign_oldest(partner)
+    max_km = _setting("DISPATCH_MAX_PICKUP_KM", 25.0)
+    pending = list(
+        models.Delivery.objects.filter(partner__isnull=True)
+        .exclude(status="delivered")
+        .order_by("created_at")
+        .values_list("delivery_id", "order_id")[:_setting("DISPATCH_BATCH_SIZE", 200)]
+    )
+    pickups = pickup_points({order_id for _, order_id in pending})
+    ranked = []
+    for age, (delivery_id, order_id) in enumerate(pending):
+        pt = pickups.get(order_id)
+        if pt is None:
+            ranked.append((1, age, delivery_id, 0.0, None))
+            continue
+        km = haversine_km(point[0], point[1], pt[0], pt[1])
+        if km <= max_km:
+            ranked.append((0, km, delivery_id, km, pt))
+    ranked.sort()
+
+    with transaction.atomic():
+        if _locked_slots([partner.partner_id])[partner.partner_id] <= 0:
+            return None
+        for _, _, delivery_id, pickup_km, pickup in ranked:
+            d = (
+                models.Delivery.objects.select_for_update(skip_locked=True, of=("self",))
+                .select_related("order")
+                .filter(pk=delivery_id, partner__isnull=True)
+                .exclude(status="delivered")
+                .first()
+            )
+            if d is not None:
+                break
+        else:
+            return None
+        d.partner = partner
+        d.status = "assigned"
+        d.estimated_time = _estimated_minutes(d, pickup_km, pickup)
+        d.save(update_fields=["partner", "status", "estimated_time", "updated_at"])
+    log_event("delivery_auto_assigned", {"delivery_id": d.delivery_id, "partner_id": partner.partner_id, "order_id": d.order_id, "pickup_km": round(pickup_km, 3)})
+    routing.replan_quietly(routing.add_delivery, partner, d.delivery_id, origin=point)
+    events.delivery_changed(d, "delivery.assigned")
+    return d.delivery_id
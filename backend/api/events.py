@@ -0,0 +1,279 @@
+# api/events.py
+"""
+In-process pub/sub for delivery, order and payment status changes.
+
+Views publish small JSON events after their transaction commits; the SSE endpoint
+(``views.event_stream``) subscribes the caller to the channels they may see and
+streams events as they arrive, so clients no longer need to poll
+``agent_deliveries`` / ``list_orders`` / ``admin_list_deliveries`` in a tight loop.
+
+Channels:
+  ``partner:<partner_id>``  deliveries assigned to (or taken from) a partner
+  ``user:<user_id>``        the customer's own orders, deliveries and payments
+  ``admin``                 every delivery change, for the superuser dashboard
+
+``LocalBroker`` only fans out within one process, which is enough for runserver or
+a single gunicorn worker. With ``EVENTS_REDIS_URL`` set, ``RedisBroker`` publishes
+every event to one Redis pub/sub channel (ids come from a Redis counter, so they
+are global) and each process runs a listener thread that hands what it receives
+to its local subscribers, so any worker can serve any stream. A short per-process
+history lets a reconnecting ``EventSource`` replay what it missed via
+``Last-Event-ID``.
+"""
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.renderers import BaseRenderer
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Subscription:
+    """A subscriber's bounded inbox. ``overflowed`` is set when events had to be dropped."""
+
+    def __init__(self, broker: "LocalBroker", channels: Iterable[str], maxsize: int):
+        self.broker = broker
+        self.channels = frozenset(channels)
+        self.queue: "queue.Queue[Dict]" = queue.Queue(maxsize=maxsize)
+        self.overflowed = False
+
+    def get(self, timeout: float) -> Optional[Dict]:
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    def __init__(self, history: int = 500, inbox_size: int = 100):
+        self._lock = threading.Lock()
+        self._subs: Dict[str, set] = {}
+        self._ids = itertools.count(1)
+        self._history: deque = deque(maxlen=history)
+        self.inbox_size = inbox_size
+
+    def subscribe(self, channels: Iterable[str], last_event_id: Optional[int] = None) -> Subscription:
+        sub = Subscription(self, channels, self.inbox_size)
+        with self._lock:
+            for ch in sub.channels:
+                self._subs.setdefault(ch, set()).add(sub)
+            if last_event_id is not None:
+                for ev in self._history:
+                    if ev["id"] > last_event_id and ev["channels"] & sub.channels:
+                        self._offer(sub, ev)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            for ch in sub.channels:
+                subs = self._subs.get(ch)
+                if subs:
+                    subs.discard(sub)
+                    if not subs:
+                        del self._subs[ch]
+
+    def publish(self, channels: Iterable[str], event_type: str, data: Dict) -> int:
+        with self._lock:
+            event_id = next(self._ids)
+        self._deliver(event_id, event_type, data, channels)
+        return event_id
+
+    def _deliver(self, event_id: int, event_type: str, data: Dict, channels: Iterable[str]):
+        channels = frozenset(c for c in channels if c)
+        with self._lock:
+            ev = {"id": event_id, "event": event_type, "data": data, "channels": channels}
+            self._history.append(ev)
+            targets = set()
+            for ch in channels:
+                targets |= self._subs.get(ch, set())
+            for sub in targets:
+                self._offer(sub, ev)
+
+    @staticmethod
+    def _offer(sub: Subscription, ev: Dict):
+        # never block a publisher on a slow reader: mark it so the stream closes and the
+        # client reconnects with Last-Event-ID to replay from history
+        try:
+            sub.queue.put_nowait(ev)
+        except queue.Full:
+            sub.overflowed = True
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len({s for subs in self._subs.values() for s in subs})
+
+
+class RedisBroker(LocalBroker):
+    """``LocalBroker`` whose events travel through Redis pub/sub, so every process sees all of them."""
+
+    def __init__(self, url: str, channel: str = "savr:events", **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.channel = channel
+        self._client = None
+        self._listener = None
+
+    def client(self):
+        if self._client is None:
+            import redis  # only needed when EVENTS_REDIS_URL is set
+            self._client = redis.Redis.from_url(self.url)
+        return self._client
+
+    def publish(self, channels: Iterable[str], event_type: str, data: Dict) -> int:
+        client = self.client()
+        event_id = client.incr(f"{self.channel}:id")
+        client.publish(self.channel, json.dumps({
+            "id": event_id, "event": event_type, "data": data, "channels": sorted(c for c in channels if c),
+        }))
+        return event_id
+
+    def subscribe(self, channels: Iterable[str], last_event_id: Optional[int] = None) -> Subscription:
+        self.start()
+        return super().subscribe(channels, last_event_id)
+
+    def start(self):
+        """Start the listener thread (idempotent); wsgi.py calls this so history fills from startup."""
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            self._listener = threading.Thread(target=self._listen, name="events-redis-listener", daemon=True)
+            self._listener.start()
+
+    def receive(self, raw):
+        ev = json.loads(raw)
+        self._deliver(int(ev["id"]), ev["event"], ev["data"], ev["channels"])
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client().pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for message in pubsub.listen():
+                    if message.get("type") == "message":
+                        self.receive(message["data"])
+            except Exception as e:
+                print(f"[events] redis listener failed, reconnecting: {e}")
+                time.sleep(1.0)
+
+
+def _make_broker() -> LocalBroker:
+    options = dict(history=_setting("EVENTS_HISTORY_SIZE", 500), inbox_size=_setting("EVENTS_SUBSCRIBER_QUEUE", 100))
+    url = _setting("EVENTS_REDIS_URL", "")
+    return RedisBroker(url, **options) if url else LocalBroker(**options)
+
+
+broker = _make_broker()
+
+
+def warm():
+    """Start listening for events at startup when they come through Redis (called from wsgi.py)."""
+    if isinstance(broker, RedisBroker) and _setting("EVENTS_STREAMING", False):
+        broker.start()
+
+
+def channels_for(principal) -> List[str]:
+    """Channels an authenticated user / partner / agent is allowed to listen on."""
+    if getattr(principal, "is_partner", False):
+        return [f"partner:{principal.partner_id}"]
+    if getattr(principal, "is_agent", False):
+        return [f"partner:{principal.partner_id}"] if getattr(principal, "partner_id", None) else []
+    out = [f"user:{principal.user_id}"] if getattr(principal, "user_id", None) else []
+    if getattr(principal, "is_superuser", False):
+        out.append("admin")
+    return out
+
+
+def publish(channels: Iterable[str], event_type: str, data: Dict):
+    """Publish once the surrounding transaction (if any) commits, so listeners never see rolled-back state."""
+    channels = list(channels)
+    data = dict(data, at=timezone.now().isoformat())
+
+    def _send():
+        try:
+            broker.publish(channels, event_type, data)
+        except Exception as e:
+            print(f"[events] publish {event_type} failed: {e}")
+
+    transaction.on_commit(_send)
+
+
+def delivery_changed(delivery, event_type: str = "delivery.updated", previous_partner_id: Optional[int] = None):
+    order = delivery.order if delivery.order_id else None
+    channels = ["admin"]
+    if delivery.partner_id:
+        channels.append(f"partner:{delivery.partner_id}")
+    if previous_partner_id and previous_partner_id != delivery.partner_id:
+        channels.append(f"partner:{previous_partner_id}")
+    if order is not None:
+        channels.append(f"user:{order.user_id}")
+    publish(channels, event_type, {
+        "delivery_id": delivery.delivery_id,
+        "order_id": delivery.order_id,
+        "partner_id": delivery.partner_id,
+        "status": delivery.status,
+        "order_status": getattr(order, "status", None),
+        "estimated_time": delivery.estimated_time,
+    })
+
+
+def order_changed(order, event_type: str = "order.updated"):
+    publish(["admin", f"user:{order.user_id}"], event_type, {"order_id": order.order_id, "status": order.status})
+
+
+def payment_changed(payment, event_type: str = "payment.updated"):
+    # payments only reach a customer through the order they pay for
+    if not payment.order_id:
+        return
+    publish([f"user:{payment.order.user_id}"], event_type, {
+        "payment_id": payment.payment_id,
+        "order_id": payment.order_id,
+        "status": payment.status,
+    })
+
+
+def format_sse(ev: Dict) -> str:
+    return f"id: {ev['id']}\nevent: {ev['event']}\ndata: {json.dumps(ev['data'], default=str)}\n\n"
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets DRF content negotiation accept ``Accept: text/event-stream`` (errors still render as JSON text)."""
+    media_type = "text/event-stream"
+    format = "sse"
+    charset = "utf-8"
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, default=str).encode()
+
+
+def stream(sub: Subscription, heartbeat: float, max_seconds: float):
+    """
+    Yield SSE frames for ``sub`` until ``max_seconds`` pass (the client reconnects; this keeps
+    a worker thread from being held forever) or the subscriber falls behind. Only served
+    when ``EVENTS_STREAMING`` is on (a gthread/gevent worker, see Procfile).
+    """
+    deadline = time.monotonic() + max_seconds
+    try:
+        yield f"retry: {int(_setting('EVENTS_RETRY_MS', 3000))}\n\n"
+        while not sub.overflowed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            ev = sub.get(timeout=min(heartbeat, remaining))
+            yield format_sse(ev) if ev else ": keepalive\n\n"
+    finally:
+        sub.close()
@@ -0,0 +1,136 @@
+# api/geo.py
+"""
+Distance helpers and a small in-memory spatial index.
+
+``distance_km_between`` (geodesic, exact) is what pricing uses;
+``haversine_km`` is the cheap great-circle kernel used when many pairs have
+to be scored at once (dispatch, routing). At city scale the two agree to
+well under 0.5%.
+"""
+import math
+from collections import defaultdict
+from typing import Container, Dict, Hashable, List, Optional, Tuple
+
+from geopy.distance import geodesic
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = 111.2
+
+
+def distance_km_between(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    return geodesic((lat1, lon1), (lat2, lon2)).km
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def eta_minutes_from_distance(distance_km: float) -> int:
+    """Very simple ETA: 20 km/h average → 3 min/km."""
+    return int(math.ceil((distance_km / 20.0) * 60.0))
+
+
+class GridIndex:
+    """
+    Uniform lat/long grid for k-nearest lookups over moving points (partners, pickups).
+
+    ``upsert``/``remove`` are O(1); ``nearest`` scans rings of cells outward from the
+    query point and stops once no unvisited ring can beat the current k-th best.
+    """
+
+    MAX_RINGS = 200  # beyond this, scanning everything is cheaper than more rings
+
+    def __init__(self, cell_km: float = 2.0):
+        self.cell_km = cell_km
+        self.cell_deg = cell_km / KM_PER_DEG_LAT
+        self._cells: Dict[Tuple[int, int], Dict[Hashable, Tuple[float, float]]] = defaultdict(dict)
+        self._where: Dict[Hashable, Tuple[int, int]] = {}
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def upsert(self, key: Hashable, lat: float, lon: float) -> None:
+        cell = self._cell(lat, lon)
+        old = self._where.get(key)
+        if old is not None and old != cell:
+            self._cells[old].pop(key, None)
+            if not self._cells[old]:
+                del self._cells[old]
+        self._cells[cell][key] = (lat, lon)
+        self._where[key] = cell
+
+    def remove(self, key: Hashable) -> None:
+        cell = self._where.pop(key, None)
+        if cell is None:
+            return
+        self._cells[cell].pop(key, None)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def position(self, key: Hashable) -> Optional[Tuple[float, float]]:
+        cell = self._where.get(key)
+        return self._cells[cell][key] if cell is not None else None
+
+    def items(self):
+        for bucket in self._cells.values():
+            yield from bucket.items()
+
+    def nearest(self, lat: float, lon: float, k: int = 5, max_km: Optional[float] = None,
+                keys: Optional[Container] = None) -> List[Tuple[float, Hashable]]:
+        """Return up to ``k`` ``(distance_km, key)`` pairs sorted by distance, only among ``keys`` if given."""
+        if not self._where:
+            return []
+        cx, cy = self._cell(lat, lon)
+        # longitude cells shrink with cos(lat); use it for a conservative ring lower bound
+        ring_km = self.cell_km * max(math.cos(math.radians(lat)), 0.01)
+        found: List[Tuple[float, Hashable]] = []
+        seen = 0
+        r = 0
+        while True:
+            if r > self.MAX_RINGS:
+                found = [(haversine_km(lat, lon, plat, plon), key) for key, (plat, plon) in self.items()
+                         if keys is None or key in keys]
+                break
+            for cell in self._ring(cx, cy, r):
+                bucket = self._cells.get(cell)
+                if not bucket:
+                    continue
+                for key, (plat, plon) in bucket.items():
+                    seen += 1
+                    if keys is None or key in keys:
+                        found.append((haversine_km(lat, lon, plat, plon), key))
+            # anything in ring r+1 is at least r * ring_km away
+            bound = r * ring_km
+            if seen >= len(self._where):
+                break
+            if max_km is not None and bound > max_km:
+                break
+            if len(found) >= k and sorted(f[0] for f in found)[k - 1] <= bound:
+                break
+            r += 1
+        if max_km is not None:
+            found = [f for f in found if f[0] <= max_km]
+        found.sort(key=lambda f: f[0])
+        return found[:k]
+
+    @staticmethod
+    def _ring(cx: int, cy: int, r: int):
+        if r == 0:
+            yield (cx, cy)
+            return
+        for dx in range(-r, r + 1):
+            yield (cx + dx, cy - r)
+            yield (cx + dx, cy + r)
+        for dy in range(-r + 1, r):
+            yield (cx - r, cy + dy)
+            yield (cx + r, cy + dy)
@@ -0,0 +1,125 @@
+# api/inventory.py
+"""
+Bulk stock updates for mart admins (``POST /admin/products/stock/bulk/``).
+
+A request carries up to ``STOCK_BULK_MAX_ROWS`` rows of ``{"product_id", "stock"}``
+(absolute) or ``{"product_id", "delta"}`` (relative). Rows for the same product
+fold together in order. Each batch of ``STOCK_BULK_BATCH_SIZE`` products is
+processed in one transaction:
+
+  1. one ``SELECT ... FOR UPDATE`` for the batch's products, in primary-key order
+  2. ownership checked against the caller's managed mart ids (a set, loaded once)
+  3. new stock computed (deltas apply to the locked value; never below zero)
+  4. one ``bulk_update`` of ``stock`` / ``updated_at``
+
+``bulk_update`` skips model signals, so the image-fetching ``pre_save`` hook never
+runs; the optimize cache and catalog snapshot are notified explicitly. Every
+product gets a result row: updated, not_found, forbidden, invalid or rejected.
+"""
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import catalog, models, optimize_cache
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def managed_mart_ids(user) -> Optional[Set[int]]:
+    """Mart ids ``user`` may manage; None means every mart (superuser)."""
+    if getattr(user, "is_superuser", False):
+        return None
+    # resolved once at authentication (CustomTokenAuthentication)
+    principal = getattr(user, "admin_principal", None)
+    return set(principal.mart_ids) if principal else set()
+
+
+def _integer(value) -> int:
+    """``value`` as an int; only ints and integer strings ("12", "-3") count, never bools or floats."""
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str) and value.strip().lstrip("+-").isdigit():
+        return int(value)
+    raise ValueError
+
+
+def _fold(rows: List[Dict]) -> Tuple[Dict[int, Dict], List[Dict]]:
+    """{product_id: {"index", "set", "delta"}} in first-seen order, plus results for malformed rows."""
+    plan: Dict[int, Dict] = {}
+    invalid = []
+    for i, row in enumerate(rows):
+        pid = row.get("product_id") if isinstance(row, dict) else None
+        try:
+            if pid is None:
+                raise ValueError("product_id required")
+            try:
+                pid = _integer(pid)
+                stock = _integer(row["stock"]) if row.get("stock") is not None else None
+                delta = _integer(row["delta"]) if row.get("delta") is not None else None
+            except (TypeError, ValueError):
+                raise ValueError("product_id, stock and delta must be integers")
+            if stock is None and delta is None:
+                raise ValueError("stock or delta required")
+            if stock is not None and stock < 0:
+                raise ValueError("stock must be >= 0")
+        except ValueError as e:
+            invalid.append({"index": i, "product_id": pid, "status": "invalid", "error": str(e)})
+            continue
+        entry = plan.setdefault(pid, {"index": i, "set": None, "delta": 0})
+        if stock is not None:
+            entry["set"], entry["delta"] = stock, 0
+        else:
+            entry["delta"] += delta
+    return plan, invalid
+
+
+def apply_stock_updates(rows: List[Dict], mart_ids: Optional[Set[int]]) -> Dict:
+    plan, results = _fold(rows)
+    batch_size = _setting("STOCK_BULK_BATCH_SIZE", 500)
+    pids = list(plan)
+
+    for start in range(0, len(pids), batch_size):
+        chunk = pids[start:start + batch_size]
+        now = timezone.now()
+        with transaction.atomic():
+            current = {
+                pid: (mart_id, stock, name)
+                # pk order: concurrent batches lock overlapping products in the same order (no deadlocks)
+                for pid, mart_id, stock, name in models.Product.objects.select_for_update()
+                .filter(pk__in=chunk).order_by("pk").values_list("product_id", "mart_id", "stock", "name")
+            }
+            changed = []
+            for pid in chunk:
+                entry = plan[pid]
+                result = {"index": entry["index"], "product_id": pid}
+                results.append(result)
+                if pid not in current:
+                    result["status"] = "not_found"
+                    continue
+                mart_id, stock, name = current[pid]
+                if mart_ids is not None and mart_id not in mart_ids:
+                    result["status"] = "forbidden"
+                    continue
+                new_stock = (entry["set"] if entry["set"] is not None else stock) + entry["delta"]
+                if new_stock < 0:
+                    result.update(status="rejected", error="stock would go below zero", stock=stock)
+                    continue
+                result.update(status="updated", stock=new_stock, previous=stock)
+                if new_stock != stock:
+                    changed.append(models.Product(product_id=pid, name=name, stock=new_stock, updated_at=now))
+            if changed:
+                models.Product.objects.bulk_update(changed, ["stock", "updated_at"])
+        if changed:
+            # names too: a product coming back in stock is a new swap candidate
+            optimize_cache.bump_products([p.product_id for p in changed], [p.name for p in changed])
+            catalog.snapshot.mark_dirty()
+
+    results.sort(key=lambda r: r["index"])
+    updated = sum(1 for r in results if r["status"] == "updated")
+    return {"updated": updated, "failed": len(results) - updated, "results": results}
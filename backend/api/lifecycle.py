@@ -0,0 +1,139 @@
+# api/lifecycle.py
+"""
+Order lifecycle transitions that fan out into other tables.
+
+``confirm_orders`` is the single place an Order becomes ``confirmed``: it flips the
+status and creates the matching ``Delivery`` rows (unassigned, with an
+``estimated_time`` for the mart → customer leg) for the whole batch in one
+transaction, then hands just those new deliveries to the dispatcher once that
+transaction has committed (the backlog is drained by ``manage.py
+dispatch_deliveries``). Newly confirmed orders are added to the sales rollups
+(``rollups.record_transition``) inside the same transaction.
+
+``mark_delivered`` is the matching place for the end of the road: views never
+write ``Order.status`` themselves, so the rollups can't drift from ``rebuild``.
+"""
+from collections import defaultdict
+from typing import Iterable, List
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import dispatch, events, models, rollups
+from .geo import haversine_km, eta_minutes_from_distance
+
+# orders in these states are past the point where a delivery should be created
+CLOSED_STATUSES = ("shipped", "delivered", "cancelled")
+
+
+def _dispatch_quietly(order_ids: List[int]):
+    try:
+        dispatch.dispatch_pending(order_ids=order_ids)
+    except Exception as e:
+        print(f"[lifecycle] dispatch after confirm failed: {e}")
+
+
+def create_deliveries(orders: Iterable[models.Order]) -> List[models.Delivery]:
+    """bulk_create one unassigned Delivery per order that doesn't have one yet."""
+    orders = list(orders)
+    if not orders:
+        return []
+    ids = [o.order_id for o in orders]
+    existing = set(models.Delivery.objects.filter(order_id__in=ids).values_list("order_id", flat=True))
+    pickups = dispatch.pickup_points(ids)
+
+    new = []
+    for o in orders:
+        if o.order_id in existing:
+            continue
+        estimated = None
+        pickup = pickups.get(o.order_id)
+        if pickup and o.delivery_address_lat is not None and o.delivery_address_long is not None:
+            km = haversine_km(pickup[0], pickup[1], float(o.delivery_address_lat), float(o.delivery_address_long))
+            estimated = eta_minutes_from_distance(km)
+        new.append(models.Delivery(order=o, partner=None, status="assigned", estimated_time=estimated))
+    if new:
+        models.Delivery.objects.bulk_create(new)
+    return new
+
+
+def confirm_orders(order_ids: Iterable[int]) -> List[int]:
+    """
+    Mark the given orders confirmed and create their deliveries, all in one transaction.
+    Safe to call repeatedly (e.g. verify + webhook for the same payment): orders that are
+    already confirmed only get a delivery if they are missing one. Returns the ids of
+    orders that received a new Delivery.
+    """
+    ids = sorted({int(i) for i in order_ids if i})
+    if not ids:
+        return []
+    with transaction.atomic():
+        # lock the orders so concurrent confirmations can't create duplicate deliveries
+        orders = list(
+            models.Order.objects.select_for_update()
+            .filter(order_id__in=ids)
+            .exclude(status__in=CLOSED_STATUSES)
+        )
+        pending = [o.order_id for o in orders if o.status == "pending"]
+        if pending:
+            models.Order.objects.filter(order_id__in=pending).update(status="confirmed", updated_at=timezone.now())
+            rollups.record_transition(pending, "pending", "confirmed")
+            for o in orders:
+                if o.status == "pending":
+                    o.status = "confirmed"
+                    events.order_changed(o, "order.confirmed")
+        created = create_deliveries(orders)
+        if created and getattr(settings, "DISPATCH_ON_CONFIRM", True):
+            created_ids = [d.order_id for d in created]
+            transaction.on_commit(lambda: _dispatch_quietly(created_ids))
+    return [d.order_id for d in created]
+
+
+def mark_delivered(order_ids: Iterable[int]) -> List[int]:
+    """
+    Move orders to ``delivered`` from whatever state they are in (agent hand-off, admin repair),
+    adding the ones that weren't counted yet to the sales rollups in the same transaction.
+    Returns the ids whose status changed.
+    """
+    ids = sorted({int(i) for i in order_ids if i})
+    if not ids:
+        return []
+    with transaction.atomic():
+        orders = list(
+            models.Order.objects.select_for_update()
+            .filter(order_id__in=ids).exclude(status="delivered").order_by("pk")
+        )
+        by_status = defaultdict(list)
+        for o in orders:
+            by_status[o.status].append(o.order_id)
+        if orders:
+            models.Order.objects.filter(order_id__in=[o.order_id for o in orders]).update(status="delivered", updated_at=timezone.now())
+        for old_status, changed in by_status.items():
+            rollups.record_transition(changed, old_status, "delivered")
+    return [o.order_id for o in orders]
+
+
+def order_ids_for_payments(payments: Iterable[models.Payment]) -> List[int]:
+    """Orders a payment pays for: its own ``order`` plus every order of a multi-mart checkout."""
+    payments = list(payments)
+    ids = {p.order_id for p in payments if p.order_id}
+    if payments:
+        ids.update(
+            models.Order.objects.filter(checkout_payment__in=[p.payment_id for p in payments])
+            .values_list("order_id", flat=True)
+        )
+    return sorted(ids)
+
+
+def confirm_orders_for_payments(payments: Iterable[models.Payment], reopen_cancelled: bool = False) -> List[int]:
+    """
+    Confirm the orders linked to successful payments. Pass ``reopen_cancelled`` when the
+    payments were ``failed`` before this capture: reconciliation cancelled their pending
+    orders then, and a late capture means the customer paid for them after all.
+    """
+    ids = order_ids_for_payments(p for p in payments if p.status == "success")
+    with transaction.atomic():
+        if reopen_cancelled and ids:
+            models.Order.objects.filter(order_id__in=ids, status="cancelled").update(status="pending", updated_at=timezone.now())
+        return confirm_orders(ids)
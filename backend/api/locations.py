@@ -0,0 +1,154 @@
+# api/locations.py
+"""
+Live partner positions with coalesced writes.
+
+Partners ping ``POST /partners/location/`` every few seconds. Each ping only updates
+an in-memory map (latest position per partner) and the live ``GridIndex``; the
+database is written by a background thread every ``LOCATION_FLUSH_INTERVAL``
+seconds, one ``bulk_update`` per ``LOCATION_FLUSH_BATCH_SIZE`` partners, and only
+for partners that moved since the last flush. However often a partner pings, they
+cost at most one row write per interval.
+
+Dispatch queries the live index directly (``nearest()``) for partners with a fresh
+ping and only indexes the rest (``DeliveryPartner.location_lat/long``) per batch;
+route planning reads ``position()`` the same way.
+
+With ``LOCATION_BUFFERED = False`` (the default under tests) every ping is written
+through immediately.
+"""
+import atexit
+import threading
+import time
+from decimal import Decimal
+from typing import Container, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from . import models
+from .geo import GridIndex
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _coord(value: float) -> Decimal:
+    # location_lat/long are DecimalField(decimal_places=6)
+    return Decimal(str(round(value, 6)))
+
+
+class LocationTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latest: Dict[int, Tuple[float, float, float, object]] = {}  # pid -> (lat, lon, monotonic, aware dt)
+        self._dirty = set()
+        self._index = GridIndex(cell_km=_setting("DISPATCH_GRID_CELL_KM", 2.0))
+        self._wake = threading.Event()
+        self._thread = None
+
+    # ---------- public API ----------
+    def ping(self, partner_id: int, lat: float, lon: float):
+        with self._lock:
+            self._latest[partner_id] = (lat, lon, time.monotonic(), timezone.now())
+            self._index.upsert(partner_id, lat, lon)
+            self._dirty.add(partner_id)
+
+        if not _setting("LOCATION_BUFFERED", True):
+            self.flush()
+        elif _setting("LOCATION_FLUSH_INTERVAL", 5.0) > 0:
+            self._ensure_worker()
+
+    def position(self, partner_id: int) -> Optional[Tuple[float, float]]:
+        with self._lock:
+            entry = self._latest.get(partner_id)
+        if entry is None or self._stale(entry):
+            return None
+        return entry[0], entry[1]
+
+    def positions(self) -> Dict[int, Tuple[float, float]]:
+        """Fresh positions of every partner this process has heard from."""
+        with self._lock:
+            items = list(self._latest.items())
+        return {pid: (e[0], e[1]) for pid, e in items if not self._stale(e)}
+
+    def nearest(self, lat: float, lon: float, k: int = 5, max_km: Optional[float] = None,
+                partner_ids: Optional[Container] = None) -> List[Tuple[float, int]]:
+        """[(km, partner_id)] of the nearest partners with a fresh position (among ``partner_ids`` if given)."""
+        with self._lock:
+            while True:
+                found = self._index.nearest(lat, lon, k=k, max_km=max_km, keys=partner_ids)
+                stale = [pid for _, pid in found if self._stale(self._latest[pid])]
+                if not stale:
+                    return found
+                # partners that went quiet leave the index until their next ping
+                for pid in stale:
+                    self._index.remove(pid)
+
+    def forget(self, partner_id: int):
+        with self._lock:
+            self._latest.pop(partner_id, None)
+            self._dirty.discard(partner_id)
+            self._index.remove(partner_id)
+
+    def flush(self) -> int:
+        """Write the latest position of every partner that moved since the last flush. Returns rows written."""
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            rows = [(pid, self._latest[pid]) for pid in dirty if pid in self._latest]
+        if not rows:
+            return 0
+        objs = [
+            models.DeliveryPartner(partner_id=pid, location_lat=_coord(e[0]), location_long=_coord(e[1]), location_updated_at=e[3])
+            for pid, e in rows
+        ]
+        try:
+            models.DeliveryPartner.objects.bulk_update(
+                objs, ["location_lat", "location_long", "location_updated_at"],
+                batch_size=_setting("LOCATION_FLUSH_BATCH_SIZE", 500),
+            )
+            return len(objs)
+        except Exception as e:
+            print(f"[locations] failed to write {len(objs)} partner positions: {e}")
+            with self._lock:
+                # retry on the next flush unless a newer ping already re-marked them
+                self._dirty.update(pid for pid, _ in rows)
+            return 0
+
+    def pending(self) -> int:
+        return len(self._dirty)
+
+    # ---------- internals ----------
+    @staticmethod
+    def _stale(entry) -> bool:
+        max_age = _setting("LOCATION_STALE_SECONDS", 300)
+        return max_age > 0 and time.monotonic() - entry[2] > max_age
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="partner-location-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=_setting("LOCATION_FLUSH_INTERVAL", 5.0))
+            self._wake.clear()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
+
+
+tracker = LocationTracker()
+
+
+def flush():
+    return tracker.flush()
+
+
+atexit.register(flush)
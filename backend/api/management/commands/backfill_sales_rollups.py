@@ -0,0 +1,38 @@
+# api/management/commands/backfill_sales_rollups.py
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max, Min
+from django.utils import timezone
+
+from api import models, rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-mart / per-day sales rollups from orders and order_items."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="day_from", default=None, help="First day (YYYY-MM-DD); default: first order")
+        parser.add_argument("--to", dest="day_to", default=None, help="Last day (YYYY-MM-DD); default: today")
+
+    def handle(self, *args, **opts):
+        try:
+            day_from = date.fromisoformat(opts["day_from"]) if opts["day_from"] else None
+            day_to = date.fromisoformat(opts["day_to"]) if opts["day_to"] else timezone.localdate()
+        except ValueError:
+            raise CommandError("--from / --to must be YYYY-MM-DD")
+        if day_from is None:
+            bounds = models.Order.objects.aggregate(first=Min("created_at"), last=Max("created_at"))
+            if bounds["first"] is None:
+                self.stdout.write("No orders; nothing to backfill.")
+                return
+            day_from = timezone.localdate(bounds["first"])
+        if day_from > day_to:
+            raise CommandError("--from must not be after --to")
+
+        self.stdout.write(self.style.NOTICE(f"Rebuilding sales rollups {day_from} .. {day_to}"))
+        days = rollups.rebuild(day_from, day_to)
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Rebuilt {days} day(s): {models.MartDailySales.objects.filter(day__gte=day_from, day__lte=day_to).count()} mart rows, "
+            f"{models.ProductDailySales.objects.filter(day__gte=day_from, day__lte=day_to).count()} product rows"
+        ))
@@ -0,0 +1,29 @@
+# api/management/commands/create_pending_deliveries.py
+from django.core.management.base import BaseCommand
+
+from api import lifecycle
+from api.models import Delivery, Order
+
+
+class Command(BaseCommand):
+    help = "Create Delivery rows for confirmed orders that don't have one yet (backfill), in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=500, help="Orders per transaction")
+
+    def handle(self, *args, **opts):
+        batch_size = opts["batch"]
+        total = 0
+        last_id = 0
+        while True:
+            ids = list(
+                Order.objects.filter(status="confirmed", order_id__gt=last_id)
+                .exclude(order_id__in=Delivery.objects.values("order_id"))
+                .order_by("order_id")
+                .values_list("order_id", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            total += len(lifecycle.confirm_orders(ids))
+            last_id = ids[-1]
+        self.stdout.write(self.style.SUCCESS(f"created {total} deliveries"))
@@ -0,0 +1,29 @@
+# api/management/commands/dispatch_deliveries.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import dispatch
+
+
+class Command(BaseCommand):
+    help = "Assign pending deliveries to the nearest available partners in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=None, help="Pending deliveries per batch (default DISPATCH_BATCH_SIZE)")
+        parser.add_argument("--loop", action="store_true", help="Keep dispatching every --interval seconds")
+        parser.add_argument("--interval", type=float, default=10.0, help="Seconds between batches with --loop")
+
+    def handle(self, *args, **opts):
+        while True:
+            total = 0
+            # drain: keep running batches while each one makes progress
+            while True:
+                assigned = dispatch.dispatch_pending(limit=opts["batch"])
+                total += len(assigned)
+                if not assigned:
+                    break
+            self.stdout.write(f"dispatched {total} deliveries")
+            if not opts["loop"]:
+                return
+            time.sleep(opts["interval"])
@@ -0,0 +1,65 @@
+# api/management/commands/import_products_csv.py
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import models, product_import
+
+
+class Command(BaseCommand):
+    help = "Stream a products CSV into the products table in batches (constant memory, resumable)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--csv", required=True, help="Path to products.csv")
+        parser.add_argument("--batch", type=int, default=1000, help="Rows per bulk_create / transaction")
+        parser.add_argument("--use-csv-ids", action="store_true", help="Use product_id from CSV (danger of collisions)")
+        parser.add_argument("--checkpoint", default=None, help="Checkpoint name in import_checkpoints (default: the CSV's absolute path)")
+        parser.add_argument("--resume", action="store_true", help="Continue after the last committed batch in --checkpoint")
+        parser.add_argument("--truncate", action="store_true", help="Empty products table before import (not with --resume)")
+        parser.add_argument("--progress-every", type=float, default=5.0, help="Seconds between progress lines")
+        parser.add_argument("--max-warnings", type=int, default=50, help="Skipped-row messages to print")
+
+    def handle(self, *args, **opts):
+        if opts["truncate"] and opts["resume"]:
+            raise CommandError("--truncate and --resume can't be combined")
+        checkpoint = opts["checkpoint"] or os.path.abspath(opts["csv"])
+
+        if opts["truncate"]:
+            models.Product.objects.all().delete()
+            self.stdout.write(self.style.WARNING("Cleared products table."))
+
+        last_report = [time.monotonic()]
+        warnings = [0]
+
+        def progress(p):
+            now = time.monotonic()
+            if now - last_report[0] >= opts["progress_every"]:
+                last_report[0] = now
+                self.stdout.write(f"row {p['row']}: created={p['created']} skipped={p['skipped']} ({p['rate']} rows/s)")
+
+        def warn(msg):
+            warnings[0] += 1
+            if warnings[0] <= opts["max_warnings"]:
+                self.stdout.write(self.style.WARNING(msg))
+
+        self.stdout.write(self.style.NOTICE(f"Importing from: {opts['csv']}"))
+        try:
+            result = product_import.import_csv(
+                opts["csv"], batch_size=opts["batch"], use_csv_ids=opts["use_csv_ids"],
+                checkpoint=checkpoint, resume=opts["resume"], progress=progress, warn=warn,
+            )
+        except product_import.CatalogImportError as e:
+            raise CommandError(str(e))
+
+        rate = round(result["rows"] / result["seconds"], 1) if result["seconds"] else result["rows"]
+        self.stdout.write(self.style.SUCCESS(
+            f"✅ Import done. rows_read={result['rows']} (resumed after {result['resumed_from']}), "
+            f"created={result['created']}, skipped={result['skipped']} in {result['seconds']}s ({rate} rows/s)"
+        ))
+        if warnings[0] > opts["max_warnings"]:
+            self.stdout.write(self.style.WARNING(f"... {warnings[0] - opts['max_warnings']} more skipped rows not shown"))
+        if result["missing_marts"]:
+            self.stdout.write(self.style.WARNING(
+                f"⚠ missing mart_ids (not found in DB): {result['missing_marts']}"
+            ))
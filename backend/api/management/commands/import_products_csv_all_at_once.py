@@ -1,40 +1,10 @@
-# api/management/commands/import_products_csv.py
+# api/management/commands/import_products_csv_all_at_once.py
 import csv
 from decimal import Decimal
 from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from api.models import Mart, Product
-
-def map_category(raw):
-    # allowed: 'grocery','clothing','essential','other','dairy'
-    if not raw:
-        return "grocery"
-    r = str(raw).strip().lower()
-    if r in {"grocery","clothing","essential","other","dairy"}:
-        return r
-    if any(k in r for k in ["milk","dairy","curd","paneer","ghee"]):
-        return "dairy"
-    if any(k in r for k in ["soap","detergent","home","clean","wash","hygiene"]):
-        return "essential"
-    if any(k in r for k in ["cloth","apparel","tshirt","shirt","jeans"]):
-        return "clothing"
-    if any(k in r for k in ["snack","biscuit","noodle","maggi","bread","chips"]):
-        return "grocery"
-    if any(k in r for k in ["rice","atta","flour","wheat","dal","lentil","pulse","oil","sugar","salt","grain","cereal","spice"]):
-        return "grocery"
-    return "other"
-
-def parse_decimal(x, default="0.00"):
-    try:
-        return Decimal(str(x)).quantize(Decimal("0.01"))
-    except Exception:
-        return Decimal(default)
-
-def parse_int(x, default=0):
-    try:
-        return int(str(x).strip())
-    except Exception:
-        return int(default)
+from api.product_import import map_category, parse_decimal, parse_int
 
 def chunked(iterable, size):
     buf = []
@@ -47,7 +17,7 @@ def chunked(iterable, size):
         yield buf
 
 class Command(BaseCommand):
-    help = "Import products from CSV into the products table (bulk, single transaction)."
+    help = "Import products from CSV into the products table (bulk, single transaction). See import_products_csv for large files."
 
     def add_arguments(self, parser):
         parser.add_argument("--csv", required=True, help="Path to products.csv")
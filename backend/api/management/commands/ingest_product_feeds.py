@@ -0,0 +1,58 @@
+# api/management/commands/ingest_product_feeds.py
+import glob
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import product_import
+
+
+class Command(BaseCommand):
+    help = ("Ingest many price/stock feed CSVs at once: parse in a process pool, then sync each mart's "
+            "merged rows with its own writer. Same matching rules as sync_products_csv.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="Feed files, directories (*.csv inside) or glob patterns")
+        parser.add_argument("--workers", type=int, default=None, help="Parser processes (default: CPU count)")
+        parser.add_argument("--writers", type=int, default=4, help="Concurrent per-mart writers")
+        parser.add_argument("--batch", type=int, default=1000, help="Changed rows per transaction")
+        parser.add_argument("--deactivate-missing", action="store_true",
+                            help="Mark products of the fed marts that no file lists inactive")
+        parser.add_argument("--dry-run", action="store_true", help="Report the diff without writing")
+        parser.add_argument("--max-warnings", type=int, default=50, help="Skipped-row messages to print")
+
+    def handle(self, *args, **opts):
+        paths = []
+        for arg in opts["paths"]:
+            if os.path.isdir(arg):
+                paths.extend(glob.glob(os.path.join(arg, "*.csv")))
+            elif glob.has_magic(arg):
+                paths.extend(glob.glob(arg))
+            else:
+                paths.append(arg)
+        # later files win on conflicting fields, so the order has to be stable
+        paths = sorted(set(paths))
+        if not paths:
+            raise CommandError("no feed files found")
+
+        warnings = [0]
+
+        def warn(msg):
+            warnings[0] += 1
+            if warnings[0] <= opts["max_warnings"]:
+                self.stdout.write(self.style.WARNING(msg))
+
+        self.stdout.write(self.style.NOTICE(f"Ingesting {len(paths)} feed files"))
+        result = product_import.ingest_feeds(
+            paths, workers=opts["workers"], writers=opts["writers"], batch_size=opts["batch"],
+            deactivate_missing=opts["deactivate_missing"], dry_run=opts["dry_run"], warn=warn,
+        )
+        rate = round(result["rows"] / result["seconds"], 1) if result["seconds"] else result["rows"]
+        prefix = "[dry run] " if opts["dry_run"] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Ingested {result['rows']} rows from {result['files']} files into {len(result['marts'])} marts "
+            f"in {result['seconds']}s ({rate} rows/s): inserted={result['inserted']} updated={result['updated']} "
+            f"unchanged={result['unchanged']} deactivated={result['deactivated']} skipped={result['skipped']}"
+        ))
+        if warnings[0] > opts["max_warnings"]:
+            self.stdout.write(self.style.WARNING(f"... {warnings[0] - opts['max_warnings']} more warnings not shown"))
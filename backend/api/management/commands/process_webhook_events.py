@@ -0,0 +1,21 @@
+# api/management/commands/process_webhook_events.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import webhooks
+
+
+class Command(BaseCommand):
+    help = "Apply stored payment webhook events (use when WEBHOOK_ASYNC is off or to retry failures)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--loop", action="store_true", help="Keep processing every --interval seconds")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds between drains with --loop")
+
+    def handle(self, *args, **opts):
+        while True:
+            self.stdout.write(f"processed {webhooks.drain()} webhook events")
+            if not opts["loop"]:
+                return
+            time.sleep(opts["interval"])
@@ -0,0 +1,27 @@
+# api/management/commands/reconcile_payments.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import reconciliation
+
+
+class Command(BaseCommand):
+    help = "Resolve stale pending Razorpay payments against the provider in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--older-than", type=int, default=None, help="Minutes a payment must be pending (default PAYMENT_RECONCILE_AFTER_MINUTES)")
+        parser.add_argument("--batch", type=int, default=None, help="Payments per batch (default PAYMENT_RECONCILE_BATCH_SIZE)")
+        parser.add_argument("--loop", action="store_true", help="Keep reconciling every --interval seconds")
+        parser.add_argument("--interval", type=float, default=600.0, help="Seconds between runs with --loop")
+
+    def handle(self, *args, **opts):
+        while True:
+            totals = reconciliation.reconcile(older_than_minutes=opts["older_than"], batch_size=opts["batch"])
+            self.stdout.write(
+                f"checked {totals['checked']} pending payments: {totals['success']} success, "
+                f"{totals['failed']} failed, {totals['refunded']} refunded, {totals['errors']} batch errors"
+            )
+            if not opts["loop"]:
+                return
+            time.sleep(opts["interval"])
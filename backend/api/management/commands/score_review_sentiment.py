@@ -0,0 +1,30 @@
+# api/management/commands/score_review_sentiment.py
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import sentiment
+
+
+class Command(BaseCommand):
+    help = "Score unscored review comments with the offline lexicon scorer, in batches across a process pool."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=None, help="Reviews per batch (default SENTIMENT_BATCH_SIZE)")
+        parser.add_argument("--workers", type=int, default=None, help="Scoring processes (default SENTIMENT_WORKERS or CPU count; 1 = inline)")
+        parser.add_argument("--limit", type=int, default=None, help="Stop after this many reviews")
+        parser.add_argument("--loop", action="store_true", help="Keep scoring new reviews every --interval seconds")
+        parser.add_argument("--interval", type=float, default=60.0, help="Seconds between runs with --loop")
+
+    def handle(self, *args, **opts):
+        while True:
+            totals = sentiment.score_pending(batch_size=opts["batch"], workers=opts["workers"], limit=opts["limit"])
+            if totals["read"] or not opts["loop"]:
+                rate = round(totals["scored"] / totals["seconds"], 1) if totals["seconds"] else totals["scored"]
+                self.stdout.write(
+                    f"scored {totals['scored']} of {totals['read']} reviews in {totals['batches']} batches "
+                    f"on {totals['workers']} workers, {totals['seconds']}s ({rate}/s)"
+                )
+            if not opts["loop"]:
+                return
+            time.sleep(opts["interval"])
@@ -0,0 +1,40 @@
+# api/management/commands/sync_products_csv.py
+from django.core.management.base import BaseCommand, CommandError
+
+from api import product_import
+
+
+class Command(BaseCommand):
+    help = ("Sync products from a CSV feed: insert new rows, update changed price/stock, optionally "
+            "soft-delete products of the feed's marts that are no longer listed. Product ids are kept.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--csv", required=True, help="Feed with mart_id,name,price,stock[,sku,category,...]")
+        parser.add_argument("--batch", type=int, default=1000, help="Changed rows per transaction")
+        parser.add_argument("--deactivate-missing", action="store_true",
+                            help="Mark products of the feed's marts that are absent from the feed inactive")
+        parser.add_argument("--dry-run", action="store_true", help="Report the diff without writing")
+        parser.add_argument("--max-warnings", type=int, default=50, help="Skipped-row messages to print")
+
+    def handle(self, *args, **opts):
+        warnings = [0]
+
+        def warn(msg):
+            warnings[0] += 1
+            if warnings[0] <= opts["max_warnings"]:
+                self.stdout.write(self.style.WARNING(msg))
+
+        try:
+            result = product_import.sync_csv(
+                opts["csv"], batch_size=opts["batch"], deactivate_missing=opts["deactivate_missing"],
+                dry_run=opts["dry_run"], warn=warn,
+            )
+        except product_import.CatalogImportError as e:
+            raise CommandError(str(e))
+
+        prefix = "[dry run] " if opts["dry_run"] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Synced {len(result['marts'])} marts from {result['rows']} rows in {result['seconds']}s: "
+            f"inserted={result['inserted']} updated={result['updated']} unchanged={result['unchanged']} "
+            f"deactivated={result['deactivated']} skipped={result['skipped']}"
+        ))
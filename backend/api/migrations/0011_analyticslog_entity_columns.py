@@ -0,0 +1,83 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:37
+
+import json
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def backfill_entity_columns(apps, schema_editor):
+    """Copy partner/delivery/order ids out of the JSON `details` text into the new columns."""
+    AnalyticsLog = apps.get_model("api", "AnalyticsLog")
+    batch = []
+    for log in AnalyticsLog.objects.exclude(details__isnull=True).only("log_id", "details").iterator(chunk_size=2000):
+        try:
+            data = json.loads(log.details)
+        except (TypeError, ValueError):
+            continue
+        if not isinstance(data, dict):
+            continue
+        changed = False
+        for field in ("partner_id", "delivery_id", "order_id"):
+            value = data.get(field)
+            if isinstance(value, int):
+                setattr(log, field, value)
+                changed = True
+        if changed:
+            batch.append(log)
+        if len(batch) >= 2000:
+            AnalyticsLog.objects.bulk_update(batch, ["partner_id", "delivery_id", "order_id"])
+            batch = []
+    if batch:
+        AnalyticsLog.objects.bulk_update(batch, ["partner_id", "delivery_id", "order_id"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_deliverypartner_password_hash_deliverypartner_phone_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analyticslog',
+            name='delivery_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analyticslog',
+            name='order_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='analyticslog',
+            name='partner_id',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='analyticslog',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddIndex(
+            model_name='analyticslog',
+            index=models.Index(fields=['action_type', 'log_id'], name='alog_action_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analyticslog',
+            index=models.Index(fields=['partner_id', 'log_id'], name='alog_partner_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analyticslog',
+            index=models.Index(fields=['delivery_id', 'log_id'], name='alog_delivery_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analyticslog',
+            index=models.Index(fields=['order_id', 'log_id'], name='alog_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='analyticslog',
+            index=models.Index(fields=['timestamp'], name='alog_ts_idx'),
+        ),
+        migrations.RunPython(backfill_entity_columns, migrations.RunPython.noop),
+    ]
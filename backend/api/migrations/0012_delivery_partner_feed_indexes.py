@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_analyticslog_entity_columns'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='delivery',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='delivery',
+            index=models.Index(fields=['partner', 'status', 'delivery_id'], name='delivery_partner_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='delivery',
+            index=models.Index(fields=['partner', 'updated_at'], name='delivery_partner_updated_idx'),
+        ),
+    ]
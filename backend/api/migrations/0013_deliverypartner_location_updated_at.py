@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-19 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_delivery_partner_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliverypartner',
+            name='location_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
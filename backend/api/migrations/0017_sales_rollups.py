@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-19 09:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_product_sku_is_active'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MartDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('order_count', models.IntegerField(default=0)),
+                ('item_qty', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('mart', models.ForeignKey(db_column='mart_id', on_delete=django.db.models.deletion.CASCADE, to='api.mart')),
+            ],
+            options={
+                'db_table': 'mart_daily_sales',
+                'indexes': [models.Index(fields=['day', 'mart'], name='mart_daily_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('mart', 'day'), name='mart_daily_sales_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ProductDailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('qty', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('order_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('mart', models.ForeignKey(db_column='mart_id', on_delete=django.db.models.deletion.CASCADE, to='api.mart')),
+                ('product', models.ForeignKey(db_column='product_id', on_delete=django.db.models.deletion.CASCADE, to='api.product')),
+            ],
+            options={
+                'db_table': 'product_daily_sales',
+                'indexes': [models.Index(fields=['day', 'mart'], name='product_daily_day_idx')],
+                'constraints': [models.UniqueConstraint(fields=('mart', 'day', 'product'), name='product_daily_sales_uniq')],
+            },
+        ),
+    ]
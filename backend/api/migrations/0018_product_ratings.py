@@ -0,0 +1,52 @@
+# Generated by Django 5.2.5 on 2026-10-19 09:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_product_ratings(apps, schema_editor):
+    """Aggregate the existing reviews once; the Review signals keep the table current afterwards."""
+    Review = apps.get_model("api", "Review")
+    ProductRating = apps.get_model("api", "ProductRating")
+    rows = Review.objects.values("product_id").annotate(
+        review_count=Count("review_id"),
+        rating_sum=Sum("rating"),
+        sentiment_sum=Sum("sentiment_score"),
+        sentiment_count=Count("sentiment_score"),
+        **{f"rating_{n}": Count("review_id", filter=Q(rating=n)) for n in range(1, 6)},
+    )
+    ProductRating.objects.bulk_create(
+        [ProductRating(**{**r, "sentiment_sum": r["sentiment_sum"] or 0}) for r in rows],
+        batch_size=2000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductRating',
+            fields=[
+                ('product', models.OneToOneField(db_column='product_id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating', serialize=False, to='api.product')),
+                ('review_count', models.IntegerField(default=0)),
+                ('rating_sum', models.IntegerField(default=0)),
+                ('rating_1', models.IntegerField(default=0)),
+                ('rating_2', models.IntegerField(default=0)),
+                ('rating_3', models.IntegerField(default=0)),
+                ('rating_4', models.IntegerField(default=0)),
+                ('rating_5', models.IntegerField(default=0)),
+                ('sentiment_sum', models.FloatField(default=0)),
+                ('sentiment_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'product_ratings',
+            },
+        ),
+        migrations.RunPython(backfill_product_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 5.2.5 on 2026-10-19 09:11
+
+import django.core.validators
+import django.db.models.deletion
+from decimal import Decimal
+
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def activate_latest_baskets(apps, schema_editor):
+    """Each user's newest basket becomes their active one; its JSON items become lines where they name a product."""
+    Basket = apps.get_model("api", "Basket")
+    BasketLine = apps.get_model("api", "BasketLine")
+    Product = apps.get_model("api", "Product")
+    latest = Basket.objects.values("user_id").annotate(last=Max("basket_id")).values_list("last", flat=True)
+    for basket in Basket.objects.filter(basket_id__in=list(latest)).iterator(chunk_size=500):
+        wanted = {}
+        for item in basket.items if isinstance(basket.items, list) else []:
+            try:
+                pid, qty = int(item["product_id"]), int(item.get("quantity", 1))
+            except (TypeError, ValueError, KeyError):
+                continue
+            if qty > 0:
+                wanted[pid] = wanted.get(pid, 0) + qty
+        prices = dict(Product.objects.filter(pk__in=list(wanted)).values_list("product_id", "price"))
+        lines = [BasketLine(basket_id=basket.basket_id, product_id=pid, quantity=qty, unit_price=prices[pid])
+                 for pid, qty in wanted.items() if pid in prices]
+        BasketLine.objects.bulk_create(lines)
+        basket.is_active = True
+        basket.total = sum((line.quantity * line.unit_price for line in lines), Decimal("0"))
+        basket.item_count = sum(line.quantity for line in lines)
+        basket.save(update_fields=["is_active", "total", "item_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_product_ratings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BasketLine',
+            fields=[
+                ('line_id', models.AutoField(primary_key=True, serialize=False)),
+                ('quantity', models.IntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('unit_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'basket_lines',
+            },
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='is_active',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='item_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='basket',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AlterField(
+            model_name='basket',
+            name='items',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddConstraint(
+            model_name='basket',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('user',), name='basket_one_active_per_user'),
+        ),
+        migrations.AddField(
+            model_name='basketline',
+            name='basket',
+            field=models.ForeignKey(db_column='basket_id', on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='api.basket'),
+        ),
+        migrations.AddField(
+            model_name='basketline',
+            name='product',
+            field=models.ForeignKey(db_column='product_id', on_delete=django.db.models.deletion.CASCADE, to='api.product'),
+        ),
+        migrations.AddConstraint(
+            model_name='basketline',
+            constraint=models.UniqueConstraint(fields=('basket', 'product'), name='basket_line_product_uniq'),
+        ),
+        migrations.RunPython(activate_latest_baskets, migrations.RunPython.noop),
+    ]
@@ -138,9 +138,17 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     image_url = models.CharField(max_length=255, blank=True, null=True)
+    # merchant's own code; catalog sync (api/product_import.py) matches on (mart, sku) before (mart, name)
+    sku = models.CharField(max_length=64, blank=True, null=True)
+    # False once a synced feed stops listing the product; kept so OrderItem / basket references stay valid
+    is_active = models.BooleanField(default=True)
 
     class Meta:
         db_table = "products"
+        indexes = [
+            models.Index(fields=["mart", "sku"], name="product_mart_sku_idx"),
+            models.Index(fields=["updated_at"], name="product_updated_at_idx"),  # catalog incremental refresh
+        ]
 
     def __str__(self):
         return self.name
@@ -180,21 +188,81 @@ class Review(models.Model):
     def __str__(self):
         return f"{self.user} -> {self.product}: {self.rating}"
 
+# Per-product review aggregates, kept current by the Review signals (api/ratings.py)
+class ProductRating(models.Model):
+    product = models.OneToOneField(Product, primary_key=True, on_delete=models.CASCADE, db_column="product_id", related_name="rating")
+    review_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    rating_1 = models.IntegerField(default=0)
+    rating_2 = models.IntegerField(default=0)
+    rating_3 = models.IntegerField(default=0)
+    rating_4 = models.IntegerField(default=0)
+    rating_5 = models.IntegerField(default=0)
+    sentiment_sum = models.FloatField(default=0)
+    sentiment_count = models.IntegerField(default=0)  # reviews with a sentiment_score
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "product_ratings"
+
+    @property
+    def average(self):
+        return self.rating_sum / self.review_count if self.review_count else None
+
+    @property
+    def mean_sentiment(self):
+        return self.sentiment_sum / self.sentiment_count if self.sentiment_count else None
+
+    @property
+    def histogram(self):
+        return {str(n): getattr(self, f"rating_{n}") for n in range(1, 6)}
+
+    def __str__(self):
+        return f"{self.product_id}: {self.average} ({self.review_count})"
+
 # ---------------------- Basket ----------------------
 class Basket(models.Model):
     basket_id = models.AutoField(primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, db_column="user_id")
-    items = models.JSONField()
+    # legacy free-form snapshot; contents live in BasketLine (api/baskets.py)
+    items = models.JSONField(default=list, blank=True)
     optimized_cost = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    is_active = models.BooleanField(default=False)
+    # sum(quantity * unit_price) and sum(quantity) over the lines, maintained on every line write
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    item_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = "baskets"
+        constraints = [
+            # not created on MySQL (no partial indexes); baskets.active_basket locks the user row instead
+            models.UniqueConstraint(fields=["user"], condition=models.Q(is_active=True), name="basket_one_active_per_user"),
+        ]
 
     def __str__(self):
         return f"Basket {self.basket_id} ({self.user})"
 
+
+class BasketLine(models.Model):
+    line_id = models.AutoField(primary_key=True)
+    basket = models.ForeignKey(Basket, on_delete=models.CASCADE, db_column="basket_id", related_name="lines")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_column="product_id")
+    quantity = models.IntegerField(validators=[MinValueValidator(1)])
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)  # price when the line was last written
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "basket_lines"
+        constraints = [
+            models.UniqueConstraint(fields=["basket", "product"], name="basket_line_product_uniq"),
+        ]
+
+    def __str__(self):
+        return f"{self.basket_id}: {self.quantity} x {self.product_id}"
+
 # ---------------------- Order ----------------------
 class Order(models.Model):
     STATUS_CHOICES = [
@@ -218,6 +286,11 @@ class Order(models.Model):
     delivery_address_lat = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
     delivery_address_long = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
 
+    # single payment covering every order of a multi-mart checkout (api/checkout.py)
+    checkout_payment = models.ForeignKey(
+        "Payment", null=True, blank=True, on_delete=models.SET_NULL, related_name="checkout_orders"
+    )
+
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -250,6 +323,7 @@ class DeliveryPartner(models.Model):
     password_hash = models.CharField(max_length=255, null=True, blank=True)
     location_lat = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
     location_long = models.DecimalField(max_digits=10, decimal_places=6, null=True, blank=True)
+    location_updated_at = models.DateTimeField(null=True, blank=True)  # last persisted ping (api/locations.py)
     availability = models.BooleanField(default=True)
     approved = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -275,10 +349,15 @@ class Delivery(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="assigned")
     route_data = models.JSONField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         db_table = "deliveries"
+        indexes = [
+            # partner feed: active deliveries newest-first, and change polling by updated_at
+            models.Index(fields=["partner", "status", "delivery_id"], name="delivery_partner_status_idx"),
+            models.Index(fields=["partner", "updated_at"], name="delivery_partner_updated_idx"),
+        ]
 
     def __str__(self):
         return f"Delivery {self.delivery_id} ({self.status})"
@@ -337,15 +416,72 @@ class AnalyticsLog(models.Model):
     admin = models.ForeignKey(Admin, on_delete=models.CASCADE, db_column="admin_id", null=True, blank=True)
     action_type = models.CharField(max_length=50, null=True, blank=True)
     details = models.TextField(null=True, blank=True)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Entity ids lifted out of `details` so audit queries hit an index instead of scanning JSON text.
+    # Plain integers (not FKs) so logs survive deletion of the referenced rows.
+    partner_id = models.IntegerField(null=True, blank=True)
+    delivery_id = models.IntegerField(null=True, blank=True)
+    order_id = models.IntegerField(null=True, blank=True)
+    # default (not auto_now_add) so buffered events keep the time they were queued
+    timestamp = models.DateTimeField(default=timezone.now)
 
     class Meta:
         db_table = "analytics_logs"
+        indexes = [
+            models.Index(fields=["action_type", "log_id"], name="alog_action_idx"),
+            models.Index(fields=["partner_id", "log_id"], name="alog_partner_idx"),
+            models.Index(fields=["delivery_id", "log_id"], name="alog_delivery_idx"),
+            models.Index(fields=["order_id", "log_id"], name="alog_order_idx"),
+            models.Index(fields=["timestamp"], name="alog_ts_idx"),
+        ]
 
     def __str__(self):
         return f"Log {self.log_id} by {self.admin}"
 
 
+# Sales rollups (api/rollups.py): maintained when orders enter / leave a counted status
+class MartDailySales(models.Model):
+    mart = models.ForeignKey(Mart, on_delete=models.CASCADE, db_column="mart_id")
+    day = models.DateField()
+    order_count = models.IntegerField(default=0)
+    item_qty = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "mart_daily_sales"
+        constraints = [
+            models.UniqueConstraint(fields=["mart", "day"], name="mart_daily_sales_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["day", "mart"], name="mart_daily_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.mart_id} {self.day}: {self.revenue}"
+
+
+class ProductDailySales(models.Model):
+    mart = models.ForeignKey(Mart, on_delete=models.CASCADE, db_column="mart_id")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_column="product_id")
+    day = models.DateField()
+    qty = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "product_daily_sales"
+        constraints = [
+            models.UniqueConstraint(fields=["mart", "day", "product"], name="product_daily_sales_uniq"),
+        ]
+        indexes = [
+            models.Index(fields=["day", "mart"], name="product_daily_day_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id}@{self.mart_id} {self.day}: {self.qty}"
+
+
 class AdminAuthAudit(models.Model):
     """Record admin auth attempts for auditing and monitoring."""
     audit_id = models.AutoField(primary_key=True)
@@ -417,6 +553,57 @@ class Payment(models.Model):
 
     class Meta:
         db_table = "payments"
+        indexes = [
+            # webhook / reconciliation lookups by the provider's ids
+            models.Index(fields=["provider_order_id"], name="payment_provider_order_idx"),
+            models.Index(fields=["provider_payment_id"], name="payment_provider_payment_idx"),
+        ]
 
     def __str__(self):
         return f"Payment #{self.payment_id} {self.provider} {self.status}"
+
+
+class PaymentWebhookEvent(models.Model):
+    """Raw provider webhook, stored on receipt and applied later by api/webhooks.py."""
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("processed", "Processed"),
+        ("ignored", "Ignored"),
+        ("failed", "Failed"),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    provider = models.CharField(max_length=50, default="razorpay")
+    event_id = models.CharField(max_length=255, unique=True)  # X-Razorpay-Event-Id (or body hash)
+    event_type = models.CharField(max_length=100)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "payment_webhook_events"
+        indexes = [
+            models.Index(fields=["status", "id"], name="webhook_status_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.event_type} {self.event_id} ({self.status})"
+
+
+class ImportCheckpoint(models.Model):
+    """Progress of a resumable CSV import, written in the same transaction as each batch (api/product_import.py)."""
+    key = models.CharField(max_length=255, unique=True)  # --checkpoint name; defaults to the CSV path
+    source = models.JSONField(default=dict)  # csv path, size and mtime the progress belongs to
+    row = models.IntegerField(default=0)  # last CSV row consumed
+    created = models.IntegerField(default=0)
+    skipped = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "import_checkpoints"
+
+    def __str__(self):
+        return f"{self.key}: row {self.row}"
@@ -0,0 +1,153 @@
+# api/optimize_cache.py
+"""
+Memoized basket optimization.
+
+``optimize_basket`` results are cached under a fingerprint of the request that
+decides them: the sorted (product_id, quantity, weight override) lines, the
+delivery coordinates and ``allow_swaps``. Each entry records the generation of
+everything it was computed from:
+
+  catalog:gen:product:<id>   every product loaded (requested + swap candidates)
+  catalog:gen:name:<name>    each product name (a new swap candidate appearing)
+  catalog:gen:marts          any mart change (approval)
+
+``api/signals.py`` bumps these on Product / Mart save and delete; code that
+writes with ``QuerySet.update()`` / ``bulk_update()`` calls ``bump_products()``
+itself. A hit is served only if every recorded generation is unchanged, which
+costs one ``get_many`` and no queries. ``OPTIMIZE_CACHE_TTL`` bounds the age of
+an entry regardless.
+
+Generations are read with ``capture()`` *before* the rows they guard are loaded
+and handed to ``put()``; a write that lands while the plan is computed then
+leaves the entry already stale instead of stamping old data with new counters.
+
+Identical requests that miss at the same time are coalesced per process: the
+first computes, the rest wait for its result (``SingleFlight``).
+"""
+import hashlib
+import json
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _gen_key(kind: str, value="") -> str:
+    if kind == "name":
+        # names can hold spaces/unicode; memcached-style keys can't
+        value = hashlib.sha1(str(value).encode()).hexdigest()
+    return f"catalog:gen:{kind}:{value}" if value != "" else f"catalog:gen:{kind}"
+
+
+def _bump(keys: List[str]):
+    for key in keys:
+        # seeded with a clock value so an evicted-then-recreated counter never repeats an old one
+        if not cache.add(key, time.time_ns(), None):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.add(key, time.time_ns(), None)
+
+
+def bump_products(product_ids: Iterable = (), names: Iterable = ()):
+    _bump([_gen_key("product", pid) for pid in set(product_ids)] + [_gen_key("name", n) for n in set(names)])
+
+
+def bump_marts():
+    _bump([_gen_key("marts")])
+
+
+def _generations(keys: List[str]) -> Dict[str, int]:
+    found = cache.get_many(keys)
+    missing = [k for k in keys if k not in found]
+    if missing:
+        for k in missing:
+            cache.add(k, time.time_ns(), None)
+        found.update(cache.get_many(missing))
+    return found
+
+
+def fingerprint(items: List[Dict], lat: float, lon: float, allow_swaps: bool) -> str:
+    lines = []
+    for it in items:
+        try:
+            lines.append([int(it.get("product_id")), int(it.get("quantity", 1)),
+                          None if it.get("weight_kg") is None else float(it["weight_kg"])])
+        except (TypeError, ValueError):
+            continue
+    lines.sort(key=lambda line: (line[0], line[1], line[2] or 0.0))
+    raw = json.dumps([lines, round(float(lat), 6), round(float(lon), 6), bool(allow_swaps)], separators=(",", ":"))
+    return "checkout:optimize:" + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def get(key: str) -> Optional[Dict]:
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    current = cache.get_many(list(entry["gens"]))
+    if current != entry["gens"]:
+        return None
+    return entry["value"]
+
+
+def capture(product_ids: Iterable = (), names: Iterable = (), marts: bool = False) -> Dict[str, int]:
+    """Current generations of the given products / names (and marts). Call before loading them."""
+    keys = [_gen_key("product", pid) for pid in set(product_ids)] + [_gen_key("name", n) for n in set(names)]
+    if marts:
+        keys.append(_gen_key("marts"))
+    return _generations(keys) if keys else {}
+
+
+def put(key: str, value: Dict, gens: Dict[str, int]):
+    """Cache ``value`` stamped with ``gens`` as captured before it was computed."""
+    cache.set(key, {"gens": dict(gens), "value": value}, _setting("OPTIMIZE_CACHE_TTL", 120))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Run ``fn`` once per key at a time; concurrent callers with the same key share the outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if call.done.wait(timeout=_setting("OPTIMIZE_COALESCE_WAIT", 10.0)):
+                if call.error is not None:
+                    raise call.error
+                return call.value
+            return fn()
+        try:
+            call.value = fn()
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+flights = SingleFlight()
@@ -0,0 +1,183 @@
+# api/payment_gateway.py
+"""
+Shared HTTP client for the Razorpay API.
+
+One ``requests.Session`` per process keeps TLS connections to the provider alive
+(pool sized by ``PAYMENT_HTTP_POOL_SIZE``), so a checkout no longer pays a fresh
+handshake. Every call uses a split (connect, read) timeout: a dead host fails fast
+on connect while a slow-but-alive provider still gets ``PAYMENT_HTTP_READ_TIMEOUT``.
+
+Retries are bounded (``PAYMENT_HTTP_RETRIES``) and only where repeating is safe:
+connection failures for any call (nothing reached the provider), plus read errors
+and 429/5xx answers for GETs. A POST that may have reached Razorpay is never
+replayed.
+
+Per-operation latency is kept in ``metrics`` (count, errors, mean / p95 / max ms)
+and exposed to superusers at ``/admin/payments/gateway-metrics/``.
+
+``base_url`` comes from ``RAZORPAY_API_BASE``, which tests point at a local stub server.
+"""
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class GatewayError(Exception):
+    """Provider call failed. ``status_code`` is None for transport errors (timeout, refused, ...)."""
+
+    def __init__(self, message, status_code=None, body=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.body = body
+
+
+class LatencyStats:
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._recent: Dict[str, deque] = {}
+        self._totals: Dict[str, Dict] = {}
+        self.window = window
+
+    def record(self, op: str, ms: float, ok: bool):
+        with self._lock:
+            t = self._totals.setdefault(op, {"count": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+            t["count"] += 1
+            t["errors"] += 0 if ok else 1
+            t["total_ms"] += ms
+            t["max_ms"] = max(t["max_ms"], ms)
+            self._recent.setdefault(op, deque(maxlen=self.window)).append(ms)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            out = {}
+            for op, t in self._totals.items():
+                recent = sorted(self._recent.get(op, ()))
+                p95 = recent[min(len(recent) - 1, int(len(recent) * 0.95))] if recent else None
+                out[op] = {
+                    "count": t["count"],
+                    "errors": t["errors"],
+                    "mean_ms": round(t["total_ms"] / t["count"], 2) if t["count"] else None,
+                    "p95_ms": round(p95, 2) if p95 is not None else None,
+                    "max_ms": round(t["max_ms"], 2),
+                }
+            return out
+
+    def reset(self):
+        with self._lock:
+            self._recent.clear()
+            self._totals.clear()
+
+
+metrics = LatencyStats()
+
+
+class RazorpayClient:
+    def __init__(self, key_id: str, key_secret: str, base_url: Optional[str] = None,
+                 connect_timeout: Optional[float] = None, read_timeout: Optional[float] = None,
+                 retries: Optional[int] = None, pool_size: Optional[int] = None):
+        self.key_id = key_id
+        self.base_url = (base_url or _setting("RAZORPAY_API_BASE", "https://api.razorpay.com/v1")).rstrip("/")
+        self.timeout = (
+            connect_timeout if connect_timeout is not None else _setting("PAYMENT_HTTP_CONNECT_TIMEOUT", 3.05),
+            read_timeout if read_timeout is not None else _setting("PAYMENT_HTTP_READ_TIMEOUT", 10.0),
+        )
+        retries = retries if retries is not None else _setting("PAYMENT_HTTP_RETRIES", 2)
+        pool_size = pool_size or _setting("PAYMENT_HTTP_POOL_SIZE", 10)
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            # read errors / bad statuses are only retried for these; connect errors for everything
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            status_forcelist=(429, 500, 502, 503, 504),
+            backoff_factor=_setting("PAYMENT_HTTP_BACKOFF", 0.3),
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        self.session = requests.Session()
+        self.session.auth = (key_id, key_secret)
+        self.session.headers.update({"Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _call(self, op: str, method: str, path: str, **kwargs) -> Dict:
+        started = time.perf_counter()
+        ok = False
+        try:
+            try:
+                r = self.session.request(method, f"{self.base_url}{path}", timeout=self.timeout, **kwargs)
+            except requests.RequestException as e:
+                raise GatewayError(f"{op}: {e.__class__.__name__}: {e}") from e
+            if r.status_code not in (200, 201):
+                raise GatewayError(f"{op}: HTTP {r.status_code}", status_code=r.status_code, body=r.text)
+            try:
+                data = r.json()
+            except ValueError as e:
+                raise GatewayError(f"{op}: invalid JSON", status_code=r.status_code, body=r.text) from e
+            ok = True
+            return data
+        finally:
+            metrics.record(op, (time.perf_counter() - started) * 1000.0, ok)
+
+    # ---------- Razorpay operations ----------
+    def create_order(self, amount_paise: int, currency: str = "INR", receipt: Optional[str] = None,
+                     notes: Optional[Dict] = None) -> Dict:
+        payload = {"amount": amount_paise, "currency": currency, "payment_capture": 1, "notes": notes or {}}
+        if receipt:
+            payload["receipt"] = receipt
+        return self._call("create_order", "POST", "/orders", json=payload)
+
+    def fetch_order(self, order_id: str) -> Dict:
+        return self._call("fetch_order", "GET", f"/orders/{order_id}")
+
+    def fetch_order_payments(self, order_id: str) -> List[Dict]:
+        return self._call("fetch_order_payments", "GET", f"/orders/{order_id}/payments").get("items", [])
+
+    def fetch_payment(self, payment_id: str) -> Dict:
+        return self._call("fetch_payment", "GET", f"/payments/{payment_id}")
+
+    def list_payments(self, from_ts: int, to_ts: int, count: int = 100, skip: int = 0) -> List[Dict]:
+        """Payments created in [from_ts, to_ts] (unix seconds), one page of up to 100."""
+        params = {"from": from_ts, "to": to_ts, "count": count, "skip": skip}
+        return self._call("list_payments", "GET", "/payments", params=params).get("items", [])
+
+    def close(self):
+        self.session.close()
+
+
+_client = None
+_client_key = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> RazorpayClient:
+    """
+    Process-wide client built from settings. Raises GatewayError when credentials are
+    missing. Rebuilt if the key or base URL changes (e.g. override_settings in tests).
+    """
+    global _client, _client_key
+    key_id = _setting("RAZORPAY_KEY_ID", None)
+    key_secret = _setting("RAZORPAY_KEY_SECRET", None)
+    if not key_id or not key_secret:
+        raise GatewayError("Razorpay credentials not configured")
+    cache_key = (key_id, key_secret, _setting("RAZORPAY_API_BASE", "https://api.razorpay.com/v1"))
+    with _client_lock:
+        if _client is None or _client_key != cache_key:
+            if _client is not None:
+                _client.close()
+            _client = RazorpayClient(key_id, key_secret)
+            _client_key = cache_key
+        return _client
@@ -0,0 +1,123 @@
+# api/ratings.py
+"""
+Per-product review aggregates (``product_ratings``).
+
+Each product with reviews has one ``ProductRating`` row: review count, rating sum,
+a 1–5 histogram and the sum / count of ``sentiment_score`` values. The Review
+signals (api/signals.py) apply each insert, edit and delete as a single
+``UPDATE ... SET col = col + n``, so concurrent reviews never lose counts and
+listings read the aggregate with a join instead of a per-product ``GROUP BY``.
+
+Code that writes reviews without signals (``bulk_create`` / ``bulk_update`` /
+``QuerySet.update``) applies the same kind of delta itself (``add_sentiment``).
+``rebuild`` recomputes rows from scratch and replaces them, so it is for repairs
+while reviews aren't being written, not for the request path.
+
+``quality`` is what the basket optimizer breaks price ties on: the review
+average when a product has reviews, else the catalog's static ``quality_score``.
+"""
+from typing import Dict, Iterable, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from . import models
+
+
+def _changes(rating: int, sentiment: Optional[float], sign: int) -> Dict:
+    changes = {
+        "review_count": F("review_count") + sign,
+        "rating_sum": F("rating_sum") + sign * rating,
+        "updated_at": timezone.now(),
+    }
+    if 1 <= rating <= 5:
+        changes[f"rating_{rating}"] = F(f"rating_{rating}") + sign
+    if sentiment is not None:
+        changes["sentiment_sum"] = F("sentiment_sum") + sign * sentiment
+        changes["sentiment_count"] = F("sentiment_count") + sign
+    return changes
+
+
+def apply(product_id: int, rating: int, sentiment: Optional[float], sign: int = 1):
+    """Add (``sign=1``) or remove (``sign=-1``) one review from its product's aggregate."""
+    _update(product_id, _changes(int(rating), sentiment, sign))
+
+
+def add_sentiment(product_id: int, total: float, count: int):
+    """Fold ``count`` newly scored reviews (scores summing to ``total``) into the sentiment columns."""
+    _update(product_id, {
+        "sentiment_sum": F("sentiment_sum") + total,
+        "sentiment_count": F("sentiment_count") + count,
+        "updated_at": timezone.now(),
+    })
+
+
+def _update(product_id: int, changes: Dict):
+    rows = models.ProductRating.objects.filter(product_id=product_id)
+    if rows.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            models.ProductRating.objects.create(product_id=product_id)
+    except IntegrityError:
+        pass  # created concurrently by another review of the same product
+    rows.update(**changes)
+
+
+def rebuild(product_ids: Optional[Iterable[int]] = None) -> int:
+    """Recompute aggregates from ``reviews`` for the given products (all when None). Returns rows written."""
+    reviews = models.Review.objects.all()
+    ratings = models.ProductRating.objects.all()
+    if product_ids is not None:
+        product_ids = list(product_ids)
+        reviews = reviews.filter(product_id__in=product_ids)
+        ratings = ratings.filter(product_id__in=product_ids)
+    rows = reviews.values("product_id").annotate(
+        review_count=Count("review_id"),
+        rating_sum=Sum("rating"),
+        sentiment_sum=Sum("sentiment_score"),
+        sentiment_count=Count("sentiment_score"),
+        **{f"rating_{n}": Count("review_id", filter=Q(rating=n)) for n in range(1, 6)},
+    )
+    fresh = [models.ProductRating(**{**r, "sentiment_sum": r["sentiment_sum"] or 0}) for r in rows]
+    with transaction.atomic():
+        ratings.delete()
+        models.ProductRating.objects.bulk_create(fresh, batch_size=2000)
+    return len(fresh)
+
+
+def _loaded_rating(product: models.Product) -> Optional[models.ProductRating]:
+    # only use the relation when it was select_related / prefetched: never query per product
+    cache = getattr(product, "_state", None)
+    if cache is None or "rating" not in cache.fields_cache:
+        return None
+    return cache.fields_cache["rating"]
+
+
+def summary(product: models.Product) -> Dict:
+    """Serializable aggregate for ``ProductSerializer`` (listings select_related ``rating``)."""
+    try:
+        r = product.rating
+    except models.ProductRating.DoesNotExist:
+        r = None
+    if r is None or not r.review_count:
+        return {"average": None, "count": 0, "histogram": {str(n): 0 for n in range(1, 6)}, "sentiment": None}
+    sentiment = r.mean_sentiment
+    return {
+        "average": round(r.average, 2),
+        "count": r.review_count,
+        "histogram": r.histogram,
+        "sentiment": round(sentiment, 3) if sentiment is not None else None,
+    }
+
+
+def quality(product: models.Product) -> float:
+    """Review average when there are reviews, else the static ``quality_score``. Never queries."""
+    q = getattr(product, "quality", None)  # precomputed by the catalog snapshot
+    if q is not None:
+        return q
+    r = _loaded_rating(product)
+    if r is not None and r.review_count:
+        return r.average
+    return float(product.quality_score or 0)
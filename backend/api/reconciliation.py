@@ -0,0 +1,166 @@
+# api/reconciliation.py
+"""
+Resolve Razorpay payments that stayed ``pending`` because neither the client
+verify call nor the webhook ever arrived.
+
+Stale pending payments are paged by ``payment_id`` in batches. For each batch the
+provider is asked once for every payment created in the batch's time window
+(``GET /payments?from=&to=``, paged 100 at a time) instead of once per row; the
+results are matched back on Razorpay order id. Outcomes are then applied in one
+transaction per batch:
+
+  captured        -> Payment success, linked orders confirmed (deliveries created)
+  refunded        -> Payment refunded
+  only failed     -> Payment failed, linked pending orders cancelled (a retried
+                     capture that arrives later re-opens and confirms them,
+                     see ``lifecycle.confirm_orders_for_payments``)
+  nothing, and older than PAYMENT_RECONCILE_EXPIRE_MINUTES -> failed (expired)
+
+The listing only proves absence when it was read to the end: if it stopped at
+``PAYMENT_RECONCILE_MAX_PAGES`` nothing in the batch is expired. Even then the
+window (first payment .. last payment + ``PAYMENT_RECONCILE_LOOKAHEAD_MINUTES``)
+can miss a late attempt, so every expiry candidate is re-checked with the per-order
+``GET /orders/{id}/payments`` and decided on that answer instead.
+
+Anything still in flight (``created`` / ``authorized``) is left for the next run.
+Rows are re-locked before writing, so a verify/webhook that lands mid-run wins.
+"""
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import lifecycle, models, payment_gateway
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def fetch_remote(client, payments: List[models.Payment], now) -> Tuple[Dict[str, List[Dict]], bool]:
+    """
+    ({razorpay_order_id: [payment entities]}, complete) for every provider payment created
+    around ``payments``. ``complete`` is False when the listing stopped at the page cap.
+    """
+    wanted = {p.provider_order_id for p in payments if p.provider_order_id}
+    if not wanted:
+        return {}, True
+    lookahead = timedelta(minutes=_setting("PAYMENT_RECONCILE_LOOKAHEAD_MINUTES", 360))
+    start = min(p.created_at for p in payments) - timedelta(minutes=5)
+    end = min(max(p.created_at for p in payments) + lookahead, now)
+    page_size = 100
+    max_pages = _setting("PAYMENT_RECONCILE_MAX_PAGES", 50)
+
+    out: Dict[str, List[Dict]] = {}
+    for page in range(max_pages):
+        items = client.list_payments(int(start.timestamp()), int(end.timestamp()), count=page_size, skip=page * page_size)
+        for entity in items:
+            if entity.get("order_id") in wanted:
+                out.setdefault(entity["order_id"], []).append(entity)
+        if len(items) < page_size:
+            return out, True
+    return out, False
+
+
+def decide(payment: models.Payment, entities: List[Dict], expire_before) -> Optional[Dict]:
+    """
+    New field values for ``payment`` given the provider's view, or None to leave it pending.
+    Pass ``expire_before=None`` when ``entities`` may be incomplete: nothing is expired then.
+    """
+    by_status = {}
+    for e in entities:
+        by_status.setdefault(e.get("status"), e)
+    if "captured" in by_status:
+        e = by_status["captured"]
+        out = {"status": "success", "provider_payment_id": e.get("id")}
+        if e.get("amount") is not None:
+            out["amount"] = e["amount"] / 100.0
+        return out
+    if "refunded" in by_status:
+        return {"status": "refunded", "provider_payment_id": by_status["refunded"].get("id")}
+    if "created" in by_status or "authorized" in by_status:
+        return None
+    if "failed" in by_status:
+        return {"status": "failed", "provider_payment_id": by_status["failed"].get("id")}
+    if expire_before is not None and payment.created_at < expire_before:
+        return {"status": "failed"}
+    return None
+
+
+def reconcile_batch(payments: List[models.Payment], client, now=None) -> Dict[str, int]:
+    now = now or timezone.now()
+    expire_before = now - timedelta(minutes=_setting("PAYMENT_RECONCILE_EXPIRE_MINUTES", 24 * 60))
+    remote, complete = fetch_remote(client, payments, now)
+
+    decided = {}
+    for p in payments:
+        entities = remote.get(p.provider_order_id, [])
+        change = decide(p, entities, None)
+        if change is None and complete and not entities and p.created_at < expire_before:
+            # about to expire on absence from the listing: ask about this order directly
+            found = client.fetch_order_payments(p.provider_order_id) if p.provider_order_id else []
+            change = decide(p, found, expire_before)
+        if change:
+            decided[p.payment_id] = (p, change)
+
+    counts = {"checked": len(payments), "success": 0, "failed": 0, "refunded": 0}
+    if not decided:
+        return counts
+
+    with transaction.atomic():
+        # verify / webhook may have resolved some rows since we read them
+        still_pending = set(
+            models.Payment.objects.select_for_update()
+            .filter(payment_id__in=list(decided), status="pending")
+            .values_list("payment_id", flat=True)
+        )
+        changed = []
+        for pid, (p, change) in decided.items():
+            if pid not in still_pending:
+                continue
+            for field, value in change.items():
+                if value is not None:
+                    setattr(p, field, value)
+            p.updated_at = now
+            changed.append(p)
+            counts[p.status] += 1
+        if not changed:
+            return counts
+        models.Payment.objects.bulk_update(changed, ["status", "provider_payment_id", "amount", "updated_at"])
+
+        lifecycle.confirm_orders_for_payments([p for p in changed if p.status == "success"])
+        failed_orders = lifecycle.order_ids_for_payments(p for p in changed if p.status == "failed")
+        if failed_orders:
+            (models.Order.objects.filter(order_id__in=failed_orders, status="pending")
+             .exclude(payments__status="success")
+             .update(status="cancelled", updated_at=now))
+    return counts
+
+
+def reconcile(older_than_minutes: Optional[int] = None, batch_size: Optional[int] = None, client=None) -> Dict[str, int]:
+    """Page through every stale pending Razorpay payment once. Returns totals."""
+    older_than = older_than_minutes if older_than_minutes is not None else _setting("PAYMENT_RECONCILE_AFTER_MINUTES", 30)
+    batch_size = batch_size or _setting("PAYMENT_RECONCILE_BATCH_SIZE", 200)
+    client = client or payment_gateway.get_client()
+    cutoff = timezone.now() - timedelta(minutes=older_than)
+
+    totals = {"checked": 0, "success": 0, "failed": 0, "refunded": 0, "errors": 0}
+    after_id = 0
+    while True:
+        batch = list(
+            models.Payment.objects.filter(provider="razorpay", status="pending", created_at__lt=cutoff, payment_id__gt=after_id)
+            .order_by("payment_id")[:batch_size]
+        )
+        if not batch:
+            return totals
+        after_id = batch[-1].payment_id
+        try:
+            counts = reconcile_batch(batch, client)
+        except payment_gateway.GatewayError as e:
+            print(f"[reconciliation] batch ending at payment {after_id} skipped: {e}")
+            totals["errors"] += 1
+            continue
+        for k, v in counts.items():
+            totals[k] += v
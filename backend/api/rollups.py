@@ -0,0 +1,186 @@
+# api/rollups.py
+"""
+Per-mart, per-day sales rollups for the admin analytics endpoints.
+
+Two tables are kept alongside ``orders`` / ``order_items``:
+
+  * ``product_daily_sales`` — mart × day × product: qty, revenue, order count
+  * ``mart_daily_sales``    — mart × day: orders, items, revenue
+
+An order counts once it is paid for (``COUNTED_STATUSES``); the day is the local
+date of ``Order.created_at`` and revenue is ``quantity * price_at_purchase`` of its
+items (delivery charges are not sales). Code that moves orders into or out of a
+counted status calls ``record_transition`` in the same transaction —
+``lifecycle.confirm_orders`` is the only such place today. Each call reads the
+orders' items once, folds them into per-key deltas and applies them with one
+``SELECT ... FOR UPDATE`` and one ``bulk_update`` per table (missing rows are
+inserted first with ``ignore_conflicts`` so concurrent confirmations can't race
+each other into a unique violation).
+
+``rebuild`` recomputes a date range from the raw tables with ``GROUP BY`` queries
+(``manage.py backfill_sales_rollups``); the read helpers only ever touch rollups.
+"""
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Set
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.utils import timezone
+
+from . import models
+
+COUNTED_STATUSES = ("confirmed", "shipped", "delivered")
+
+_REVENUE = ExpressionWrapper(F("quantity") * F("price_at_purchase"), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _money(value) -> str:
+    return str(Decimal(value or 0).quantize(Decimal("0.01")))
+
+
+def _day_bounds(day: date):
+    tz = timezone.get_current_timezone()
+    start = timezone.make_aware(datetime.combine(day, time.min), tz)
+    return start, start + timedelta(days=1)
+
+
+# ---------- incremental maintenance ----------
+def _deltas(order_ids: List[int]):
+    """Fold the orders' items into {(mart, day): [orders, qty, revenue]} and {(mart, day, product): [...]}."""
+    marts = defaultdict(lambda: [set(), 0, Decimal("0")])
+    products = defaultdict(lambda: [set(), 0, Decimal("0")])
+    rows = models.OrderItem.objects.filter(order_id__in=order_ids).values_list(
+        "order_id", "order__created_at", "mart_id", "product_id", "quantity", "price_at_purchase"
+    )
+    for order_id, created_at, mart_id, product_id, qty, price in rows:
+        day = timezone.localdate(created_at)
+        revenue = Decimal(qty) * (price or 0)
+        for entry in (marts[(mart_id, day)], products[(mart_id, day, product_id)]):
+            entry[0].add(order_id)
+            entry[1] += qty
+            entry[2] += revenue
+    return marts, products
+
+
+def _merge(model, key_fields, deltas, qty_field, sign: int):
+    if not deltas:
+        return
+    model.objects.bulk_create(
+        [model(**dict(zip(key_fields, key))) for key in deltas],
+        ignore_conflicts=True,
+    )
+    lookup = {f"{field}__in": {key[i] for key in deltas} for i, field in enumerate(key_fields)}
+    changed = []
+    for row in model.objects.select_for_update().filter(**lookup).order_by("pk"):
+        key = tuple(getattr(row, field) for field in key_fields)
+        delta = deltas.get(key)
+        if delta is None:
+            continue
+        orders, qty, revenue = delta
+        row.order_count += sign * len(orders)
+        setattr(row, qty_field, getattr(row, qty_field) + sign * qty)
+        row.revenue += sign * revenue
+        row.updated_at = timezone.now()
+        changed.append(row)
+    model.objects.bulk_update(changed, ["order_count", qty_field, "revenue", "updated_at"])
+
+
+def apply_orders(order_ids: Iterable[int], sign: int = 1):
+    """Add (``sign=1``) or remove (``sign=-1``) the given orders' sales from the rollups."""
+    ids = sorted({int(i) for i in order_ids if i})
+    if not ids:
+        return
+    marts, products = _deltas(ids)
+    with transaction.atomic():
+        _merge(models.MartDailySales, ("mart_id", "day"), marts, "item_qty", sign)
+        _merge(models.ProductDailySales, ("mart_id", "day", "product_id"), products, "qty", sign)
+
+
+def record_transition(order_ids: Iterable[int], old_status: str, new_status: str):
+    """Call when ``order_ids`` move from ``old_status`` to ``new_status``."""
+    was, now = old_status in COUNTED_STATUSES, new_status in COUNTED_STATUSES
+    if was != now:
+        apply_orders(order_ids, 1 if now else -1)
+
+
+# ---------- backfill ----------
+def rebuild(day_from: date, day_to: date) -> int:
+    """Recompute rollups for ``day_from``..``day_to`` (inclusive), one transaction per day. Returns days rebuilt."""
+    day = day_from
+    rebuilt = 0
+    while day <= day_to:
+        start, end = _day_bounds(day)
+        items = models.OrderItem.objects.filter(
+            order__status__in=COUNTED_STATUSES, order__created_at__gte=start, order__created_at__lt=end,
+        )
+        with transaction.atomic():
+            models.MartDailySales.objects.filter(day=day).delete()
+            models.ProductDailySales.objects.filter(day=day).delete()
+            models.MartDailySales.objects.bulk_create([
+                models.MartDailySales(mart_id=r["mart_id"], day=day, order_count=r["orders"], item_qty=r["qty"], revenue=r["revenue"])
+                for r in items.values("mart_id").annotate(orders=Count("order_id", distinct=True), qty=Sum("quantity"), revenue=Sum(_REVENUE))
+            ])
+            models.ProductDailySales.objects.bulk_create([
+                models.ProductDailySales(mart_id=r["mart_id"], product_id=r["product_id"], day=day,
+                                         order_count=r["orders"], qty=r["qty"], revenue=r["revenue"])
+                for r in items.values("mart_id", "product_id").annotate(orders=Count("order_id", distinct=True), qty=Sum("quantity"), revenue=Sum(_REVENUE))
+            ], batch_size=1000)
+        rebuilt += 1
+        day += timedelta(days=1)
+    return rebuilt
+
+
+# ---------- reads (rollups only) ----------
+def date_range(raw_from: Optional[str], raw_to: Optional[str]):
+    """Parse ``from`` / ``to`` query params (YYYY-MM-DD); defaults to the last ``ANALYTICS_DEFAULT_DAYS`` days."""
+    try:
+        day_to = date.fromisoformat(raw_to) if raw_to else timezone.localdate()
+        day_from = date.fromisoformat(raw_from) if raw_from else day_to - timedelta(days=_setting("ANALYTICS_DEFAULT_DAYS", 30) - 1)
+    except ValueError:
+        raise ValueError("from / to must be YYYY-MM-DD")
+    if day_from > day_to:
+        raise ValueError("from must not be after to")
+    max_days = _setting("ANALYTICS_MAX_DAYS", 366)
+    if (day_to - day_from).days >= max_days:
+        raise ValueError(f"at most {max_days} days per request")
+    return day_from, day_to
+
+
+def _scoped(qs, day_from: date, day_to: date, mart_ids: Optional[Set[int]]):
+    qs = qs.filter(day__gte=day_from, day__lte=day_to)
+    return qs if mart_ids is None else qs.filter(mart_id__in=mart_ids)
+
+
+def sales_summary(day_from: date, day_to: date, mart_ids: Optional[Set[int]] = None) -> Dict:
+    """Totals, a per-day series and per-mart totals for the range."""
+    qs = _scoped(models.MartDailySales.objects.all(), day_from, day_to, mart_ids)
+    sums = dict(orders=Sum("order_count"), items=Sum("item_qty"), revenue=Sum("revenue"))
+    totals = qs.aggregate(**sums)
+    days = qs.values("day").annotate(**sums).order_by("day")
+    marts = qs.values("mart_id", "mart__name").annotate(**sums).order_by("-revenue")
+    return {
+        "totals": {"orders": totals["orders"] or 0, "items": totals["items"] or 0, "revenue": _money(totals["revenue"])},
+        "days": [{"day": d["day"].isoformat(), "orders": d["orders"], "items": d["items"], "revenue": _money(d["revenue"])} for d in days],
+        "marts": [{"mart_id": m["mart_id"], "name": m["mart__name"], "orders": m["orders"], "items": m["items"], "revenue": _money(m["revenue"])} for m in marts],
+    }
+
+
+def top_products(day_from: date, day_to: date, mart_ids: Optional[Set[int]] = None, limit: int = 20, sort: str = "revenue") -> List[Dict]:
+    qs = _scoped(models.ProductDailySales.objects.all(), day_from, day_to, mart_ids)
+    rows = (
+        qs.values("product_id", "product__name", "mart_id")
+        .annotate(qty=Sum("qty"), revenue=Sum("revenue"), orders=Sum("order_count"))
+        .order_by(f"-{sort}", "product_id")[:limit]
+    )
+    return [
+        {"product_id": r["product_id"], "name": r["product__name"], "mart_id": r["mart_id"],
+         "qty": r["qty"], "orders": r["orders"], "revenue": _money(r["revenue"])}
+        for r in rows
+    ]
@@ -0,0 +1,280 @@
+# api/routing.py
+"""
+Multi-stop route planning for delivery partners.
+
+A partner's route covers every active delivery they hold: one pickup stop per mart
+(shared by all deliveries that need something from it, taken from ``OrderItem.mart``)
+and one drop stop per delivery. Drops may only be visited after all of their pickups.
+
+The route is built with nearest-neighbour and polished with precedence-aware 2-opt.
+When a single delivery is added or completed the stored route is patched in place
+(cheapest insertion / stop removal) instead of re-planned from scratch.
+
+The result is written to ``Delivery.route_data`` of every active delivery the partner
+holds, together with per-stop ETAs; ``estimated_time`` becomes the ETA of that
+delivery's own drop.
+"""
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import locations, models
+from .geo import haversine_km, eta_minutes_from_distance
+
+ACTIVE_STATUSES = ("assigned", "in_transit")
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _point(lat, lon) -> Optional[Tuple[float, float]]:
+    if lat is None or lon is None:
+        return None
+    return float(lat), float(lon)
+
+
+def _stop_km(a: Dict, b: Dict) -> float:
+    return haversine_km(a["lat"], a["lon"], b["lat"], b["lon"])
+
+
+# --------------------- route construction ---------------------
+def _feasible(stops: List[Dict]) -> bool:
+    """Every drop must come after all pickups of its delivery."""
+    picked = set()
+    for s in stops:
+        if s["type"] == "pickup":
+            picked.add(s["mart_id"])
+        elif not set(s["needs"]) <= picked:
+            return False
+    return True
+
+
+def _length(start: Tuple[float, float], stops: List[Dict]) -> float:
+    total = 0.0
+    lat, lon = start
+    for s in stops:
+        total += haversine_km(lat, lon, s["lat"], s["lon"])
+        lat, lon = s["lat"], s["lon"]
+    return total
+
+
+def nearest_neighbour(start: Tuple[float, float], stops: List[Dict]) -> List[Dict]:
+    remaining = list(stops)
+    route: List[Dict] = []
+    picked = set()
+    lat, lon = start
+    while remaining:
+        candidates = [s for s in remaining if s["type"] == "pickup" or set(s["needs"]) <= picked]
+        nxt = min(candidates, key=lambda s: haversine_km(lat, lon, s["lat"], s["lon"]))
+        remaining.remove(nxt)
+        route.append(nxt)
+        if nxt["type"] == "pickup":
+            picked.add(nxt["mart_id"])
+        lat, lon = nxt["lat"], nxt["lon"]
+    return route
+
+
+def two_opt(start: Tuple[float, float], route: List[Dict], max_passes: int = 10) -> List[Dict]:
+    """Reverse segments while that shortens the (open) route and keeps pickups before drops."""
+    best = list(route)
+    best_len = _length(start, best)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(len(best) - 1):
+            for j in range(i + 1, len(best)):
+                cand = best[:i] + best[i:j + 1][::-1] + best[j + 1:]
+                if not _feasible(cand):
+                    continue
+                cand_len = _length(start, cand)
+                if cand_len + 1e-9 < best_len:
+                    best, best_len, improved = cand, cand_len, True
+        if not improved:
+            break
+    return best
+
+
+def _cheapest_insert(start: Tuple[float, float], route: List[Dict], stop: Dict, after: int = -1) -> List[Dict]:
+    """Insert ``stop`` at the position (strictly after index ``after``) that adds the least distance."""
+    best_route, best_len = None, None
+    for pos in range(after + 1, len(route) + 1):
+        cand = route[:pos] + [stop] + route[pos:]
+        if not _feasible(cand):
+            continue
+        cand_len = _length(start, cand)
+        if best_len is None or cand_len < best_len:
+            best_route, best_len = cand, cand_len
+    return best_route if best_route is not None else route + [stop]
+
+
+def _with_etas(start: Tuple[float, float], route: List[Dict]) -> List[Dict]:
+    service_min = _setting("ROUTE_STOP_SERVICE_MIN", 3)
+    out = []
+    cum_km = 0.0
+    lat, lon = start
+    for n, s in enumerate(route):
+        cum_km += haversine_km(lat, lon, s["lat"], s["lon"])
+        lat, lon = s["lat"], s["lon"]
+        stop = dict(s)
+        stop["cum_km"] = round(cum_km, 3)
+        stop["eta_min"] = eta_minutes_from_distance(cum_km) + n * service_min
+        out.append(stop)
+    return out
+
+
+# --------------------- loading & persistence ---------------------
+def _load(partner_id: int):
+    """Return (active deliveries, {delivery_id: [pickup stop dicts]}, {delivery_id: drop stop dict})."""
+    deliveries = list(
+        models.Delivery.objects.filter(partner_id=partner_id, status__in=ACTIVE_STATUSES)
+        .select_related("order")
+        .order_by("created_at")
+    )
+    marts_by_order: Dict[int, Dict[int, Tuple[float, float]]] = {}
+    rows = (
+        models.OrderItem.objects.filter(order_id__in=[d.order_id for d in deliveries])
+        .values_list("order_id", "mart_id", "mart__location_lat", "mart__location_long")
+        .distinct()
+    )
+    for order_id, mart_id, lat, lon in rows:
+        pt = _point(lat, lon)
+        if pt:
+            marts_by_order.setdefault(order_id, {})[mart_id] = pt
+
+    pickups, drops = {}, {}
+    for d in deliveries:
+        # in_transit deliveries have already been collected
+        marts = {} if d.status == "in_transit" else marts_by_order.get(d.order_id, {})
+        pickups[d.delivery_id] = [
+            {"type": "pickup", "mart_id": mart_id, "lat": pt[0], "lon": pt[1], "delivery_ids": [d.delivery_id]}
+            for mart_id, pt in marts.items()
+        ]
+        drop_pt = _point(d.order.delivery_address_lat, d.order.delivery_address_long)
+        if drop_pt:
+            drops[d.delivery_id] = {
+                "type": "drop", "delivery_id": d.delivery_id, "order_id": d.order_id,
+                "lat": drop_pt[0], "lon": drop_pt[1], "needs": sorted(marts),
+            }
+    return deliveries, pickups, drops
+
+
+def _start_point(partner: models.DeliveryPartner, origin, stops) -> Optional[Tuple[float, float]]:
+    if origin:
+        return origin
+    pt = locations.tracker.position(partner.partner_id) or _point(partner.location_lat, partner.location_long)
+    if pt:
+        return pt
+    return (stops[0]["lat"], stops[0]["lon"]) if stops else None
+
+
+def _merge_pickups(pickups: Dict[int, List[Dict]]) -> List[Dict]:
+    by_mart: Dict[int, Dict] = {}
+    for stops in pickups.values():
+        for s in stops:
+            if s["mart_id"] in by_mart:
+                by_mart[s["mart_id"]]["delivery_ids"].extend(s["delivery_ids"])
+            else:
+                by_mart[s["mart_id"]] = dict(s, delivery_ids=list(s["delivery_ids"]))
+    return list(by_mart.values())
+
+
+def _save(deliveries, start, route) -> Dict:
+    route = _with_etas(start, route)
+    now = timezone.now()
+    data = {
+        "computed_at": now.isoformat(),
+        "start": [start[0], start[1]],
+        "total_km": route[-1]["cum_km"] if route else 0.0,
+        "stops": route,
+    }
+    eta_by_delivery = {s["delivery_id"]: (n, s["eta_min"]) for n, s in enumerate(route) if s["type"] == "drop"}
+    for d in deliveries:
+        idx, eta = eta_by_delivery.get(d.delivery_id, (None, None))
+        d.route_data = dict(data, stop_index=idx)
+        if eta is not None:
+            d.estimated_time = eta
+        d.updated_at = now
+    if deliveries:
+        models.Delivery.objects.bulk_update(deliveries, ["route_data", "estimated_time", "updated_at"])
+    return data
+
+
+def _stored_route(deliveries) -> Optional[Tuple[Tuple[float, float], List[Dict]]]:
+    for d in deliveries:
+        rd = d.route_data
+        if isinstance(rd, dict) and rd.get("stops") is not None and rd.get("start"):
+            strip = ("cum_km", "eta_min")
+            stops = [{k: v for k, v in s.items() if k not in strip} for s in rd["stops"]]
+            return (rd["start"][0], rd["start"][1]), stops
+    return None
+
+
+# --------------------- public API ---------------------
+def plan_route(partner: models.DeliveryPartner, origin: Optional[Tuple[float, float]] = None) -> Optional[Dict]:
+    """Full re-plan of ``partner``'s active deliveries. Returns the stored route dict (or None)."""
+    deliveries, pickups, drops = _load(partner.partner_id)
+    stops = _merge_pickups(pickups) + list(drops.values())
+    start = _start_point(partner, origin, stops)
+    if not deliveries or start is None:
+        return None
+    route = two_opt(start, nearest_neighbour(start, stops))
+    return _save(deliveries, start, route)
+
+
+def add_delivery(partner: models.DeliveryPartner, delivery_id: int, origin: Optional[Tuple[float, float]] = None) -> Optional[Dict]:
+    """Insert one newly assigned delivery into the partner's stored route (cheapest insertion)."""
+    deliveries, pickups, drops = _load(partner.partner_id)
+    stored = _stored_route([d for d in deliveries if d.delivery_id != delivery_id])
+    routed = {s.get("delivery_id") for s in stored[1] if s["type"] == "drop"} if stored else set()
+    expected = {d.delivery_id for d in deliveries if d.delivery_id != delivery_id and d.delivery_id in drops}
+    if not stored or routed != expected or delivery_id not in drops:
+        return plan_route(partner, origin=origin)
+
+    start, route = stored
+    if origin:
+        start = origin
+    for p in pickups.get(delivery_id, []):
+        existing = next((s for s in route if s["type"] == "pickup" and s["mart_id"] == p["mart_id"]), None)
+        if existing:
+            existing["delivery_ids"] = sorted(set(existing["delivery_ids"]) | {delivery_id})
+        else:
+            route = _cheapest_insert(start, route, p)
+    route = _cheapest_insert(start, route, drops[delivery_id])
+    route = two_opt(start, route, max_passes=2)
+    return _save(deliveries, start, route)
+
+
+def remove_delivery(partner: models.DeliveryPartner, delivery_id: int, origin: Optional[Tuple[float, float]] = None) -> Optional[Dict]:
+    """Drop a completed (or reassigned) delivery's stops and refresh ETAs for the rest."""
+    deliveries, pickups, drops = _load(partner.partner_id)
+    if not deliveries:
+        return None
+    stored = _stored_route(deliveries)
+    if not stored:
+        return plan_route(partner, origin=origin)
+    start, route = stored
+    if origin:
+        start = origin
+    active = {d.delivery_id for d in deliveries}
+    kept = []
+    for s in route:
+        if s["type"] == "drop":
+            if s["delivery_id"] != delivery_id and s["delivery_id"] in active:
+                kept.append(s)
+        else:
+            ids = [i for i in s["delivery_ids"] if i != delivery_id and i in active]
+            if ids:
+                kept.append(dict(s, delivery_ids=ids))
+    if {s["delivery_id"] for s in kept if s["type"] == "drop"} != set(drops):
+        return plan_route(partner, origin=origin)
+    return _save(deliveries, start, kept)
+
+
+def replan_quietly(fn, *args, **kwargs):
+    """Route planning is advisory: never let it fail the request that triggered it."""
+    try:
+        return fn(*args, **kwargs)
+    except Exception as e:
+        print(f"[routing] {getattr(fn, '__name__', fn)} failed: {e}")
+        return None
@@ -0,0 +1,226 @@
+# api/sentiment.py
+"""
+Offline, CPU-only sentiment scoring for ``Review.comment``.
+
+Scores come from a small valence lexicon (VADER-style: word weights on a -4..4
+scale, negation flips the next few words, intensifiers and "!" amplify, a "but"
+clause outweighs what came before) normalized into ``sentiment_score`` in
+[-1, 1]. ``SENTIMENT_LEXICON_PATH`` may point at a ``word<TAB>score`` file (the
+VADER lexicon format) that extends / overrides the built-in words.
+
+Nothing here runs on the review request path. ``score_pending`` (the
+``score_review_sentiment`` command, optionally ``--loop``) pages unscored reviews
+by id and keeps up to two batches per worker in flight on a process pool, so a
+backfill uses every core while the parent reads the next batch and writes the
+previous one. Each result batch is written with one ``bulk_update`` (only rows
+still unscored, in case a review was edited meanwhile); ``bulk_update`` skips
+signals, so the new scores are then added to each product's sentiment sum / count
+with ``UPDATE ... SET col = col + n`` in the same transaction, which leaves
+concurrent review writes to the aggregate intact.
+"""
+import math
+import os
+import re
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence
+
+from django.conf import settings
+from django.db import transaction
+
+from . import models, ratings
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+LEXICON: Dict[str, float] = {
+    # product / delivery experience
+    "fresh": 2.0, "tasty": 2.3, "delicious": 2.7, "crisp": 1.5, "ripe": 1.2, "juicy": 1.6, "soft": 0.8,
+    "quick": 1.4, "fast": 1.4, "prompt": 1.5, "ontime": 1.5, "polite": 1.8, "helpful": 1.9, "friendly": 1.8,
+    "cheap": 0.8, "affordable": 1.6, "worth": 1.7, "value": 1.2, "quality": 1.0, "genuine": 1.6,
+    "clean": 1.7, "neat": 1.5, "packed": 0.6, "sealed": 0.8, "recommend": 1.9, "recommended": 1.9,
+    "stale": -2.3, "rotten": -3.0, "spoiled": -2.6, "expired": -2.5, "mouldy": -2.8, "moldy": -2.8,
+    "soggy": -1.6, "bland": -1.4, "sour": -1.0, "smelly": -2.1, "stinks": -2.4, "raw": -0.6,
+    "late": -1.6, "delayed": -1.7, "slow": -1.4, "rude": -2.5, "missing": -1.8, "wrong": -1.8,
+    "damaged": -2.3, "broken": -2.2, "leaking": -2.1, "leaked": -2.1, "torn": -1.7, "dirty": -2.1,
+    "overpriced": -2.0, "expensive": -1.2, "costly": -1.1, "fake": -2.6, "refund": -0.9, "return": -0.4,
+    "cancelled": -1.2, "cold": -0.5, "small": -0.4, "tiny": -0.8,
+    # general valence
+    "good": 1.9, "great": 3.1, "excellent": 3.2, "amazing": 2.8, "awesome": 3.1, "perfect": 2.7,
+    "nice": 1.8, "love": 3.2, "loved": 2.9, "like": 1.5, "liked": 1.7, "happy": 2.7, "satisfied": 1.8,
+    "best": 3.2, "better": 1.9, "fine": 0.8, "ok": 0.9, "okay": 0.9, "decent": 1.4, "superb": 3.0,
+    "fantastic": 2.6, "wonderful": 2.7, "pleased": 1.9, "glad": 2.0, "thanks": 1.9, "thank": 1.5,
+    "bad": -2.5, "worst": -3.1, "terrible": -2.1, "awful": -2.0, "horrible": -2.5, "poor": -2.1,
+    "hate": -2.7, "hated": -3.2, "disappointed": -2.2, "disappointing": -2.2, "useless": -1.8,
+    "waste": -1.8, "problem": -1.7, "issue": -1.1, "complaint": -1.6, "unhappy": -1.8,
+    "worse": -2.1, "sad": -2.1, "angry": -2.3, "annoying": -1.9, "pathetic": -2.3, "disgusting": -2.4,
+}
+
+NEGATORS = {"not", "no", "never", "nothing", "none", "nor", "neither", "without", "hardly", "barely", "cannot"}
+INTENSIFIERS = {
+    "very": 0.293, "really": 0.293, "extremely": 0.293, "super": 0.293, "so": 0.293, "too": 0.293,
+    "totally": 0.293, "absolutely": 0.293, "highly": 0.293, "most": 0.293, "quite": 0.15,
+    "slightly": -0.293, "somewhat": -0.293, "little": -0.293, "kinda": -0.293,
+}
+_NEGATION_SCALE = -0.74
+_NEGATION_SPAN = 3
+_ALPHA = 15.0  # normalization constant: score / sqrt(score^2 + alpha)
+
+_TOKEN = re.compile(r"[a-z]+(?:n't|'[a-z]+)?|[!.,;]")
+
+_lexicon: Optional[Dict[str, float]] = None
+
+
+def load_lexicon(path: Optional[str] = None) -> Dict[str, float]:
+    lexicon = dict(LEXICON)
+    if path:
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) < 2 or not parts[0] or parts[0].startswith("#"):
+                    continue
+                try:
+                    lexicon[parts[0].lower()] = float(parts[1])
+                except ValueError:
+                    continue
+    return lexicon
+
+
+def _init_worker(path: Optional[str]):
+    global _lexicon
+    _lexicon = load_lexicon(path)
+
+
+def _active_lexicon() -> Dict[str, float]:
+    global _lexicon
+    if _lexicon is None:
+        _lexicon = load_lexicon(_setting("SENTIMENT_LEXICON_PATH", "") or None)
+    return _lexicon
+
+
+def score_text(text: str, lexicon: Dict[str, float]) -> float:
+    tokens = _TOKEN.findall((text or "").lower())
+    negate_left = 0
+    boost = 0.0
+    clause_start = 0  # index into `weights` where the current "but" clause begins
+    weights: List[float] = []
+    bangs = 0
+    for tok in tokens:
+        if tok == "!":
+            bangs += 1
+            negate_left = 0
+            continue
+        if tok in ".,;":
+            negate_left = 0  # negation doesn't cross punctuation
+            continue
+        if tok in NEGATORS or tok.endswith("n't"):
+            negate_left = _NEGATION_SPAN
+            continue
+        if tok == "but":
+            # what follows "but" dominates what came before it
+            weights[clause_start:] = [w * 0.5 for w in weights[clause_start:]]
+            clause_start = len(weights)
+            continue
+        if tok in INTENSIFIERS:
+            boost += INTENSIFIERS[tok]
+            continue
+        valence = lexicon.get(tok.replace("'", ""))
+        if valence is not None:
+            if boost:
+                valence += math.copysign(boost, valence)
+            if negate_left:
+                valence *= _NEGATION_SCALE
+            weights.append(valence)
+        boost = 0.0
+        negate_left = max(0, negate_left - 1)
+    if clause_start:
+        weights[clause_start:] = [w * 1.5 for w in weights[clause_start:]]
+    total = sum(weights)
+    if total and bangs:
+        total += math.copysign(min(bangs, 4) * 0.292, total)
+    return round(total / math.sqrt(total * total + _ALPHA), 4) if total else 0.0
+
+
+def score_texts(texts: Sequence[str]) -> List[float]:
+    """Score one batch; runs in a pool worker (lexicon loaded once per process)."""
+    lexicon = _active_lexicon()
+    return [score_text(t, lexicon) for t in texts]
+
+
+# ---------- batch job ----------
+def _unscored():
+    return (
+        models.Review.objects.filter(sentiment_score__isnull=True)
+        .exclude(comment__isnull=True).exclude(comment="")
+        .order_by("review_id")
+    )
+
+
+def _write(batch: List[tuple], scores: List[float]) -> int:
+    by_id = {review_id: score for (review_id, _product_id, _text), score in zip(batch, scores)}
+    product_of = {review_id: product_id for review_id, product_id, _text in batch}
+    with transaction.atomic():
+        still_unscored = list(
+            models.Review.objects.select_for_update()
+            .filter(pk__in=list(by_id), sentiment_score__isnull=True)
+            .values_list("review_id", flat=True)
+        )
+        models.Review.objects.bulk_update(
+            [models.Review(review_id=rid, sentiment_score=by_id[rid]) for rid in still_unscored],
+            ["sentiment_score"],
+        )
+        per_product: Dict[int, List[float]] = {}
+        for rid in still_unscored:
+            per_product.setdefault(product_of[rid], []).append(by_id[rid])
+        for product_id in sorted(per_product):
+            ratings.add_sentiment(product_id, sum(per_product[product_id]), len(per_product[product_id]))
+    return len(still_unscored)
+
+
+def score_pending(batch_size: Optional[int] = None, workers: Optional[int] = None, limit: Optional[int] = None) -> Dict:
+    """
+    Score every unscored review with a comment (at most ``limit``). ``workers`` defaults to
+    ``SENTIMENT_WORKERS`` or the CPU count; 1 scores inline.
+    """
+    started = time.monotonic()
+    batch_size = batch_size or _setting("SENTIMENT_BATCH_SIZE", 500)
+    workers = workers or _setting("SENTIMENT_WORKERS", 0) or os.cpu_count() or 1
+    totals = {"read": 0, "scored": 0, "batches": 0}
+
+    def batches():
+        after = 0
+        while limit is None or totals["read"] < limit:
+            size = batch_size if limit is None else min(batch_size, limit - totals["read"])
+            rows = list(_unscored().filter(review_id__gt=after).values_list("review_id", "product_id", "comment")[:size])
+            if not rows:
+                return
+            after = rows[-1][0]
+            totals["read"] += len(rows)
+            yield rows
+
+    def done(batch, scores):
+        totals["scored"] += _write(batch, scores)
+        totals["batches"] += 1
+
+    if workers == 1:
+        for batch in batches():
+            done(batch, score_texts([text for _rid, _pid, text in batch]))
+    else:
+        path = _setting("SENTIMENT_LEXICON_PATH", "") or None
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(path,)) as pool:
+            in_flight = deque()
+            for batch in batches():
+                in_flight.append((batch, pool.submit(score_texts, [text for _rid, _pid, text in batch])))
+                if len(in_flight) >= workers * 2:
+                    b, fut = in_flight.popleft()
+                    done(b, fut.result())
+            while in_flight:
+                b, fut = in_flight.popleft()
+                done(b, fut.result())
+
+    totals["workers"] = workers
+    totals["seconds"] = round(time.monotonic() - started, 2)
+    return totals
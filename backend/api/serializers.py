@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from . import models
+from . import models, ratings
 from .models import (
     User, Admin, Mart, Product, Offer, Review, Basket,
     Order, OrderItem, DeliveryPartner, Delivery, AnalyticsLog, Address
@@ -43,12 +43,13 @@ class ProductSerializer(serializers.ModelSerializer):
     mart_id = serializers.IntegerField(source="mart.mart_id", read_only=True)
     mart_name = serializers.CharField(source="mart.name", read_only=True)
     image_url = serializers.SerializerMethodField()
+    rating = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
         fields = [
             "product_id", "name", "category", "price",
-            "quality_score", "stock", "mart_id", "mart_name", "image_url",
+            "quality_score", "stock", "mart_id", "mart_name", "image_url", "rating",
         ]
 
     def get_image_url(self, obj):
@@ -56,6 +57,10 @@ class ProductSerializer(serializers.ModelSerializer):
         # fall back to a tiny placeholder if still empty
         return obj.image_url or "https://via.placeholder.com/80"
 
+    def get_rating(self, obj):
+        # {average, count, histogram, sentiment} from product_ratings (api/ratings.py)
+        return ratings.summary(obj)
+
 # -------------------- Review --------------------
 class ReviewSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
@@ -72,12 +77,33 @@ class OfferSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 # -------------------- Basket --------------------
+class BasketLineSerializer(serializers.ModelSerializer):
+    product_id = serializers.IntegerField(source="product.product_id", read_only=True)
+    name = serializers.CharField(source="product.name", read_only=True)
+    mart_id = serializers.IntegerField(source="product.mart_id", read_only=True)
+    image_url = serializers.CharField(source="product.image_url", read_only=True)
+    price = serializers.DecimalField(source="product.price", max_digits=10, decimal_places=2, read_only=True)
+    in_stock = serializers.SerializerMethodField()
+    line_total = serializers.SerializerMethodField()
+
+    class Meta:
+        model = models.BasketLine
+        fields = ["product_id", "name", "mart_id", "image_url", "quantity", "unit_price", "price", "in_stock", "line_total"]
+
+    def get_in_stock(self, obj):
+        return obj.product.is_active and obj.product.stock >= obj.quantity
+
+    def get_line_total(self, obj):
+        return str(obj.quantity * obj.unit_price)
+
+
 class BasketSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
+    lines = BasketLineSerializer(many=True, read_only=True)
 
     class Meta:
         model = Basket
-        fields = "__all__"
+        exclude = ["items"]  # legacy snapshot, no longer written; ``lines`` is the content
 
 # -------------------- OrderItem --------------------
 class OrderItemSerializer(serializers.ModelSerializer):
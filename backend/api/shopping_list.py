@@ -0,0 +1,232 @@
+# api/shopping_list.py
+"""
+Free-text shopping lists -> basket items (``POST /utils/parse-shopping-list/``).
+
+Each line ("2 kg rice", "milk x3", "half dozen eggs", "500g paneer") is split into a
+count, an optional amount + unit and the remaining product words. All lines are
+then matched in one pass against an in-process index of listed product names:
+character trigrams narrow each line to a few dozen names, ``difflib`` ranks them.
+The best names are resolved to in-stock products of approved marts with one query
+(or none, from the catalog snapshot), and weights are turned into unit counts via
+``unit_weight_kg``. The response carries ``basket_items`` in the shape
+``optimize_basket`` takes, so a list costs the client one round trip.
+
+The name index is rebuilt lazily when products change (``mark_dirty`` from the
+Product signals) and at least every ``SHOPPING_LIST_INDEX_TTL`` seconds, which
+covers bulk imports that skip signals.
+"""
+import math
+import re
+import threading
+import time
+from difflib import SequenceMatcher
+from fractions import Fraction
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+from . import catalog, models, ratings
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+# unit -> (kind, factor): mass/volume in kg (1 l ~ 1 kg), counts in pieces
+UNITS = {
+    "kg": ("kg", 1), "kgs": ("kg", 1), "kilo": ("kg", 1), "kilos": ("kg", 1), "kilogram": ("kg", 1), "kilograms": ("kg", 1),
+    "g": ("kg", 0.001), "gm": ("kg", 0.001), "gms": ("kg", 0.001), "gram": ("kg", 0.001), "grams": ("kg", 0.001), "gr": ("kg", 0.001),
+    "l": ("kg", 1), "lt": ("kg", 1), "ltr": ("kg", 1), "ltrs": ("kg", 1), "litre": ("kg", 1), "litres": ("kg", 1),
+    "liter": ("kg", 1), "liters": ("kg", 1),
+    "ml": ("kg", 0.001),
+    "pc": ("count", 1), "pcs": ("count", 1), "piece": ("count", 1), "pieces": ("count", 1), "nos": ("count", 1),
+    "pack": ("count", 1), "packs": ("count", 1), "packet": ("count", 1), "packets": ("count", 1),
+    "pkt": ("count", 1), "pkts": ("count", 1), "bottle": ("count", 1), "bottles": ("count", 1),
+    "dozen": ("count", 12), "dozens": ("count", 12),
+}
+NUMBER_WORDS = {
+    "a": 1, "an": 1, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6,
+    "seven": 7, "eight": 8, "nine": 9, "ten": 10, "half": 0.5, "quarter": 0.25,
+}
+FILLER = {"of", "x", "and", "some"}
+
+_SPLIT = re.compile(r"[\n,;]+")
+_BULLET = re.compile(r"^\s*(?:[-*•]+|\d+[.)])\s+")
+_TOKEN = re.compile(r"\d+(?:\.\d+)?(?:/\d+)?|[a-z]+")
+
+
+def _number(tok: str) -> Optional[float]:
+    if tok in NUMBER_WORDS:
+        return NUMBER_WORDS[tok]
+    if tok[0].isdigit():
+        try:
+            return float(Fraction(tok)) if "/" in tok else float(tok)
+        except (ValueError, ZeroDivisionError):
+            return None
+    return None
+
+
+def split_lines(text: str) -> List[str]:
+    return [line for line in (_BULLET.sub("", part).strip() for part in _SPLIT.split(text or "")) if line]
+
+
+def parse_line(raw: str) -> Dict:
+    """{"raw", "name", "quantity", "weight_kg"}: quantity counts units, weight_kg is the total asked for (or None)."""
+    tokens = _TOKEN.findall(raw.lower())
+    count: Optional[float] = None
+    weight_kg: Optional[float] = None
+    words = []
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        num = _number(tok)
+        nxt = tokens[i + 1] if i + 1 < len(tokens) else None
+        # "a"/"an" only count when a unit follows ("a dozen eggs"); otherwise they're filler
+        if num is not None and not (tok in ("a", "an") and nxt not in UNITS):
+            if nxt in UNITS:
+                kind, factor = UNITS[nxt]
+                if kind == "kg":
+                    weight_kg = (weight_kg or 0) + num * factor
+                else:
+                    count = (count or 1) * num * factor
+                i += 2
+                continue
+            count = (count or 1) * num
+            i += 1
+            continue
+        if tok not in FILLER and tok not in ("a", "an"):
+            words.append(tok)
+        i += 1
+    quantity = max(1, int(math.ceil(count - 1e-9))) if count else 1
+    if weight_kg is not None and count:
+        weight_kg *= count  # "2 x 500 g butter"
+    return {"raw": raw, "name": " ".join(words), "quantity": quantity, "weight_kg": weight_kg}
+
+
+# ---------- name index ----------
+def _normalize(name: str) -> str:
+    return " ".join(_TOKEN.findall((name or "").lower()))
+
+
+def _trigrams(text: str) -> set:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._built = 0.0
+        self._dirty = True
+        self.names: List[str] = []
+        self.normalized: List[str] = []
+        self.grams: Dict[str, List[int]] = {}
+
+    def mark_dirty(self):
+        self._dirty = True
+
+    def _ensure(self):
+        now = time.monotonic()
+        if not self._dirty and now - self._built < _setting("SHOPPING_LIST_INDEX_TTL", 60):
+            return
+        with self._lock:
+            if not self._dirty and now - self._built < _setting("SHOPPING_LIST_INDEX_TTL", 60):
+                return
+            self._dirty = False
+            names = sorted(set(
+                models.Product.objects.filter(is_active=True, mart__approved=True).values_list("name", flat=True)
+            ))
+            normalized = [_normalize(n) for n in names]
+            grams: Dict[str, List[int]] = {}
+            for idx, norm in enumerate(normalized):
+                for g in _trigrams(norm):
+                    grams.setdefault(g, []).append(idx)
+            self.names, self.normalized, self.grams = names, normalized, grams
+            self._built = time.monotonic()
+
+    def match_many(self, queries: List[str], limit: int = 3) -> List[List[Tuple[str, float]]]:
+        """Best ``limit`` (name, score) pairs per query, all against one index snapshot."""
+        self._ensure()
+        names, normalized, grams = self.names, self.normalized, self.grams
+        min_score = _setting("SHOPPING_LIST_MIN_SCORE", 0.55)
+        out = []
+        for q in queries:
+            q = _normalize(q)
+            if not q:
+                out.append([])
+                continue
+            q_grams = _trigrams(q)
+            q_words = set(q.split())
+            hits: Dict[int, int] = {}
+            for g in q_grams:
+                for idx in grams.get(g, ()):
+                    hits[idx] = hits.get(idx, 0) + 1
+            shortlist = sorted(hits, key=hits.get, reverse=True)[:50]
+            scored = []
+            for idx in shortlist:
+                cand = normalized[idx]
+                score = SequenceMatcher(None, q, cand).ratio()
+                cand_words = set(cand.split())
+                if q_words <= cand_words or cand_words <= q_words:
+                    score = max(score, 0.8)  # "milk" vs "toned milk", "packet milk" vs "milk"
+                if cand == q:
+                    score = 1.0
+                if score >= min_score:
+                    scored.append((names[idx], round(score, 3)))
+            scored.sort(key=lambda s: (-s[1], s[0]))
+            out.append(scored[:limit])
+        return out
+
+
+names = NameIndex()
+
+
+# ---------- resolution ----------
+def _listed(product_names) -> Dict[str, List[models.Product]]:
+    if catalog.enabled():
+        return catalog.snapshot.variants(product_names)
+    out: Dict[str, List[models.Product]] = {n: [] for n in product_names}
+    qs = models.Product.objects.filter(name__in=list(product_names), is_active=True, mart__approved=True, stock__gt=0)
+    for p in qs.select_related("mart", "rating"):
+        out[p.name].append(p)
+    return out
+
+
+def _units_for(line: Dict, product: models.Product) -> int:
+    if line["weight_kg"] is None:
+        return line["quantity"]
+    per_unit = float(product.unit_weight_kg or 1) or 1.0
+    return max(1, int(math.ceil(line["weight_kg"] / per_unit - 1e-9)))
+
+
+def resolve(text: str) -> Dict:
+    raw_lines = split_lines(text)[:_setting("SHOPPING_LIST_MAX_LINES", 200)]
+    lines = [parse_line(raw) for raw in raw_lines]
+    matches = names.match_many([line["name"] for line in lines])
+    products = _listed({name for found in matches for name, _score in found})
+
+    basket_items = []
+    unmatched = []
+    for line, found in zip(lines, matches):
+        candidates = []
+        for name, score in found:
+            listed = products.get(name) or []
+            if not listed:
+                continue
+            best = min(listed, key=lambda p: (float(p.price), -ratings.quality(p)))
+            candidates.append({
+                "name": name,
+                "score": score,
+                "product_id": best.product_id,
+                "mart_id": best.mart_id,
+                "price": str(best.price),
+                "unit_weight_kg": float(best.unit_weight_kg or 1),
+                "quantity": _units_for(line, best),
+                "offers": len(listed),
+            })
+        line["candidates"] = candidates
+        if candidates:
+            basket_items.append({"product_id": candidates[0]["product_id"], "quantity": candidates[0]["quantity"]})
+        else:
+            unmatched.append(line["raw"])
+    return {"items": raw_lines, "lines": lines, "basket_items": basket_items, "unmatched": unmatched}
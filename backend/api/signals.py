@@ -1,7 +1,9 @@
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
-from .models import Product
+from .authentication import invalidate_admin_principals
+from .models import Admin, Mart, Product, Review
 from .utils import fetch_product_image
+from . import catalog, optimize_cache, ratings, shopping_list
 
 @receiver(pre_save, sender=Product)
 def add_image_to_product(sender, instance, **kwargs):
@@ -11,3 +13,70 @@ def add_image_to_product(sender, instance, **kwargs):
     if not instance.image_url:
         query = f"{instance.name} {instance.category or ''}".strip()
         instance.image_url = fetch_product_image(query)
+
+
+@receiver(pre_save, sender=Product)
+def remember_listed_name(sender, instance, update_fields=None, **kwargs):
+    # the shopping-list name index only depends on name / is_active; price and stock edits leave it alone
+    if instance.pk is None:
+        instance._listing_changed = True
+    elif update_fields is not None and not {"name", "is_active"} & set(update_fields):
+        instance._listing_changed = False
+    else:
+        before = Product.objects.filter(pk=instance.pk).values_list("name", "is_active").first()
+        instance._listing_changed = before != (instance.name, instance.is_active)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_plans(sender, instance, **kwargs):
+    """
+    Memoized optimize results that used this product (or its name) are stale now,
+    and the in-memory catalog should pick the change up on its next read.
+    """
+    optimize_cache.bump_products([instance.product_id], [instance.name])
+    if kwargs.get("created") or getattr(instance, "_listing_changed", True):
+        shopping_list.names.mark_dirty()
+    if kwargs.get("signal") is post_delete:
+        catalog.snapshot.discard(instance.product_id)
+    else:
+        catalog.snapshot.mark_dirty()
+
+
+@receiver(post_save, sender=Mart)
+@receiver(post_delete, sender=Mart)
+def invalidate_mart_plans(sender, instance, **kwargs):
+    optimize_cache.bump_marts()
+    catalog.snapshot.mark_dirty()
+    shopping_list.names.mark_dirty()  # approval decides which names are listed
+    # a mart may have changed hands
+    invalidate_admin_principals()
+
+
+@receiver(post_save, sender=Admin)
+@receiver(post_delete, sender=Admin)
+def invalidate_admin_lookup(sender, instance, **kwargs):
+    invalidate_admin_principals()
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    # an edited review leaves the aggregate with its old values in post_save
+    instance._rated_before = None
+    if instance.pk:
+        instance._rated_before = (
+            Review.objects.filter(pk=instance.pk).values_list("product_id", "rating", "sentiment_score").first()
+        )
+
+
+@receiver(post_save, sender=Review)
+def add_review_to_rating(sender, instance, created, **kwargs):
+    before = getattr(instance, "_rated_before", None)
+    if before:
+        ratings.apply(*before, sign=-1)
+    ratings.apply(instance.product_id, instance.rating, instance.sentiment_score)
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_from_rating(sender, instance, **kwargs):
+    ratings.apply(instance.product_id, instance.rating, instance.sentiment_score, sign=-1)
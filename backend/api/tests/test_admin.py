@@ -1,4 +1,8 @@
+from unittest.mock import patch
+
+from django.db import connection
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth.hashers import make_password
 from api import models
@@ -49,3 +53,196 @@ class AdminAuthTests(TestCase):
         res2 = self.client.post(upd_url, data={'product_id': product.product_id, 'stock': 20}, content_type='application/json', HTTP_AUTHORIZATION=f'Token {token}')
         self.assertEqual(res2.status_code, 200)
         self.assertEqual(res2.json().get('stock'), 20)
+
+
+class BulkStockUpdateTests(TestCase):
+    def setUp(self):
+        staff = models.User.objects.create(username='martadmin', email='mart@example.com', password_hash='x', is_staff=True)
+        models.UserToken.objects.create(user=staff, token_key='marttoken')
+        mine = models.Admin.objects.create(username='martadmin', email='mart@example.com', password_hash='x')
+        other = models.Admin.objects.create(username='other', email='other@example.com', password_hash='x')
+        mart = models.Mart.objects.create(name='Mine', location_lat=17.0, location_long=83.0, admin=mine, approved=True)
+        foreign = models.Mart.objects.create(name='Theirs', location_lat=17.0, location_long=83.0, admin=other, approved=True)
+        self.products = [
+            models.Product.objects.create(mart=mart, name=f'P{i}', category='grocery', price=10, stock=5, image_url='')
+            for i in range(3)
+        ]
+        self.foreign = models.Product.objects.create(mart=foreign, name='F', category='grocery', price=10, stock=5, image_url='x')
+        self.client = Client(HTTP_AUTHORIZATION='Token marttoken')
+
+    def _post(self, updates):
+        return self.client.post(reverse('admin-bulk-update-stock'), data={'updates': updates}, content_type='application/json')
+
+    def test_per_row_results(self):
+        a, b, c = self.products
+        with patch('api.signals.fetch_product_image') as fetch:
+            resp = self._post([
+                {'product_id': a.pk, 'stock': 40},
+                {'product_id': b.pk, 'delta': -2},
+                {'product_id': b.pk, 'delta': -1},
+                {'product_id': c.pk, 'delta': -9},
+                {'product_id': self.foreign.pk, 'stock': 1},
+                {'product_id': 99999, 'stock': 1},
+                {'product_id': a.pk + 1000, 'stock': 'many'},
+            ])
+        fetch.assert_not_called()
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual((data['updated'], data['failed']), (2, 4))
+        statuses = {r['index']: r['status'] for r in data['results']}
+        self.assertEqual(statuses, {0: 'updated', 1: 'updated', 3: 'rejected', 4: 'forbidden', 5: 'not_found', 6: 'invalid'})
+        stocks = dict(models.Product.objects.values_list('product_id', 'stock'))
+        self.assertEqual((stocks[a.pk], stocks[b.pk], stocks[c.pk], stocks[self.foreign.pk]), (40, 2, 5, 5))
+
+    def test_non_integer_values_are_invalid(self):
+        a = self.products[0]
+        resp = self._post([
+            {'product_id': a.pk, 'stock': 2.7},
+            {'product_id': a.pk, 'delta': True},
+            {'product_id': a.pk, 'stock': '3.5'},
+            {'product_id': str(a.pk), 'stock': '12'},
+        ])
+        statuses = {r['index']: r['status'] for r in resp.json()['results']}
+        self.assertEqual(statuses, {0: 'invalid', 1: 'invalid', 2: 'invalid', 3: 'updated'})
+        self.assertEqual(models.Product.objects.get(pk=a.pk).stock, 12)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        many = [models.Product(mart=self.products[0].mart, name=f'Q{i}', category='grocery', price=1, stock=0, image_url='x') for i in range(50)]
+        models.Product.objects.bulk_create(many)
+        ids = list(models.Product.objects.filter(name__startswith='Q').values_list('pk', flat=True))
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self._post([{'product_id': pid, 'stock': 7} for pid in ids])
+        self.assertEqual(resp.json()['updated'], 50)
+        self.assertLess(len(ctx.captured_queries), 12)
+        self.assertEqual(models.Product.objects.filter(pk__in=ids, stock=7).count(), 50)
+
+
+class AdminPrincipalTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        staff = models.User.objects.create(username='MartAdmin', email='Mart@Example.com', password_hash='x', is_staff=True)
+        models.UserToken.objects.create(user=staff, token_key='marttoken')
+        self.admin = models.Admin.objects.create(username='martadmin', email='mart@example.com', password_hash='x')
+        self.other = models.Admin.objects.create(username='other', email='other@example.com', password_hash='x')
+        self.mart = models.Mart.objects.create(name='Mine', location_lat=17.0, location_long=83.0, admin=self.admin, approved=True)
+        self.product = models.Product.objects.create(mart=self.mart, name='P', category='grocery', price=10, stock=5, image_url='x')
+        self.client = Client(HTTP_AUTHORIZATION='Token marttoken')
+
+    def _update(self, stock):
+        return self.client.post(reverse('admin-update-stock'), data={'product_id': self.product.pk, 'stock': stock},
+                                content_type='application/json')
+
+    def test_resolved_once_then_served_from_cache(self):
+        self.assertEqual(self._update(7).status_code, 200)  # case-insensitive fallback match
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._update(8).status_code, 200)
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if 'FROM "admins"' in q['sql'] or 'FROM "marts"' in q['sql']])
+
+    def test_mart_reassignment_takes_effect(self):
+        self.assertEqual(self._update(7).status_code, 200)
+        self.mart.admin = self.other
+        self.mart.save()
+        self.assertEqual(self._update(8).status_code, 403)
+
+    def test_user_email_change_takes_effect(self):
+        self.assertEqual(self._update(7).status_code, 200)
+        models.User.objects.filter(username='MartAdmin').update(email='someone@example.com', username='someone')
+        self.assertEqual(self._update(8).status_code, 403)
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        staff = models.User.objects.create(username='martadmin', email='mart@example.com', password_hash='x', is_staff=True)
+        models.UserToken.objects.create(user=staff, token_key='marttoken')
+        mine = models.Admin.objects.create(username='martadmin', email='mart@example.com', password_hash='x')
+        other = models.Admin.objects.create(username='other', email='other@example.com', password_hash='x')
+        self.mart = models.Mart.objects.create(name='Mine', location_lat=17.0, location_long=83.0, admin=mine, approved=True)
+        self.foreign = models.Mart.objects.create(name='Theirs', location_lat=17.0, location_long=83.0, admin=other, approved=True)
+        self.milk = models.Product.objects.create(mart=self.mart, name='Milk', category='grocery', price=30, stock=50, image_url='x')
+        self.rice = models.Product.objects.create(mart=self.mart, name='Rice', category='grocery', price=60, stock=50, image_url='x')
+        self.bread = models.Product.objects.create(mart=self.foreign, name='Bread', category='grocery', price=40, stock=50, image_url='x')
+        self.customer = models.User.objects.create(username='cust', email='cust@example.com', password_hash='x')
+        self.client = Client(HTTP_AUTHORIZATION='Token marttoken')
+
+    def _order(self, *lines):
+        order = models.Order.objects.create(user=self.customer, total_cost=0, status='pending')
+        for product, qty in lines:
+            models.OrderItem.objects.create(order=order, product=product, mart=product.mart, quantity=qty, price_at_purchase=product.price)
+        return order
+
+    def _rows(self):
+        return (
+            sorted(models.MartDailySales.objects.values_list('mart_id', 'order_count', 'item_qty', 'revenue')),
+            sorted(models.ProductDailySales.objects.values_list('product_id', 'order_count', 'qty', 'revenue')),
+        )
+
+    def test_confirmation_updates_rollups_once(self):
+        from api import lifecycle
+        a = self._order((self.milk, 2), (self.rice, 1), (self.bread, 3))
+        b = self._order((self.milk, 1))
+        self._order((self.rice, 5))  # never confirmed: not a sale
+        lifecycle.confirm_orders([a.order_id, b.order_id])
+        lifecycle.confirm_orders([a.order_id])  # repeat confirmation changes nothing
+        marts, products = self._rows()
+        self.assertEqual(marts, [(self.mart.pk, 2, 4, 150), (self.foreign.pk, 1, 3, 120)])
+        self.assertEqual(products, [(self.milk.pk, 2, 3, 90), (self.rice.pk, 1, 1, 60), (self.bread.pk, 1, 3, 120)])
+
+        # a backfill from the raw tables lands on the same numbers
+        from django.core.management import call_command
+        from io import StringIO
+        models.ProductDailySales.objects.all().delete()
+        models.MartDailySales.objects.update(revenue=0)
+        call_command('backfill_sales_rollups', stdout=StringIO())
+        self.assertEqual(self._rows(), (marts, products))
+
+    def test_leaving_a_counted_status_subtracts(self):
+        from api import lifecycle, rollups
+        a = self._order((self.milk, 2))
+        lifecycle.confirm_orders([a.order_id])
+        rollups.record_transition([a.order_id], 'confirmed', 'delivered')
+        rollups.record_transition([a.order_id], 'confirmed', 'cancelled')
+        self.assertEqual(self._rows(), ([(self.mart.pk, 0, 0, 0)], [(self.milk.pk, 0, 0, 0)]))
+
+    def test_forcing_delivered_counts_orders_like_the_backfill(self):
+        from api import lifecycle
+        a = self._order((self.milk, 2))
+        b = self._order((self.rice, 1))
+        lifecycle.confirm_orders([b.order_id])
+        self.assertEqual(lifecycle.mark_delivered([a.order_id, b.order_id]), [a.order_id, b.order_id])
+        self.assertEqual(lifecycle.mark_delivered([a.order_id]), [])  # already delivered
+        marts, products = self._rows()
+        self.assertEqual(marts, [(self.mart.pk, 2, 3, 120)])
+
+        from django.core.management import call_command
+        from io import StringIO
+        call_command('backfill_sales_rollups', stdout=StringIO())
+        self.assertEqual(self._rows(), (marts, products))
+
+    def test_admin_fix_delivery_adds_pending_order_to_rollups(self):
+        root = models.User.objects.create(username='root', email='root@example.com', password_hash='x', is_staff=True, is_superuser=True)
+        models.UserToken.objects.create(user=root, token_key='roottoken')
+        order = self._order((self.milk, 2))
+        delivery = models.Delivery.objects.create(order=order, status='assigned')
+        resp = Client(HTTP_AUTHORIZATION='Token roottoken').post(reverse('admin-deliveries-fix', args=[delivery.pk]))
+        self.assertEqual((resp.status_code, resp.json()['after']['order_status']), (200, 'delivered'))
+        self.assertEqual(self._rows(), ([(self.mart.pk, 1, 2, 60)], [(self.milk.pk, 1, 2, 60)]))
+
+    def test_analytics_api_reads_rollups_scoped_to_managed_marts(self):
+        from api import lifecycle
+        lifecycle.confirm_orders([self._order((self.milk, 2), (self.bread, 1)).order_id,
+                                  self._order((self.rice, 3)).order_id])
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self.client.get(reverse('admin-analytics-sales'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if 'FROM "order' in q['sql'] or 'JOIN "order' in q['sql']])
+        data = resp.json()
+        self.assertEqual(data['totals'], {'orders': 2, 'items': 5, 'revenue': '240.00'})
+        self.assertEqual([m['mart_id'] for m in data['marts']], [self.mart.pk])
+
+        top = self.client.get(reverse('admin-analytics-top-products'), {'sort': 'qty', 'limit': 1}).json()
+        self.assertEqual([p['product_id'] for p in top['products']], [self.rice.pk])
+        self.assertEqual(self.client.get(reverse('admin-analytics-sales'), {'mart_id': self.foreign.pk}).status_code, 403)
+        self.assertEqual(self.client.get(reverse('admin-analytics-sales'), {'from': '2024-02-01', 'to': '2024-01-01'}).status_code, 400)
@@ -0,0 +1,75 @@
+from django.test import TestCase, Client, override_settings
+from api import models
+from api.audit import AuditLogWriter
+
+
+@override_settings(AUDIT_LOG_BUFFERED=True, AUDIT_LOG_FLUSH_INTERVAL=0, AUDIT_LOG_BATCH_SIZE=3, AUDIT_LOG_MAX_QUEUE=100)
+class AuditLogWriterTests(TestCase):
+    def setUp(self):
+        self.writer = AuditLogWriter()
+
+    def test_events_are_buffered_until_batch_is_full(self):
+        self.writer.log('otp_sent', {'destination': 'a@example.com'})
+        self.writer.log('otp_sent', {'destination': 'b@example.com'})
+        self.assertEqual(models.AnalyticsLog.objects.count(), 0)
+        self.assertEqual(self.writer.pending(), 2)
+
+        # third event fills the batch and triggers a bulk write
+        self.writer.log('otp_sent', {'destination': 'c@example.com'})
+        self.assertEqual(models.AnalyticsLog.objects.count(), 3)
+        self.assertEqual(self.writer.pending(), 0)
+        self.assertIn('"destination": "a@example.com"', models.AnalyticsLog.objects.order_by('log_id').first().details)
+
+    def test_flush_writes_partial_batch(self):
+        self.writer.log('partner_approved', {'partner_id': 7})
+        self.assertEqual(self.writer.flush(), 1)
+        self.assertEqual(models.AnalyticsLog.objects.get().action_type, 'partner_approved')
+
+    @override_settings(AUDIT_LOG_MAX_QUEUE=1)
+    def test_full_queue_falls_back_to_synchronous_write(self):
+        writer = AuditLogWriter()
+        writer.log('otp_sent', {'n': 1})
+        writer.log('otp_sent', {'n': 2})
+        # second event could not be queued, so it was written straight away
+        self.assertEqual(models.AnalyticsLog.objects.count(), 1)
+        writer.flush()
+        self.assertEqual(models.AnalyticsLog.objects.count(), 2)
+
+    @override_settings(AUDIT_LOG_BUFFERED=False)
+    def test_unbuffered_mode_writes_immediately(self):
+        self.writer.log('delivery_assigned', {'delivery_id': 1})
+        self.assertEqual(models.AnalyticsLog.objects.count(), 1)
+
+
+class AdminListLogsTests(TestCase):
+    def setUp(self):
+        admin_user = models.User.objects.create(username='root', email='root@example.com', password_hash='x', is_staff=True, is_superuser=True)
+        models.UserToken.objects.create(user=admin_user, token_key='roottoken')
+        self.client = Client(HTTP_AUTHORIZATION='Token roottoken')
+        writer = AuditLogWriter()
+        with override_settings(AUDIT_LOG_BUFFERED=False):
+            for i in range(5):
+                writer.log('delivery_assigned', {'delivery_id': 100 + i, 'partner_id': 1 if i % 2 else 2})
+            writer.log('partner_approved', {'partner_id': 1})
+
+    def test_entity_ids_are_stored_in_columns(self):
+        log = models.AnalyticsLog.objects.filter(action_type='partner_approved').get()
+        self.assertEqual(log.partner_id, 1)
+        self.assertIsNone(log.delivery_id)
+
+    def test_filters_and_keyset_pagination(self):
+        resp = self.client.get('/api/v1/admin/logs/', {'partner_id': 1, 'limit': 2})
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual([l['action_type'] for l in data['logs']], ['partner_approved', 'delivery_assigned'])
+        self.assertIsNotNone(data['next_before'])
+
+        resp = self.client.get('/api/v1/admin/logs/', {'partner_id': 1, 'limit': 2, 'before': data['next_before']})
+        data = resp.json()
+        self.assertEqual(len(data['logs']), 1)
+        self.assertEqual(data['logs'][0]['delivery_id'], 101)
+        self.assertIsNone(data['next_before'])
+
+    def test_bad_filter_returns_400(self):
+        resp = self.client.get('/api/v1/admin/logs/', {'before': 'abc'})
+        self.assertEqual(resp.status_code, 400)
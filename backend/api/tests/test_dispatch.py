@@ -0,0 +1,159 @@
+import random
+
+from django.test import TestCase, override_settings
+from api import models, dispatch, lifecycle, locations
+from api.geo import GridIndex, haversine_km
+
+
+class GridIndexTests(TestCase):
+    def test_nearest_matches_brute_force(self):
+        rng = random.Random(7)
+        index = GridIndex(cell_km=1.0)
+        points = {}
+        for i in range(300):
+            lat, lon = 17.6 + rng.random() * 0.3, 83.1 + rng.random() * 0.3
+            points[i] = (lat, lon)
+            index.upsert(i, lat, lon)
+        # move a few points to exercise re-bucketing
+        for i in range(0, 300, 10):
+            lat, lon = 17.6 + rng.random() * 0.3, 83.1 + rng.random() * 0.3
+            points[i] = (lat, lon)
+            index.upsert(i, lat, lon)
+        index.remove(5)
+        points.pop(5)
+
+        q = (17.75, 83.25)
+        expected = sorted(points, key=lambda k: haversine_km(q[0], q[1], *points[k]))[:5]
+        self.assertEqual([key for _, key in index.nearest(q[0], q[1], k=5)], expected)
+        self.assertEqual(len(index), 299)
+
+        allowed = set(range(0, 300, 3)) - {5}
+        expected = sorted(allowed, key=lambda k: haversine_km(q[0], q[1], *points[k]))[:5]
+        self.assertEqual([key for _, key in index.nearest(q[0], q[1], k=5, keys=allowed)], expected)
+
+
+class DispatchTests(TestCase):
+    def setUp(self):
+        user = models.User.objects.create(username='cust', email='cust@example.com', password_hash='x')
+        admin = models.Admin.objects.create(username='adm', password_hash='x')
+        self.mart_far = models.Mart.objects.create(name='Far', location_lat=17.90, location_long=83.40, admin=admin, approved=True)
+        self.mart_near = models.Mart.objects.create(name='Near', location_lat=17.70, location_long=83.20, admin=admin, approved=True)
+        self.deliveries = {}
+        for key, mart in (('far', self.mart_far), ('near', self.mart_near)):
+            product = models.Product.objects.create(mart=mart, name=f'P {key}', category='grocery', price=10, stock=5, image_url='x')
+            order = models.Order.objects.create(user=user, total_cost=10, status='confirmed',
+                                                delivery_address_lat=17.69, delivery_address_long=83.21)
+            models.OrderItem.objects.create(order=order, product=product, mart=mart, quantity=1, price_at_purchase=10)
+            # 'far' is created first, so FIFO would hand it out first
+            self.deliveries[key] = models.Delivery.objects.create(order=order, partner=None)
+        self.partner = models.DeliveryPartner.objects.create(name='Ravi', approved=True, availability=True,
+                                                             location_lat=17.705, location_long=83.205)
+
+    @override_settings(DISPATCH_PARTNER_CAPACITY=1)
+    def test_batch_assigns_nearest_delivery_not_oldest(self):
+        assigned = dispatch.dispatch_pending()
+        self.assertEqual(assigned, [(self.deliveries['near'].delivery_id, self.partner.partner_id)])
+        d = models.Delivery.objects.get(pk=self.deliveries['near'].delivery_id)
+        self.assertEqual(d.partner_id, self.partner.partner_id)
+        self.assertIsNotNone(d.estimated_time)
+        self.assertIsNone(models.Delivery.objects.get(pk=self.deliveries['far'].delivery_id).partner_id)
+
+    @override_settings(DISPATCH_PARTNER_CAPACITY=1)
+    def test_busy_partner_gets_nothing_until_free(self):
+        dispatch.dispatch_pending()
+        # capacity 1: second batch must not stack another delivery on the same partner
+        self.assertEqual(dispatch.dispatch_pending(), [])
+
+    @override_settings(DISPATCH_PARTNER_CAPACITY=1)
+    def test_live_position_comes_from_tracker_index(self):
+        # stored position is next to 'near', the live ping is at 'far'
+        locations.tracker.ping(self.partner.partner_id, 17.90, 83.40)
+        self.addCleanup(locations.tracker.forget, self.partner.partner_id)
+        assigned = dispatch.dispatch_pending()
+        self.assertEqual(assigned, [(self.deliveries['far'].delivery_id, self.partner.partner_id)])
+
+    @override_settings(DISPATCH_PARTNER_CAPACITY=2, DISPATCH_MAX_PICKUP_KM=5.0)
+    def test_out_of_range_delivery_stays_pending(self):
+        # 'far' is ~30 km from the partner: not handed to them just because they have room
+        assigned = dispatch.dispatch_pending()
+        self.assertEqual(assigned, [(self.deliveries['near'].delivery_id, self.partner.partner_id)])
+        self.assertIsNone(models.Delivery.objects.get(pk=self.deliveries['far'].delivery_id).partner_id)
+
+    @override_settings(DISPATCH_PARTNER_CAPACITY=3)
+    def test_delivery_without_pickup_falls_back_to_fifo(self):
+        order = models.Order.objects.create(user=self.deliveries['far'].order.user, total_cost=10, status='confirmed')
+        no_pickup = models.Delivery.objects.create(order=order, partner=None)  # no items: no mart to measure from
+        assigned = dict(dispatch.dispatch_pending())
+        self.assertEqual(assigned[no_pickup.delivery_id], self.partner.partner_id)
+
+    @override_settings(DISPATCH_PARTNER_CAPACITY=2, DISPATCH_MAX_PICKUP_KM=5.0)
+    def test_freed_partner_gets_nearest_delivery_only(self):
+        other = models.DeliveryPartner.objects.create(name='Asha', approved=True, availability=True,
+                                                      location_lat=17.90, location_long=83.40)
+        self.assertEqual(dispatch.assign_next_for_partner(self.partner), self.deliveries['near'].delivery_id)
+        d = models.Delivery.objects.get(pk=self.deliveries['near'].delivery_id)
+        self.assertIsNotNone(d.estimated_time)
+        # nothing else in range; the backlog isn't dispatched to other partners on this call
+        self.assertIsNone(dispatch.assign_next_for_partner(self.partner))
+        self.assertFalse(models.Delivery.objects.filter(partner=other).exists())
+
+    @override_settings(DISPATCH_PARTNER_CAPACITY=1)
+    def test_fifo_pick_respects_capacity(self):
+        self.partner.location_lat = None
+        self.partner.location_long = None
+        self.partner.save()
+        self.assertEqual(dispatch.assign_next_for_partner(self.partner), self.deliveries['far'].delivery_id)
+        self.assertIsNone(dispatch.assign_next_for_partner(self.partner))
+        self.assertIsNone(models.Delivery.objects.get(pk=self.deliveries['near'].delivery_id).partner_id)
+
+    def test_partner_without_position_falls_back_to_oldest(self):
+        self.partner.location_lat = None
+        self.partner.location_long = None
+        self.partner.save()
+        next_id = dispatch.assign_next_for_partner(self.partner)
+        self.assertEqual(next_id, self.deliveries['far'].delivery_id)
+
+
+class ConfirmOrdersTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create(username='cust', email='cust@example.com', password_hash='x')
+        admin = models.Admin.objects.create(username='adm', password_hash='x')
+        self.mart = models.Mart.objects.create(name='Near', location_lat=17.70, location_long=83.20, admin=admin, approved=True)
+        self.product = models.Product.objects.create(mart=self.mart, name='Rice', category='grocery', price=10, stock=5, image_url='x')
+
+    def _order(self, status='pending'):
+        order = models.Order.objects.create(user=self.user, total_cost=10, status=status,
+                                            delivery_address_lat=17.75, delivery_address_long=83.25)
+        models.OrderItem.objects.create(order=order, product=self.product, mart=self.mart, quantity=1, price_at_purchase=10)
+        return order
+
+    def test_confirm_creates_one_delivery_per_order(self):
+        o1, o2, cancelled = self._order(), self._order(), self._order(status='cancelled')
+        created = lifecycle.confirm_orders([o1.order_id, o2.order_id, cancelled.order_id])
+        self.assertEqual(sorted(created), [o1.order_id, o2.order_id])
+        self.assertEqual(models.Order.objects.get(pk=o1.order_id).status, 'confirmed')
+        d = models.Delivery.objects.get(order=o1)
+        self.assertIsNone(d.partner_id)
+        self.assertGreater(d.estimated_time, 0)
+        self.assertFalse(models.Delivery.objects.filter(order=cancelled).exists())
+
+        # verify + webhook for the same payment must not duplicate the delivery
+        self.assertEqual(lifecycle.confirm_orders([o1.order_id]), [])
+        self.assertEqual(models.Delivery.objects.filter(order=o1).count(), 1)
+
+    def test_confirm_queues_dispatch_after_commit(self):
+        partner = models.DeliveryPartner.objects.create(name='Ravi', approved=True, location_lat=17.70, location_long=83.20)
+        order = self._order()
+        with self.captureOnCommitCallbacks(execute=True):
+            lifecycle.confirm_orders([order.order_id])
+        self.assertEqual(models.Delivery.objects.get(order=order).partner_id, partner.partner_id)
+
+    def test_confirm_dispatches_only_its_own_deliveries(self):
+        partner = models.DeliveryPartner.objects.create(name='Ravi', approved=True, location_lat=17.70, location_long=83.20)
+        backlog = models.Delivery.objects.create(order=self._order(status='confirmed'), partner=None)
+        order = self._order()
+        with self.captureOnCommitCallbacks(execute=True):
+            lifecycle.confirm_orders([order.order_id])
+        self.assertEqual(models.Delivery.objects.get(order=order).partner_id, partner.partner_id)
+        # older backlog is left to the dispatch command
+        self.assertIsNone(models.Delivery.objects.get(pk=backlog.pk).partner_id)
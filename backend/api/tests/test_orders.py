@@ -1,4 +1,5 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
+from django.utils import timezone
 from api import models
 from decimal import Decimal
 from unittest.mock import patch
@@ -144,6 +145,21 @@ class TestCreateFromPlan(TestCase):
         # order should be created, but items may be fewer than requested
         self.assertTrue(len(data['orders']) >= 1)
 
+    def test_create_from_plan_skips_delisted_products(self):
+        self.p2.is_active = False
+        self.p2.save(update_fields=['is_active'])
+        plan = {'marts': [{'mart_id': self.mart.mart_id, 'items': [
+            {'product_id': self.p1.product_id, 'qty': 1},
+            {'product_id': self.p2.product_id, 'qty': 1},
+        ]}]}
+        resp = self.client.post('/api/v1/orders/create-from-plan/',
+                                {'plan': plan, 'address_id': self.addr.address_id, 'contact_number': '9999999999'},
+                                content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        order_ids = [o['order_id'] for o in resp.json()['orders']]
+        self.assertEqual(list(models.OrderItem.objects.filter(order_id__in=order_ids).values_list('product_id', flat=True)),
+                         [self.p1.product_id])
+
     def test_create_from_plan_with_missing_product_skips(self):
         """If a product id in the plan doesn't exist, it should be skipped without failing the whole plan."""
         url = '/api/v1/orders/create-from-plan/'
@@ -166,3 +182,533 @@ class TestCreateFromPlan(TestCase):
         self.assertEqual(resp.status_code, 400)
         data = resp.json()
         self.assertIn('error', data)
+
+
+class TestCheckout(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create(username='buyer', email='buyer@example.com', password_hash='x')
+        models.UserToken.objects.create(user=self.user, token_key='buyertoken')
+        admin = models.Admin.objects.create(username='adm', email='adm@example.com', password_hash='x')
+        self.near = models.Mart.objects.create(name='Near', location_lat=17.69, location_long=83.22, admin=admin, approved=True)
+        self.far = models.Mart.objects.create(name='Far', location_lat=17.80, location_long=83.35, admin=admin, approved=True)
+        self.rice = models.Product.objects.create(mart=self.near, name='Rice', category='grocery', price=50, stock=10, unit_weight_kg=1, image_url='x')
+        self.milk = models.Product.objects.create(mart=self.far, name='Milk', category='dairy', price=30, stock=10, unit_weight_kg=1, image_url='x')
+        models.Address.objects.create(user=self.user, line1='Addr', city='Visakhapatnam', state='AP', pincode='530029',
+                                      location_lat=17.6868, location_long=83.2185, is_default=True)
+        self.client = Client(HTTP_AUTHORIZATION='Token buyertoken')
+        self.items = [{'product_id': self.rice.product_id, 'quantity': 2}, {'product_id': self.milk.product_id, 'quantity': 1}]
+
+    def test_cod_checkout_creates_orders_per_mart(self):
+        resp = self.client.post('/api/v1/checkout/', {'items': self.items, 'contact_number': '999', 'payment_method': 'cod'},
+                                content_type='application/json')
+        self.assertEqual(resp.status_code, 201, resp.content)
+        data = resp.json()
+        self.assertIsNone(data['payment'])
+        self.assertEqual(len(data['orders']), 2)
+        self.assertEqual(sum(float(o['total_cost']) for o in data['orders']), data['result']['grand_total'])
+        self.assertEqual(models.OrderItem.objects.filter(order__user=self.user).count(), 2)
+
+    def test_razorpay_checkout_links_one_payment_to_every_order(self):
+        class FakeClient:
+            key_id = 'rzp_test'
+
+            def create_order(self, amount_paise, currency='INR', receipt=None, notes=None):
+                return {'id': 'order_rz', 'amount': amount_paise}
+
+        with patch('api.payment_gateway.get_client', return_value=FakeClient()):
+            resp = self.client.post('/api/v1/checkout/', {'items': self.items, 'contact_number': '999'},
+                                    content_type='application/json')
+        self.assertEqual(resp.status_code, 201, resp.content)
+        data = resp.json()
+        payment = models.Payment.objects.get(pk=data['payment']['payment_id'])
+        self.assertEqual(payment.provider_order_id, 'order_rz')
+        self.assertEqual(float(payment.amount), data['result']['grand_total'])
+        order_ids = sorted(o['order_id'] for o in data['orders'])
+        self.assertEqual(sorted(payment.checkout_orders.values_list('order_id', flat=True)), order_ids)
+
+        # a successful payment confirms every order of the checkout
+        payment.status = 'success'
+        payment.save()
+        from api import lifecycle
+        self.assertEqual(sorted(lifecycle.confirm_orders_for_payments([payment])), order_ids)
+
+    def test_provider_failure_fails_payment_and_cancels_orders(self):
+        from api import payment_gateway
+
+        class FailingClient:
+            key_id = 'rzp_test'
+
+            def create_order(self, *args, **kwargs):
+                raise payment_gateway.GatewayError('create_order: HTTP 500', status_code=500, body='boom')
+
+        with patch('api.payment_gateway.get_client', return_value=FailingClient()):
+            resp = self.client.post('/api/v1/checkout/', {'items': self.items, 'contact_number': '999'},
+                                    content_type='application/json')
+        self.assertEqual(resp.status_code, 502)
+        # orders and payment were committed before the provider call
+        self.assertEqual(models.Payment.objects.get().status, 'failed')
+        self.assertEqual(set(models.Order.objects.filter(user=self.user).values_list('status', flat=True)), {'cancelled'})
+
+
+class TestCachedPlan(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = models.User.objects.create(username='buyer', email='buyer@example.com', password_hash='x')
+        models.UserToken.objects.create(user=self.user, token_key='buyertoken')
+        admin = models.Admin.objects.create(username='adm', email='adm@example.com', password_hash='x')
+        mart = models.Mart.objects.create(name='Near', location_lat=17.69, location_long=83.22, admin=admin, approved=True)
+        self.rice = models.Product.objects.create(mart=mart, name='Rice', category='grocery', price=50, stock=10, unit_weight_kg=1, image_url='x')
+        models.Address.objects.create(user=self.user, line1='Addr', city='Visakhapatnam', state='AP', pincode='530029',
+                                      location_lat=17.6868, location_long=83.2185, is_default=True)
+        self.client = Client(HTTP_AUTHORIZATION='Token buyertoken')
+
+    def _plan_id(self):
+        resp = self.client.post('/api/v1/basket/optimize/', {'items': [{'product_id': self.rice.product_id, 'quantity': 3}]},
+                                content_type='application/json')
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return resp.json()['plan_id']
+
+    def _order(self, plan_id, client=None):
+        return (client or self.client).post('/api/v1/orders/from-plan/', {'plan_id': plan_id, 'contact_number': '999'},
+                                            content_type='application/json')
+
+    def test_plan_id_creates_orders_once(self):
+        plan_id = self._plan_id()
+        resp = self._order(plan_id)
+        self.assertEqual(resp.status_code, 200, resp.content)
+        self.assertEqual(len(resp.json()['orders']), 1)
+        self.assertEqual(models.OrderItem.objects.get(order__user=self.user).quantity, 3)
+        # single use
+        self.assertEqual(self._order(plan_id).status_code, 410)
+
+    def test_claimed_plan_rejects_concurrent_submit(self):
+        from api import checkout
+        plan_id = self._plan_id()
+        # another request claimed the plan and is still creating its orders
+        checkout.claim_plan(plan_id, self.user)
+        self.assertEqual(self._order(plan_id).status_code, 410)
+        self.assertFalse(models.Order.objects.filter(user=self.user).exists())
+        # a failed attempt releases its claim
+        checkout.release_plan(plan_id, self.user)
+        self.assertEqual(self._order(plan_id).status_code, 200)
+
+    def test_unrelated_update_still_orders(self):
+        plan_id = self._plan_id()
+        self.rice.stock = 5
+        self.rice.save()
+        self.assertEqual(self._order(plan_id).status_code, 200)
+
+    def test_price_change_is_reported(self):
+        plan_id = self._plan_id()
+        self.rice.price = 55
+        self.rice.save()
+        resp = self._order(plan_id)
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()['changes'][0]['reason'], 'price_changed')
+        self.assertFalse(models.Order.objects.filter(user=self.user).exists())
+
+    def test_stock_shortfall_is_reported(self):
+        plan_id = self._plan_id()
+        self.rice.stock = 2
+        self.rice.save()
+        resp = self._order(plan_id)
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(resp.json()['changes'][0]['reason'], 'insufficient_stock')
+
+    def test_plan_id_is_bound_to_user(self):
+        plan_id = self._plan_id()
+        other = models.User.objects.create(username='other', email='o@example.com', password_hash='x')
+        models.UserToken.objects.create(user=other, token_key='othertoken')
+        self.assertEqual(self._order(plan_id, Client(HTTP_AUTHORIZATION='Token othertoken')).status_code, 400)
+        self.assertEqual(self._order(plan_id + 'x').status_code, 400)
+
+
+class TestOptimizeCache(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+        self.user = models.User.objects.create(username='buyer', email='buyer@example.com', password_hash='x')
+        models.UserToken.objects.create(user=self.user, token_key='buyertoken')
+        admin = models.Admin.objects.create(username='adm', email='adm@example.com', password_hash='x')
+        self.mart = models.Mart.objects.create(name='Near', location_lat=17.69, location_long=83.22, admin=admin, approved=True)
+        self.rice = models.Product.objects.create(mart=self.mart, name='Rice', category='grocery', price=50, stock=10, unit_weight_kg=1, image_url='x')
+        models.Address.objects.create(user=self.user, line1='Addr', city='Visakhapatnam', state='AP', pincode='530029',
+                                      location_lat=17.6868, location_long=83.2185, is_default=True)
+        self.client = Client(HTTP_AUTHORIZATION='Token buyertoken')
+
+    def _optimize(self):
+        resp = self.client.post('/api/v1/basket/optimize/', {'items': [{'product_id': self.rice.product_id, 'quantity': 2}]},
+                                content_type='application/json')
+        self.assertEqual(resp.status_code, 200, resp.content)
+        return resp.json()
+
+    def test_repeat_is_served_from_cache_until_catalog_changes(self):
+        from api import checkout
+        with patch('api.checkout.optimize', wraps=checkout.optimize) as spy:
+            first = self._optimize()
+            second = self._optimize()
+            self.assertEqual(spy.call_count, 1)
+            self.assertEqual(first['result'], second['result'])
+            self.assertNotEqual(first['plan_id'], second['plan_id'])
+
+            self.rice.price = 40
+            self.rice.save()
+            self.assertEqual(self._optimize()['result']['items_price'], 80.0)
+            self.assertEqual(spy.call_count, 2)
+
+            self.mart.approved = False
+            self.mart.save()
+            resp = self.client.post('/api/v1/basket/optimize/', {'items': [{'product_id': self.rice.product_id, 'quantity': 2}]},
+                                    content_type='application/json')
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(spy.call_count, 3)
+
+    def test_write_during_compute_leaves_entry_stale(self):
+        from api import checkout
+        original = checkout.optimize
+
+        def optimize_then_reprice(ctx, items, allow_swaps=True):
+            plan = original(ctx, items, allow_swaps=allow_swaps)
+            models.Product.objects.filter(pk=self.rice.pk).update(price=45)
+            self.rice.refresh_from_db()
+            self.rice.save()  # signal bumps the product's generation mid-computation
+            return plan
+
+        with patch('api.checkout.optimize', side_effect=optimize_then_reprice):
+            self.assertEqual(self._optimize()['result']['items_price'], 100.0)
+        self.assertEqual(self._optimize()['result']['items_price'], 90.0)
+
+    def test_concurrent_identical_calls_share_one_computation(self):
+        import threading
+        import time
+        from api.optimize_cache import SingleFlight
+
+        flights, gate, calls, results = SingleFlight(), threading.Event(), [], []
+
+        def slow():
+            calls.append(1)
+            gate.wait(2)
+            return {'ok': True}
+
+        threads = [threading.Thread(target=lambda: results.append(flights.do('k', slow))) for _ in range(5)]
+        for t in threads:
+            t.start()
+        time.sleep(0.2)  # let every caller reach the in-flight computation
+        gate.set()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'ok': True}] * 5)
+
+
+@override_settings(CATALOG_SNAPSHOT=True, CATALOG_REFRESH_INTERVAL=3600)
+class TestCatalogSnapshot(TestCase):
+    def setUp(self):
+        from api import catalog
+        self.user = models.User.objects.create(username='buyer', email='buyer@example.com', password_hash='x')
+        admin = models.Admin.objects.create(username='adm', email='adm@example.com', password_hash='x')
+        self.near = models.Mart.objects.create(name='Near', location_lat=17.69, location_long=83.22, admin=admin, approved=True)
+        self.far = models.Mart.objects.create(name='Far', location_lat=17.80, location_long=83.35, admin=admin, approved=True)
+        self.rice = models.Product.objects.create(mart=self.near, name='Rice', category='grocery', price=50, stock=10, unit_weight_kg=1, image_url='x')
+        self.cheap = models.Product.objects.create(mart=self.far, name='Rice', category='grocery', price=20, stock=5, unit_weight_kg='0.5', image_url='x')
+        self.addr = models.Address.objects.create(user=self.user, line1='Addr', city='Visakhapatnam', state='AP', pincode='530029',
+                                                  location_lat=17.6868, location_long=83.2185, is_default=True)
+        self.snapshot = catalog.snapshot
+        self.snapshot.refresh(force=True)
+
+    def _ctx(self):
+        from api import checkout
+        return checkout.CheckoutContext(self.user, self.addr, 17.6868, 83.2185)
+
+    def test_optimize_reads_no_products_from_db(self):
+        from api import checkout
+        ctx = self._ctx()
+        with self.assertNumQueries(0):
+            ctx.load_products([self.rice.product_id], with_variants=True)
+            plan = checkout.optimize(ctx, [{'product_id': self.rice.product_id, 'quantity': 2}])
+        self.assertEqual(plan['result']['marts'][0]['items'][0]['qty'], 2)
+        self.assertEqual(len(ctx.variants_by_name['Rice']), 2)
+        self.assertEqual(ctx.products[self.cheap.product_id].unit_weight_kg, Decimal('0.5'))
+
+    def test_incremental_refresh_and_orders_use_db_prices(self):
+        from api import checkout
+        models.Product.objects.filter(pk=self.cheap.pk).update(price=25, updated_at=timezone.now())
+        ctx = self._ctx()
+        ctx.load_products([self.cheap.product_id])
+        self.assertEqual(ctx.products[self.cheap.product_id].price, Decimal('20'))  # not refreshed yet
+
+        orders = checkout.create_orders(ctx, [{'mart_id': self.far.mart_id, 'items': [{'product_id': self.cheap.product_id, 'qty': 1}]}], '999')
+        self.assertEqual(models.OrderItem.objects.get(order_id=orders[0]['order_id']).price_at_purchase, Decimal('25'))
+
+        self.snapshot.mark_dirty()
+        self.assertEqual(self.snapshot.products([self.cheap.product_id])[self.cheap.product_id].price, Decimal('25'))
+
+    def test_first_load_runs_in_background_not_on_the_request(self):
+        from api import catalog
+        snap = catalog.CatalogSnapshot()
+        with patch.object(snap, 'start') as start, self.assertNumQueries(0):
+            self.assertEqual(snap.products([self.rice.product_id]), {})
+        start.assert_called_once()
+        snap.load()
+        self.assertEqual(snap.products([self.rice.product_id])[self.rice.product_id].price, Decimal('50'))
+
+    @override_settings(CATALOG_REFRESH_ASYNC=True)
+    def test_incremental_refresh_runs_in_background(self):
+        self.snapshot.mark_dirty()
+        with patch.object(self.snapshot, '_apply_changes') as apply_changes, self.assertNumQueries(0):
+            self.assertIn(self.rice.product_id, self.snapshot.products([self.rice.product_id]))
+            self.snapshot._refresher.join()
+        apply_changes.assert_called_once_with()
+
+    def test_delete_and_unapproved_mart_drop_out(self):
+        self.cheap.delete()
+        self.assertEqual(self.snapshot.variants(['Rice'])['Rice'][0].product_id, self.rice.product_id)
+        self.near.approved = False
+        self.near.save()
+        self.assertEqual(self.snapshot.variants(['Rice'])['Rice'], [])
+
+
+class TestProductRatings(TestCase):
+    def setUp(self):
+        admin = models.Admin.objects.create(username='adm', email='adm@example.com', password_hash='x')
+        self.near = models.Mart.objects.create(name='Near', location_lat=17.69, location_long=83.22, admin=admin, approved=True)
+        self.far = models.Mart.objects.create(name='Far', location_lat=17.70, location_long=83.23, admin=admin, approved=True)
+        self.plain = models.Product.objects.create(mart=self.near, name='Dal', category='grocery', price=40, stock=5, image_url='x', quality_score=4.5)
+        self.loved = models.Product.objects.create(mart=self.far, name='Dal', category='grocery', price=40, stock=5, image_url='x', quality_score=3.0)
+        self.users = [models.User.objects.create(username=f'u{i}', email=f'u{i}@example.com', password_hash='x') for i in range(3)]
+
+    def _rating(self, product):
+        r = models.ProductRating.objects.get(pk=product.pk)
+        return (r.review_count, r.rating_sum, r.histogram, r.sentiment_count, round(r.sentiment_sum, 3))
+
+    def test_insert_edit_delete_keep_aggregate_in_step(self):
+        from api import ratings
+        a = models.Review.objects.create(product=self.loved, user=self.users[0], rating=5, sentiment_score=0.8)
+        b = models.Review.objects.create(product=self.loved, user=self.users[1], rating=4)
+        models.Review.objects.create(product=self.loved, user=self.users[2], rating=5, sentiment_score=0.4)
+        b.rating, b.sentiment_score = 2, -0.5
+        b.save()
+        a.delete()
+        expected = (2, 7, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1}, 2, -0.1)
+        self.assertEqual(self._rating(self.loved), expected)
+
+        ratings.rebuild([self.loved.pk])
+        self.assertEqual(self._rating(self.loved), expected)
+
+    def test_listing_serializes_ratings_without_per_product_queries(self):
+        for u in self.users:
+            models.Review.objects.create(product=self.loved, user=u, rating=4, sentiment_score=0.5)
+        with self.assertNumQueries(1):
+            data = Client().get('/api/v1/products/').json()
+        by_id = {p['product_id']: p['rating'] for p in data}
+        self.assertEqual(by_id[self.loved.pk]['average'], 4.0)
+        self.assertEqual((by_id[self.loved.pk]['count'], by_id[self.loved.pk]['sentiment']), (3, 0.5))
+        self.assertEqual(by_id[self.plain.pk], {'average': None, 'count': 0, 'histogram': {str(n): 0 for n in range(1, 6)}, 'sentiment': None})
+
+    def test_order_listing_serializes_ratings_without_per_item_queries(self):
+        user = self.users[0]
+        models.UserToken.objects.create(user=user, token_key='ratingtoken')
+        models.Review.objects.create(product=self.loved, user=self.users[1], rating=4)
+        for _ in range(2):
+            order = models.Order.objects.create(user=user, total_cost=80)
+            for product in (self.plain, self.loved):
+                models.OrderItem.objects.create(order=order, product=product, mart=product.mart, quantity=1, price_at_purchase=40)
+        with self.assertNumQueries(3):  # token, orders, items with product + mart + rating
+            data = Client(HTTP_AUTHORIZATION='Token ratingtoken').get('/api/v1/orders/').json()
+        ratings = {item['product']['product_id']: item['product']['rating']['count'] for o in data for item in o['items']}
+        self.assertEqual(ratings, {self.plain.pk: 0, self.loved.pk: 1})
+
+    def test_optimizer_breaks_price_ties_on_quality(self):
+        from api import checkout
+        user = self.users[0]
+        addr = models.Address.objects.create(user=user, line1='Addr', city='Visakhapatnam', state='AP', pincode='530029',
+                                             location_lat=17.6868, location_long=83.2185, is_default=True)
+        ctx = checkout.CheckoutContext(user, addr, 17.6868, 83.2185)
+        ctx.load_products([self.plain.pk], with_variants=True)
+        with self.assertNumQueries(0):
+            chosen = checkout._work_items(ctx, [{'product_id': self.plain.pk, 'quantity': 1}], True)[0]['product']
+        self.assertEqual(chosen.pk, self.plain.pk)  # no reviews: static quality_score 4.5 > 3.0
+
+        for u in self.users:
+            models.Review.objects.create(product=self.loved, user=u, rating=5)
+        ctx = checkout.CheckoutContext(user, addr, 17.6868, 83.2185)
+        ctx.load_products([self.plain.pk], with_variants=True)
+        with self.assertNumQueries(0):
+            chosen = checkout._work_items(ctx, [{'product_id': self.plain.pk, 'quantity': 1}], True)[0]['product']
+        self.assertEqual(chosen.pk, self.loved.pk)
+
+
+class TestReviewSentiment(TestCase):
+    def setUp(self):
+        admin = models.Admin.objects.create(username='adm', email='adm@example.com', password_hash='x')
+        mart = models.Mart.objects.create(name='Near', location_lat=17.69, location_long=83.22, admin=admin, approved=True)
+        self.product = models.Product.objects.create(mart=mart, name='Bread', category='grocery', price=40, stock=5, image_url='x')
+        self.users = [models.User.objects.create(username=f'u{i}', email=f'u{i}@example.com', password_hash='x') for i in range(5)]
+
+    def test_scores_text(self):
+        from api import sentiment
+        lexicon = sentiment.load_lexicon()
+        self.assertGreater(sentiment.score_text('Very fresh and tasty!', lexicon), 0.5)
+        self.assertLess(sentiment.score_text("didn't like it, stale bread", lexicon), -0.3)
+        self.assertLess(sentiment.score_text('not good', lexicon), 0)
+        self.assertGreater(sentiment.score_text('delivery was late but the bread was excellent', lexicon), 0)
+        self.assertEqual(sentiment.score_text('arrived on tuesday', lexicon), 0.0)
+
+    def test_batch_job_scores_unscored_reviews_and_refreshes_aggregates(self):
+        from api import sentiment
+        comments = ['Excellent, fresh bread', 'rotten and stale', '', None, 'fine']
+        reviews = [models.Review.objects.create(product=self.product, user=u, rating=4, comment=c)
+                   for u, c in zip(self.users, comments)]
+        reviews[4].sentiment_score = 0.9  # already scored: untouched
+        reviews[4].save()
+
+        totals = sentiment.score_pending(batch_size=2, workers=1)
+        self.assertEqual((totals['read'], totals['scored'], totals['batches']), (2, 2, 1))
+        scores = dict(models.Review.objects.values_list('pk', 'sentiment_score'))
+        self.assertGreater(scores[reviews[0].pk], 0)
+        self.assertLess(scores[reviews[1].pk], 0)
+        self.assertEqual((scores[reviews[2].pk], scores[reviews[3].pk], scores[reviews[4].pk]), (None, None, 0.9))
+
+        rating = models.ProductRating.objects.get(pk=self.product.pk)
+        self.assertEqual(rating.sentiment_count, 3)
+        self.assertAlmostEqual(rating.sentiment_sum, scores[reviews[0].pk] + scores[reviews[1].pk] + 0.9)
+        self.assertEqual(sentiment.score_pending(workers=1)['read'], 0)
+
+    def test_batch_job_adds_to_aggregates_instead_of_recomputing(self):
+        from api import sentiment
+        models.Review.objects.create(product=self.product, user=self.users[0], rating=5, comment='Excellent bread')
+        # another writer's delta that this job can't see in the reviews table
+        models.ProductRating.objects.filter(pk=self.product.pk).update(review_count=2, rating_sum=9)
+
+        sentiment.score_pending(workers=1)
+        rating = models.ProductRating.objects.get(pk=self.product.pk)
+        self.assertEqual((rating.review_count, rating.rating_sum, rating.sentiment_count), (2, 9, 1))
+
+
+class TestShoppingList(TestCase):
+    def setUp(self):
+        from api import shopping_list
+        admin = models.Admin.objects.create(username='adm', email='adm@example.com', password_hash='x')
+        near = models.Mart.objects.create(name='Near', location_lat=17.69, location_long=83.22, admin=admin, approved=True)
+        far = models.Mart.objects.create(name='Far', location_lat=17.70, location_long=83.23, admin=admin, approved=True)
+        hidden = models.Mart.objects.create(name='Unapproved', location_lat=17.70, location_long=83.23, admin=admin, approved=False)
+        self.rice = models.Product.objects.create(mart=near, name='Basmati Rice', category='grocery', price=90, stock=9, unit_weight_kg=1, image_url='x')
+        models.Product.objects.create(mart=far, name='Basmati Rice', category='grocery', price=95, stock=9, unit_weight_kg=1, image_url='x')
+        self.milk = models.Product.objects.create(mart=far, name='Toned Milk', category='grocery', price=28, stock=9, unit_weight_kg='0.5', image_url='x')
+        self.eggs = models.Product.objects.create(mart=near, name='Eggs', category='grocery', price=7, stock=99, image_url='x')
+        self.paneer = models.Product.objects.create(mart=near, name='Paneer', category='grocery', price=80, stock=9, unit_weight_kg='0.2', image_url='x')
+        models.Product.objects.create(mart=hidden, name='Saffron', category='grocery', price=500, stock=9, image_url='x')
+        shopping_list.names.mark_dirty()
+        user = models.User.objects.create(username='buyer', email='buyer@example.com', password_hash='x')
+        models.UserToken.objects.create(user=user, token_key='buyertoken')
+        self.client = Client(HTTP_AUTHORIZATION='Token buyertoken')
+
+    def test_parse_line(self):
+        from api.shopping_list import parse_line
+        self.assertEqual(parse_line('2 kg rice'), {'raw': '2 kg rice', 'name': 'rice', 'quantity': 1, 'weight_kg': 2.0})
+        self.assertEqual(parse_line('milk x3')['quantity'], 3)
+        self.assertEqual(parse_line('half dozen eggs')['quantity'], 6)
+        self.assertEqual(parse_line('2 x 500g butter')['weight_kg'], 1.0)
+        self.assertEqual(parse_line('bottle gourd')['name'], 'bottle gourd')
+
+    def test_resolves_every_line_in_one_call(self):
+        text = '2 kg basmati rice, milk x3\n- half dozen egg; 500g paneer\nsaffron, unicorn dust'
+        with self.assertNumQueries(3):  # token, name index build, one product lookup for all lines
+            resp = self.client.post('/api/v1/utils/parse-shopping-list/', {'text': text}, content_type='application/json')
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual(data['basket_items'], [
+            {'product_id': self.rice.pk, 'quantity': 2},
+            {'product_id': self.milk.pk, 'quantity': 3},
+            {'product_id': self.eggs.pk, 'quantity': 6},
+            {'product_id': self.paneer.pk, 'quantity': 3},
+        ])
+        self.assertEqual(data['unmatched'], ['saffron', 'unicorn dust'])
+        self.assertEqual(data['lines'][0]['candidates'][0]['offers'], 2)
+        self.assertEqual(len(data['items']), 6)
+
+        with self.assertNumQueries(2):  # token + product lookup; index reused
+            self.client.post('/api/v1/utils/parse-shopping-list/', {'text': 'eggs'}, content_type='application/json')
+
+    def test_only_listing_changes_mark_the_name_index_dirty(self):
+        from api import shopping_list
+        shopping_list.names.match_many(['rice'])
+        self.eggs.price, self.eggs.stock = 8, 50
+        self.eggs.save()
+        self.assertFalse(shopping_list.names._dirty)
+        self.eggs.name = 'Brown Eggs'
+        self.eggs.save(update_fields=['name'])
+        self.assertTrue(shopping_list.names._dirty)
+        shopping_list.names.match_many(['rice'])
+        self.eggs.delete()
+        self.assertTrue(shopping_list.names._dirty)
+
+
+class TestActiveBasket(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create(username='buyer', email='buyer@example.com', password_hash='x')
+        models.UserToken.objects.create(user=self.user, token_key='buyertoken')
+        admin = models.Admin.objects.create(username='adm', email='adm@example.com', password_hash='x')
+        mart = models.Mart.objects.create(name='Near', location_lat=17.69, location_long=83.22, admin=admin, approved=True)
+        self.rice = models.Product.objects.create(mart=mart, name='Rice', category='grocery', price='50.00', stock=10, image_url='x')
+        self.milk = models.Product.objects.create(mart=mart, name='Milk', category='grocery', price='28.50', stock=10, image_url='x')
+        self.client = Client(HTTP_AUTHORIZATION='Token buyertoken')
+
+    def _basket(self):
+        return models.Basket.objects.get(user=self.user, is_active=True)
+
+    def test_first_use_rechecks_under_the_user_lock(self):
+        from api import baskets
+        lock = models.User.objects.select_for_update
+
+        def racing_lock():
+            # another request commits its basket while this one waits for the lock
+            models.Basket.objects.create(user=self.user, is_active=True)
+            return lock()
+
+        with patch.object(models.User.objects, 'select_for_update', side_effect=racing_lock) as locked:
+            basket = baskets.active_basket(self.user)
+        locked.assert_called_once_with()
+        self.assertEqual(models.Basket.objects.filter(user=self.user, is_active=True).count(), 1)
+        self.assertEqual(basket.pk, self._basket().pk)
+
+    def test_line_edits_keep_total_and_single_active_basket(self):
+        data = self.client.get('/api/v1/basket/').json()
+        self.assertEqual(data['lines'], [])
+        self.assertNotIn('items', data)  # legacy snapshot isn't served
+        self.client.post('/api/v1/basket/items/', {'product_id': self.rice.pk, 'quantity': 2}, content_type='application/json')
+        self.client.post('/api/v1/basket/items/', {'product_id': self.rice.pk}, content_type='application/json')
+        resp = self.client.post('/api/v1/basket/items/', {'product_id': self.milk.pk, 'quantity': 2}, content_type='application/json')
+        self.assertEqual((resp.json()['total'], resp.json()['item_count']), ('207.00', 5))
+
+        resp = self.client.patch(f'/api/v1/basket/items/{self.rice.pk}/', {'quantity': 1}, content_type='application/json')
+        self.assertEqual(resp.json()['total'], '107.00')
+        resp = self.client.delete(f'/api/v1/basket/items/{self.milk.pk}/')
+        self.assertEqual([(l['product_id'], l['quantity']) for l in resp.json()['lines']], [(self.rice.pk, 1)])
+        self.assertEqual(self.client.delete(f'/api/v1/basket/items/{self.milk.pk}/').status_code, 404)
+        self.assertEqual(self.client.post('/api/v1/basket/items/', {'product_id': 99999}, content_type='application/json').status_code, 404)
+
+        basket = self._basket()
+        self.assertEqual((basket.total, basket.item_count), (Decimal('50.00'), 1))
+        self.assertEqual(models.Basket.objects.filter(user=self.user).count(), 1)
+
+    def test_edit_touches_only_the_changed_line(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        self.client.post('/api/v1/basket/', {'items': [{'product_id': self.rice.pk, 'quantity': 1},
+                                                       {'product_id': self.milk.pk, 'quantity': 4}]}, content_type='application/json')
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.patch(f'/api/v1/basket/items/{self.milk.pk}/', {'quantity': 3}, content_type='application/json')
+        writes = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith(('UPDATE', 'INSERT', 'DELETE'))]
+        self.assertEqual(len(writes), 2)  # the milk line + the basket's cached total
+        self.assertEqual(self._basket().total, Decimal('135.50'))
+
+    def test_replace_and_clear(self):
+        resp = self.client.post('/api/v1/basket/', {'items': [{'product_id': self.rice.pk, 'quantity': 2}], 'optimized_cost': '99.00'},
+                                content_type='application/json')
+        self.assertEqual((resp.status_code, resp.json()['total']), (200, '100.00'))
+        self.assertEqual(self.client.post('/api/v1/basket/', {'items': [{'product_id': 424242}]}, content_type='application/json').status_code, 400)
+        self.assertEqual(self._basket().item_count, 2)
+        resp = self.client.delete('/api/v1/basket/')
+        self.assertEqual((resp.json()['lines'], resp.json()['total']), ([], '0.00'))
@@ -0,0 +1,183 @@
+from django.db import connection
+from django.test import TestCase, Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from api import events, locations, models
+
+
+class PartnerDeliveriesFeedTests(TestCase):
+    def setUp(self):
+        user = models.User.objects.create(username='cust', email='cust@example.com', password_hash='x')
+        self.partner = models.DeliveryPartner.objects.create(name='Ravi', email='ravi@example.com', approved=True)
+        models.DeliveryPartnerToken.objects.create(partner=self.partner, token_key='partnertoken')
+        self.client = Client(HTTP_AUTHORIZATION='Token partnertoken')
+        self.deliveries = []
+        for status in ('delivered', 'assigned', 'assigned', 'in_transit'):
+            order = models.Order.objects.create(user=user, total_cost=10, status='confirmed')
+            self.deliveries.append(models.Delivery.objects.create(order=order, partner=self.partner, status=status))
+
+    def test_defaults_to_active_and_paginates(self):
+        resp = self.client.get('/api/v1/partners/deliveries/', {'limit': 2})
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual([d['delivery_id'] for d in data['deliveries']], [self.deliveries[3].delivery_id, self.deliveries[2].delivery_id])
+        self.assertEqual(data['next_before'], self.deliveries[2].delivery_id)
+
+        data = self.client.get('/api/v1/partners/deliveries/', {'limit': 2, 'before': data['next_before']}).json()
+        self.assertEqual([d['delivery_id'] for d in data['deliveries']], [self.deliveries[1].delivery_id])
+        self.assertIsNone(data['next_before'])
+
+        data = self.client.get('/api/v1/partners/deliveries/', {'status': 'all'}).json()
+        self.assertEqual(len(data['deliveries']), 4)
+
+    def test_unchanged_poll_returns_304(self):
+        resp = self.client.get('/api/v1/partners/deliveries/')
+        etag = resp['ETag']
+        resp = self.client.get('/api/v1/partners/deliveries/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 304)
+
+        d = self.deliveries[1]
+        d.status = 'delivered'
+        d.save(update_fields=['status', 'updated_at'])
+        resp = self.client.get('/api/v1/partners/deliveries/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp.status_code, 200)
+
+    def test_since_returns_only_changes(self):
+        token = self.client.get('/api/v1/partners/deliveries/').json()['server_time']
+        self.assertEqual(self.client.get('/api/v1/partners/deliveries/', {'since': token}).json()['deliveries'], [])
+
+        d = self.deliveries[2]
+        d.status = 'delivered'
+        d.save(update_fields=['status', 'updated_at'])
+        data = self.client.get('/api/v1/partners/deliveries/', {'since': token}).json()
+        self.assertEqual([(x['delivery_id'], x['status']) for x in data['deliveries']], [(d.delivery_id, 'delivered')])
+
+
+class EventStreamTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create(username='cust', email='cust@example.com', password_hash='x')
+        self.partner = models.DeliveryPartner.objects.create(name='Ravi', email='ravi@example.com', approved=True)
+        models.DeliveryPartnerToken.objects.create(partner=self.partner, token_key='partnertoken')
+        self.client = Client(HTTP_AUTHORIZATION='Token partnertoken')
+        order = models.Order.objects.create(user=self.user, total_cost=10, status='confirmed')
+        self.delivery = models.Delivery.objects.create(order=order, partner=self.partner, status='assigned')
+
+    def _drain(self, sub):
+        out = []
+        while True:
+            ev = sub.get(timeout=0)
+            if ev is None:
+                return out
+            out.append(ev)
+
+    def test_mark_delivered_reaches_partner_and_customer(self):
+        partner_sub = events.broker.subscribe([f'partner:{self.partner.partner_id}'])
+        customer_sub = events.broker.subscribe([f'user:{self.user.user_id}'])
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                resp = self.client.post(f'/api/v1/partners/deliveries/{self.delivery.delivery_id}/mark-delivered/')
+            self.assertEqual(resp.status_code, 200)
+            for sub in (partner_sub, customer_sub):
+                evs = [e for e in self._drain(sub) if e['event'] == 'delivery.delivered']
+                self.assertEqual(len(evs), 1)
+                self.assertEqual(evs[0]['data']['delivery_id'], self.delivery.delivery_id)
+                self.assertEqual(evs[0]['data']['order_status'], 'delivered')
+        finally:
+            partner_sub.close()
+            customer_sub.close()
+
+    @override_settings(EVENTS_STREAMING=False)
+    def test_stream_disabled_behind_sync_workers(self):
+        self.assertEqual(self.client.get('/api/v1/events/status/').json(), {'streaming': False})
+        resp = self.client.get('/api/v1/events/', HTTP_ACCEPT='application/json')
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(events.broker.subscriber_count(), 0)
+
+    @override_settings(EVENTS_STREAMING=True, EVENTS_MAX_STREAM_SECONDS=0.2, EVENTS_HEARTBEAT_SECONDS=0.05)
+    def test_stream_replays_from_last_event_id(self):
+        channel = f'partner:{self.partner.partner_id}'
+        seen = events.broker.publish([channel], 'delivery.assigned', {'delivery_id': 1})
+        events.broker.publish(['partner:999999'], 'delivery.assigned', {'delivery_id': 2})
+        resp = self.client.get('/api/v1/events/', HTTP_ACCEPT='text/event-stream', HTTP_LAST_EVENT_ID=str(seen - 1))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Type'], 'text/event-stream')
+        body = b''.join(resp.streaming_content).decode()
+        self.assertIn(f'id: {seen}\nevent: delivery.assigned\n', body)
+        self.assertNotIn('"delivery_id": 2', body)
+        self.assertEqual(events.broker.subscriber_count(), 0)
+
+
+class _FakeRedis:
+    """incr / publish surface of redis.Redis; published messages are kept for the test to deliver."""
+
+    def __init__(self):
+        self.counter = 0
+        self.published = []
+
+    def incr(self, key):
+        self.counter += 1
+        return self.counter
+
+    def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+class RedisBrokerTests(TestCase):
+    def test_events_published_in_one_process_reach_subscribers_in_another(self):
+        shared = _FakeRedis()
+        sender, receiver = events.RedisBroker('redis://test'), events.RedisBroker('redis://test')
+        sender._client = receiver._client = shared
+        receiver.start = lambda: None  # the listener thread is replaced by receive() below
+        sub = receiver.subscribe(['partner:7'])
+
+        self.assertEqual(sender.publish(['partner:7', 'admin'], 'delivery.assigned', {'delivery_id': 3}), 1)
+        self.assertIsNone(sub.get(timeout=0))  # nothing delivered locally without going through redis
+        for _channel, message in shared.published:
+            receiver.receive(message)
+        ev = sub.get(timeout=0)
+        self.assertEqual((ev['id'], ev['event'], ev['data']), (1, 'delivery.assigned', {'delivery_id': 3}))
+
+        # a reconnect on the receiving process replays from its history
+        replay = receiver.subscribe(['admin'], last_event_id=0)
+        self.assertEqual(replay.get(timeout=0)['id'], 1)
+
+
+class PartnerLocationTests(TestCase):
+    def setUp(self):
+        self.partner = models.DeliveryPartner.objects.create(name='Ravi', email='ravi@example.com', approved=True)
+        self.other = models.DeliveryPartner.objects.create(name='Sita', email='sita@example.com', approved=True)
+        models.DeliveryPartnerToken.objects.create(partner=self.partner, token_key='partnertoken')
+        self.client = Client(HTTP_AUTHORIZATION='Token partnertoken')
+
+    def tearDown(self):
+        locations.tracker.forget(self.partner.partner_id)
+
+    def test_ping_updates_position(self):
+        resp = self.client.post('/api/v1/partners/location/', {'lat': 17.7, 'lon': 83.2}, content_type='application/json')
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(locations.tracker.position(self.partner.partner_id), (17.7, 83.2))
+        # unbuffered under tests: written through
+        self.partner.refresh_from_db()
+        self.assertEqual(float(self.partner.location_lat), 17.7)
+        self.assertIsNotNone(self.partner.location_updated_at)
+
+        resp = self.client.post('/api/v1/partners/location/', {'lat': 'x', 'lon': 83.2}, content_type='application/json')
+        self.assertEqual(resp.status_code, 400)
+
+    @override_settings(LOCATION_BUFFERED=True, LOCATION_FLUSH_INTERVAL=0)
+    def test_pings_are_coalesced_into_one_batched_write(self):
+        tracker = locations.LocationTracker()
+        for i in range(50):
+            tracker.ping(self.partner.partner_id, 17.70 + i * 0.001, 83.2)
+            tracker.ping(self.other.partner_id, 17.80, 83.30 + i * 0.001)
+        self.partner.refresh_from_db()
+        self.assertIsNone(self.partner.location_lat)
+        self.assertEqual(tracker.pending(), 2)
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(tracker.flush(), 2)
+        self.assertEqual(len([q for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]), 1)
+        self.partner.refresh_from_db()
+        self.assertAlmostEqual(float(self.partner.location_lat), 17.749)
+        self.assertEqual(tracker.flush(), 0)
+
+        self.assertEqual([pid for _, pid in tracker.nearest(17.80, 83.35, k=1)], [self.other.partner_id])
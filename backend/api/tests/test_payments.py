@@ -0,0 +1,246 @@
+import hashlib
+import hmac
+import json
+import threading
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.test import TestCase, Client, override_settings
+from django.utils import timezone
+from api import models, payment_gateway, reconciliation, webhooks
+
+
+@override_settings(RAZORPAY_WEBHOOK_SECRET='whsec_test')
+class RazorpayWebhookTests(TestCase):
+    def setUp(self):
+        self.client = Client()
+        user = models.User.objects.create(username='cust', email='cust@example.com', password_hash='x')
+        self.order = models.Order.objects.create(user=user, total_cost=100, status='pending')
+        self.payment = models.Payment.objects.create(order=self.order, amount=100, provider_order_id='order_rz1')
+
+    def _post(self, event, event_id='evt_1'):
+        body = json.dumps(event).encode()
+        sig = hmac.new(b'whsec_test', body, hashlib.sha256).hexdigest()
+        return self.client.post('/api/v1/payments/razorpay/webhook/', body, content_type='application/json',
+                                HTTP_X_RAZORPAY_SIGNATURE=sig, HTTP_X_RAZORPAY_EVENT_ID=event_id)
+
+    def _event(self, kind):
+        return {'event': kind, 'payload': {'payment': {'entity': {'id': 'pay_1', 'order_id': 'order_rz1', 'amount': 10000}}}}
+
+    def test_event_is_stored_once_and_applied_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self._post(self._event('payment.captured'))
+        self.assertEqual(resp.json(), {'ok': True, 'duplicate': False})
+        ev = models.PaymentWebhookEvent.objects.get(event_id='evt_1')
+        self.assertEqual(ev.status, 'processed')
+        self.payment.refresh_from_db()
+        self.assertEqual((self.payment.status, self.payment.provider_payment_id), ('success', 'pay_1'))
+        self.assertEqual(models.Order.objects.get(pk=self.order.order_id).status, 'confirmed')
+
+        # Razorpay retry of the same event: acknowledged, nothing re-applied
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            resp = self._post(self._event('payment.captured'))
+        self.assertTrue(resp.json()['duplicate'])
+        self.assertEqual(callbacks, [])
+        self.assertEqual(models.PaymentWebhookEvent.objects.count(), 1)
+
+    def test_late_failure_does_not_downgrade_success(self):
+        self._post(self._event('payment.captured'), event_id='evt_1')
+        self._post(self._event('payment.failed'), event_id='evt_2')
+        self.assertEqual(webhooks.drain(), 2)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'success')
+
+    def test_bad_signature_is_rejected_without_storing(self):
+        body = json.dumps(self._event('payment.captured')).encode()
+        resp = self.client.post('/api/v1/payments/razorpay/webhook/', body, content_type='application/json',
+                                HTTP_X_RAZORPAY_SIGNATURE='nope')
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(models.PaymentWebhookEvent.objects.exists())
+
+
+class _StubRazorpay(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    failures_left = 0
+    ports = []
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        type(self).ports.append(self.client_address[1])
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        if type(self).failures_left > 0:
+            type(self).failures_left -= 1
+            return self._reply(503, {'error': 'busy'})
+        self._reply(200, {'id': 'order_stub', 'amount': payload['amount'], 'currency': payload['currency']})
+
+    def do_GET(self):
+        type(self).ports.append(self.client_address[1])
+        if type(self).failures_left > 0:
+            type(self).failures_left -= 1
+            return self._reply(503, {'error': 'busy'})
+        self._reply(200, {'id': self.path.rsplit('/', 1)[-1], 'status': 'captured'})
+
+    def log_message(self, *args):
+        pass
+
+
+class PaymentGatewayClientTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubRazorpay)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base = f'http://127.0.0.1:{cls.server.server_address[1]}/v1'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        _StubRazorpay.failures_left = 0
+        _StubRazorpay.ports = []
+        payment_gateway.metrics.reset()
+        self.client = payment_gateway.RazorpayClient('rzp_test', 'secret', base_url=self.base)
+
+    def tearDown(self):
+        self.client.close()
+
+    def test_calls_reuse_one_connection_and_record_latency(self):
+        for _ in range(3):
+            self.assertEqual(self.client.create_order(1000)['id'], 'order_stub')
+        self.assertEqual(len(set(_StubRazorpay.ports)), 1)
+        stats = payment_gateway.metrics.snapshot()['create_order']
+        self.assertEqual((stats['count'], stats['errors']), (3, 0))
+
+    @override_settings(PAYMENT_HTTP_BACKOFF=0)
+    def test_get_is_retried_but_post_is_not(self):
+        client = payment_gateway.RazorpayClient('rzp_test', 'secret', base_url=self.base)
+        _StubRazorpay.failures_left = 1
+        self.assertEqual(client.fetch_payment('pay_1')['status'], 'captured')
+
+        _StubRazorpay.failures_left = 1
+        with self.assertRaises(payment_gateway.GatewayError) as ctx:
+            client.create_order(1000)
+        self.assertEqual(ctx.exception.status_code, 503)
+        client.close()
+
+    @override_settings(RAZORPAY_KEY_ID='rzp_test', RAZORPAY_KEY_SECRET='secret')
+    def test_create_razorpay_order_view_uses_gateway(self):
+        user = models.User.objects.create(username='cust', email='cust@example.com', password_hash='x')
+        models.UserToken.objects.create(user=user, token_key='usertoken')
+        with self.settings(RAZORPAY_API_BASE=self.base):
+            resp = Client(HTTP_AUTHORIZATION='Token usertoken').post(
+                '/api/v1/payments/razorpay/create-order/', {'amount': 499}, content_type='application/json')
+        self.assertEqual(resp.status_code, 200, resp.content)
+        self.assertEqual(resp.json()['razorpay_order_id'], 'order_stub')
+        p = models.Payment.objects.get(pk=resp.json()['payment_id'])
+        self.assertEqual((p.provider_order_id, p.status), ('order_stub', 'pending'))
+
+
+class _StubGateway:
+    """Stands in for RazorpayClient.list_payments / fetch_order_payments."""
+
+    def __init__(self, items, by_order=None):
+        self.items = items
+        self.by_order = by_order or {}
+        self.calls = []
+        self.order_calls = []
+
+    def list_payments(self, from_ts, to_ts, count=100, skip=0):
+        self.calls.append((from_ts, to_ts, skip))
+        return self.items[skip:skip + count]
+
+    def fetch_order_payments(self, order_id):
+        self.order_calls.append(order_id)
+        return self.by_order.get(order_id, [])
+
+
+class ReconcilePaymentsTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create(username='cust', email='cust@example.com', password_hash='x')
+
+    def _pending(self, rz_order, age_minutes):
+        order = models.Order.objects.create(user=self.user, total_cost=100, status='pending')
+        p = models.Payment.objects.create(order=order, amount=100, provider_order_id=rz_order)
+        models.Payment.objects.filter(pk=p.pk).update(created_at=timezone.now() - timedelta(minutes=age_minutes))
+        return p
+
+    def test_batch_resolves_from_one_bulk_listing(self):
+        captured = self._pending('order_a', 60)
+        failed = self._pending('order_b', 60)
+        in_flight = self._pending('order_c', 60)
+        expired = self._pending('order_d', 3000)
+        fresh = self._pending('order_e', 1)
+        stub = _StubGateway([
+            {'id': 'pay_a', 'order_id': 'order_a', 'status': 'captured', 'amount': 10000},
+            {'id': 'pay_b', 'order_id': 'order_b', 'status': 'failed'},
+            {'id': 'pay_c', 'order_id': 'order_c', 'status': 'authorized'},
+            {'id': 'pay_x', 'order_id': 'someone_else', 'status': 'captured'},
+        ])
+
+        totals = reconciliation.reconcile(batch_size=10, client=stub)
+        self.assertEqual(len(stub.calls), 1)
+        # only the expiry candidate is confirmed per order
+        self.assertEqual(stub.order_calls, ['order_d'])
+        self.assertEqual((totals['checked'], totals['success'], totals['failed']), (4, 1, 2))
+
+        status = lambda p: models.Payment.objects.get(pk=p.pk).status
+        order_status = lambda p: models.Order.objects.get(pk=p.order_id).status
+        self.assertEqual((status(captured), order_status(captured)), ('success', 'confirmed'))
+        self.assertEqual(models.Payment.objects.get(pk=captured.pk).provider_payment_id, 'pay_a')
+        self.assertTrue(models.Delivery.objects.filter(order_id=captured.order_id).exists())
+        self.assertEqual((status(failed), order_status(failed)), ('failed', 'cancelled'))
+        self.assertEqual((status(expired), order_status(expired)), ('failed', 'cancelled'))
+        self.assertEqual(status(in_flight), 'pending')
+        self.assertEqual(status(fresh), 'pending')
+
+    def test_truncated_listing_never_expires(self):
+        old = self._pending('order_d', 3000)
+        filler = [{'id': f'pay_{i}', 'order_id': f'other_{i}', 'status': 'captured'} for i in range(100)]
+        stub = _StubGateway(filler)
+        with self.settings(PAYMENT_RECONCILE_MAX_PAGES=1):
+            totals = reconciliation.reconcile(batch_size=10, client=stub)
+        self.assertEqual(totals['failed'], 0)
+        self.assertEqual(stub.order_calls, [])
+        self.assertEqual(models.Payment.objects.get(pk=old.pk).status, 'pending')
+
+    def test_late_attempt_outside_window_found_per_order(self):
+        old = self._pending('order_d', 3000)
+        stub = _StubGateway([], by_order={'order_d': [{'id': 'pay_d', 'order_id': 'order_d', 'status': 'captured', 'amount': 10000}]})
+        reconciliation.reconcile(batch_size=10, client=stub)
+        self.assertEqual(models.Payment.objects.get(pk=old.pk).status, 'success')
+        self.assertEqual(models.Order.objects.get(pk=old.order_id).status, 'confirmed')
+
+    def test_capture_after_reconciled_failure_reopens_orders(self):
+        p = self._pending('order_b', 60)
+        reconciliation.reconcile(batch_size=10, client=_StubGateway([{'id': 'pay_b1', 'order_id': 'order_b', 'status': 'failed'}]))
+        self.assertEqual(models.Order.objects.get(pk=p.order_id).status, 'cancelled')
+
+        # the customer's retry is captured after all
+        ev = models.PaymentWebhookEvent.objects.create(
+            event_id='evt_retry', provider='razorpay', event_type='payment.captured',
+            payload={'event': 'payment.captured', 'payload': {'payment': {'entity': {'id': 'pay_b2', 'order_id': 'order_b', 'amount': 10000}}}},
+        )
+        self.assertEqual(webhooks.drain(), 1)
+        ev.refresh_from_db()
+        self.assertEqual(ev.status, 'processed')
+        self.assertEqual(models.Payment.objects.get(pk=p.pk).status, 'success')
+        self.assertEqual(models.Order.objects.get(pk=p.order_id).status, 'confirmed')
+        self.assertTrue(models.Delivery.objects.filter(order_id=p.order_id).exists())
+
+    def test_payment_resolved_meanwhile_is_not_overwritten(self):
+        p = self._pending('order_a', 60)
+        stale_copy = models.Payment.objects.get(pk=p.pk)
+        models.Payment.objects.filter(pk=p.pk).update(status='success')
+        reconciliation.reconcile_batch([stale_copy], _StubGateway([{'id': 'pay_a', 'order_id': 'order_a', 'status': 'failed'}]))
+        self.assertEqual(models.Payment.objects.get(pk=p.pk).status, 'success')
@@ -0,0 +1,165 @@
+import csv
+import os
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from api import models, product_import
+
+HEADER = ["product_id", "mart_id", "name", "category", "price", "stock", "description",
+          "quality_score", "created_at", "updated_at", "image_url"]
+
+
+class ProductCsvImportTests(TestCase):
+    def setUp(self):
+        admin = models.Admin.objects.create(username='adm', email='adm@example.com', password_hash='x')
+        self.mart = models.Mart.objects.create(name='M', location_lat=17.7, location_long=83.2, admin=admin, approved=True)
+        tmp = tempfile.mkdtemp()
+        self.path = os.path.join(tmp, 'products.csv')
+        with open(self.path, 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow(HEADER)
+            for i in range(7):
+                mart_id = 999 if i == 3 else self.mart.mart_id
+                w.writerow([i, mart_id, f'Item {i}', 'milk', '12.5', 3, '', '4.0', '', '', 'x'])
+        self.checkpoint = self.path
+
+    def test_streams_in_batches_and_skips_unknown_marts(self):
+        out = StringIO()
+        # mart ids; per batch savepoint + insert + checkpoint update + release (the first also inserts
+        # the checkpoint row); the final flush only records the last row
+        with self.assertNumQueries(1 + 3 * 4 + 1 + 3):
+            call_command('import_products_csv', csv=self.path, batch=2, stdout=out)
+        self.assertEqual(models.Product.objects.count(), 6)
+        self.assertEqual(models.Product.objects.filter(category='dairy').count(), 6)
+        self.assertIn('missing mart_ids (not found in DB): [999]', out.getvalue())
+
+    def test_resume_continues_after_last_committed_batch(self):
+        real = models.Product.objects.bulk_create
+        calls = []
+
+        def flaky(objs, *args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError('connection lost')
+            return real(objs, *args, **kwargs)
+
+        with patch.object(models.Product.objects, 'bulk_create', side_effect=flaky):
+            with self.assertRaises(RuntimeError):
+                product_import.import_csv(self.path, batch_size=2, checkpoint=self.checkpoint)
+        self.assertEqual(models.Product.objects.count(), 2)
+
+        result = product_import.import_csv(self.path, batch_size=2, checkpoint=self.checkpoint, resume=True)
+        self.assertEqual(result['resumed_from'], 2)
+        self.assertEqual(result['created'], 6)
+        self.assertEqual(sorted(models.Product.objects.values_list('name', flat=True)),
+                         [f'Item {i}' for i in range(7) if i != 3])
+
+    def test_batch_and_checkpoint_commit_together(self):
+        real = product_import.save_checkpoint
+        calls = []
+
+        def crash_after_insert(*args):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError('killed before the checkpoint was written')
+            return real(*args)
+
+        with patch.object(product_import, 'save_checkpoint', side_effect=crash_after_insert):
+            with self.assertRaises(RuntimeError):
+                product_import.import_csv(self.path, batch_size=2, checkpoint=self.checkpoint)
+        # the second batch rolled back with its checkpoint, so resuming can't insert it twice
+        self.assertEqual(models.Product.objects.count(), 2)
+        product_import.import_csv(self.path, batch_size=2, checkpoint=self.checkpoint, resume=True)
+        self.assertEqual(models.Product.objects.count(), 6)
+
+
+class ProductCsvSyncTests(TestCase):
+    def setUp(self):
+        admin = models.Admin.objects.create(username='adm', email='adm@example.com', password_hash='x')
+        self.mart = models.Mart.objects.create(name='M', location_lat=17.7, location_long=83.2, admin=admin, approved=True)
+        self.rice = models.Product.objects.create(mart=self.mart, name='Rice', category='grocery', price=50, stock=10, image_url='x')
+        self.milk = models.Product.objects.create(mart=self.mart, name='Milk', category='dairy', price=30, stock=5, image_url='x')
+        self.soap = models.Product.objects.create(mart=self.mart, name='Soap', category='essential', price=20, stock=5, image_url='x')
+        self.path = os.path.join(tempfile.mkdtemp(), 'feed.csv')
+
+    def _feed(self, rows):
+        with open(self.path, 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow(['mart_id', 'sku', 'name', 'price', 'stock'])
+            for r in rows:
+                w.writerow([self.mart.mart_id] + r)
+
+    def test_diff_touches_only_changed_rows_and_keeps_ids(self):
+        self._feed([['', 'rice', '50.00', 10], ['M-1', 'Milk', '32.00', 5], ['', 'Dal', '90', 4]])
+        before = models.Product.objects.get(pk=self.rice.pk).updated_at
+        result = product_import.sync_csv(self.path, deactivate_missing=True)
+        self.assertEqual((result['inserted'], result['updated'], result['unchanged'], result['deactivated']), (1, 1, 1, 1))
+
+        self.assertEqual(models.Product.objects.get(pk=self.rice.pk).updated_at, before)
+        milk = models.Product.objects.get(pk=self.milk.pk)
+        self.assertEqual((milk.price, milk.sku), (Decimal('32.00'), 'M-1'))
+        self.assertFalse(models.Product.objects.get(pk=self.soap.pk).is_active)
+        self.assertTrue(models.Product.objects.filter(mart=self.mart, name='Dal', is_active=True).exists())
+
+        # a relisted product comes back under its old id; sku now matches first
+        self._feed([['M-1', 'Milk (1L)', '32.00', 5], ['', 'Soap', '20', 5]])
+        result = product_import.sync_csv(self.path)
+        self.assertEqual((result['inserted'], result['updated'], result['unchanged']), (0, 1, 1))
+        self.assertTrue(models.Product.objects.get(pk=self.soap.pk).is_active)
+
+    def test_dry_run_writes_nothing(self):
+        self._feed([['', 'Rice', '55', 10]])
+        out = StringIO()
+        call_command('sync_products_csv', csv=self.path, dry_run=True, deactivate_missing=True, stdout=out)
+        self.assertIn('updated=1', out.getvalue())
+        self.assertIn('deactivated=2', out.getvalue())
+        self.assertEqual(models.Product.objects.get(pk=self.rice.pk).price, Decimal('50.00'))
+        self.assertEqual(models.Product.objects.filter(is_active=True).count(), 3)
+
+
+class ProductFeedIngestTests(TestCase):
+    def setUp(self):
+        admin = models.Admin.objects.create(username='adm', email='adm@example.com', password_hash='x')
+        self.a = models.Mart.objects.create(name='A', location_lat=17.7, location_long=83.2, admin=admin, approved=True)
+        self.b = models.Mart.objects.create(name='B', location_lat=17.7, location_long=83.2, admin=admin, approved=True)
+        self.rice = models.Product.objects.create(mart=self.a, name='Rice', category='grocery', price=50, stock=10, image_url='x')
+        self.dir = tempfile.mkdtemp()
+
+    def _write(self, name, header, rows):
+        with open(os.path.join(self.dir, name), 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow(header)
+            w.writerows(rows)
+
+    def test_price_and_stock_feeds_merge_per_mart(self):
+        self._write('1_prices.csv', ['mart_id', 'name', 'price'],
+                    [[self.a.mart_id, 'Rice', '55'], [self.b.mart_id, 'Oil', '120'], [self.b.mart_id, 'Ghee', 'abc']])
+        self._write('2_stock.csv', ['mart_id', 'name', 'stock'],
+                    [[self.a.mart_id, 'Rice', 4], [self.b.mart_id, 'Oil', 7], [999, 'Salt', 1]])
+        out = StringIO()
+        # workers/writers of 1 keep parsing and writing in-process so the test transaction sees them
+        call_command('ingest_product_feeds', self.dir, workers=1, writers=1, stdout=out)
+
+        rice = models.Product.objects.get(pk=self.rice.pk)
+        self.assertEqual((rice.price, rice.stock), (Decimal('55.00'), 4))
+        oil = models.Product.objects.get(mart=self.b, name='Oil')
+        self.assertEqual((oil.price, oil.stock), (Decimal('120.00'), 7))
+        self.assertIn('inserted=1 updated=1', out.getvalue())
+        self.assertIn('skipped=2', out.getvalue())
+        self.assertIn("bad price 'abc'", out.getvalue())
+
+    def test_parse_feed_is_database_free(self):
+        self._write('p.csv', ['mart_id', 'name', 'price'], [[self.a.mart_id, 'Rice', '55'], [self.a.mart_id, 'rice', '56']])
+        with self.assertNumQueries(0):
+            parsed = product_import.parse_feed(os.path.join(self.dir, 'p.csv'))
+        self.assertEqual(parsed['partitions'][self.a.mart_id][('name', 'rice')]['price'], Decimal('56.00'))
+
+    def test_non_finite_prices_are_rejected(self):
+        for raw in ('NaN', 'nan', 'Infinity', '-inf', 'sNaN'):
+            with self.assertRaisesRegex(ValueError, 'bad price'):
+                product_import.parse_record({'mart_id': str(self.a.mart_id), 'name': 'Rice', 'price': raw})
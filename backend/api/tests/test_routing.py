@@ -0,0 +1,68 @@
+from django.test import TestCase
+from api import models, routing
+
+
+class RoutePlanningTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create(username='cust', email='cust@example.com', password_hash='x')
+        admin = models.Admin.objects.create(username='adm', password_hash='x')
+        self.mart_a = models.Mart.objects.create(name='A', location_lat=17.700, location_long=83.200, admin=admin, approved=True)
+        self.mart_b = models.Mart.objects.create(name='B', location_lat=17.720, location_long=83.240, admin=admin, approved=True)
+        self.partner = models.DeliveryPartner.objects.create(name='Ravi', approved=True, location_lat=17.690, location_long=83.190)
+
+    def _delivery(self, mart, lat, lon):
+        product = models.Product.objects.create(mart=mart, name='Rice', category='grocery', price=10, stock=5, image_url='x')
+        order = models.Order.objects.create(user=self.user, total_cost=10, status='confirmed',
+                                            delivery_address_lat=lat, delivery_address_long=lon)
+        models.OrderItem.objects.create(order=order, product=product, mart=mart, quantity=1, price_at_purchase=10)
+        return models.Delivery.objects.create(order=order, partner=self.partner)
+
+    def _stops(self, delivery):
+        delivery.refresh_from_db()
+        return delivery.route_data['stops']
+
+    def test_plan_visits_pickups_before_drops_and_sets_etas(self):
+        d1 = self._delivery(self.mart_a, 17.730, 83.250)
+        d2 = self._delivery(self.mart_b, 17.740, 83.260)
+        routing.plan_route(self.partner)
+
+        stops = self._stops(d1)
+        self.assertEqual(len(stops), 4)
+        seen_marts = set()
+        for s in stops:
+            if s['type'] == 'pickup':
+                seen_marts.add(s['mart_id'])
+            else:
+                self.assertTrue(set(s['needs']) <= seen_marts)
+        etas = [s['eta_min'] for s in stops]
+        self.assertEqual(etas, sorted(etas))
+
+        d2.refresh_from_db()
+        drop = next(s for s in d2.route_data['stops'] if s.get('delivery_id') == d2.delivery_id)
+        self.assertEqual(d2.estimated_time, drop['eta_min'])
+
+    def test_incremental_add_and_remove(self):
+        d1 = self._delivery(self.mart_a, 17.730, 83.250)
+        routing.plan_route(self.partner)
+        self.assertEqual(len(self._stops(d1)), 2)
+
+        # second order from the same mart shares the pickup stop
+        d2 = self._delivery(self.mart_a, 17.735, 83.255)
+        routing.add_delivery(self.partner, d2.delivery_id)
+        stops = self._stops(d1)
+        self.assertEqual(len(stops), 3)
+        self.assertEqual(sorted(stops[0]['delivery_ids']), sorted([d1.delivery_id, d2.delivery_id]))
+
+        d1.status = 'delivered'
+        d1.save()
+        routing.remove_delivery(self.partner, d1.delivery_id, origin=(17.730, 83.250))
+        stops = self._stops(d2)
+        self.assertEqual([s['type'] for s in stops], ['pickup', 'drop'])
+        self.assertEqual(stops[0]['delivery_ids'], [d2.delivery_id])
+
+    def test_two_opt_removes_crossing(self):
+        start = (0.0, 0.0)
+        pts = [(0.0, 0.01), (0.01, 0.02), (0.01, 0.01), (0.0, 0.02)]
+        stops = [{'type': 'drop', 'delivery_id': i, 'needs': [], 'lat': lat, 'lon': lon} for i, (lat, lon) in enumerate(pts)]
+        improved = routing.two_opt(start, stops)
+        self.assertLess(routing._length(start, improved), routing._length(start, stops))
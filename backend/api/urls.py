@@ -36,17 +36,23 @@ urlpatterns = [
 
     # --- Basket & Orders ---
     path("basket/", views.basket_view, name="basket"),
+    path("basket/items/", views.basket_add_item, name="basket-items"),
+    path("basket/items/<int:product_id>/", views.basket_item, name="basket-item"),
     path("basket/optimize/", views.optimize_basket, name="optimize-basket"),
 
     # multi-mart orders
     path("orders/create-from-plan/", views.create_order_from_plan, name="create-order-from-plan"),
     path("orders/from-plan/", views.create_order_from_plan, name="orders-from-plan"),
+    path("checkout/", views.checkout_basket, name="checkout"),
 
     path("orders/create/", views.create_order, name="create-order"),
     path("orders/", views.list_orders, name="orders-list"),
     # Admin endpoints
     path("admin/orders/", views.admin_list_orders, name="admin-orders-list"),
     path("admin/products/update-stock/", views.admin_update_stock, name="admin-update-stock"),
+    path("admin/products/stock/bulk/", views.admin_bulk_update_stock, name="admin-bulk-update-stock"),
+    path("admin/analytics/sales/", views.admin_sales_analytics, name="admin-analytics-sales"),
+    path("admin/analytics/top-products/", views.admin_top_products, name="admin-analytics-top-products"),
     path("admin/auth/create/", views.create_admin, name="admin-auth-create"),
     path("admin/auth/list/", views.list_admins, name="admin-auth-list"),
     path("admin/auth/<int:admin_id>/", views.delete_admin, name="admin-auth-delete"),
@@ -68,6 +74,7 @@ urlpatterns = [
     path("admin/deliveries/<int:delivery_id>/assign/", views.admin_assign_delivery, name="admin-deliveries-assign"),
     path("admin/deliveries/<int:delivery_id>/fix/", views.admin_fix_delivery, name="admin-deliveries-fix"),
     path("admin/logs/", views.admin_list_logs, name="admin-logs-list"),
+    path("admin/payments/gateway-metrics/", views.admin_payment_gateway_metrics, name="admin-payment-gateway-metrics"),
     path("admin/marts/assign/", views.assign_mart_to_admin, name="admin-mart-assign"),
     # Delivery agent
     path("agents/login/", views.delivery_agent_login, name="delivery-agent-login"),
@@ -79,8 +86,13 @@ urlpatterns = [
     path("partners/login/", views.delivery_partner_login, name="delivery-partner-login"),
     path("partners/set-password/", views.agent_set_password, name="partner-set-password"),
     path("partners/deliveries/", views.agent_deliveries, name="partner-deliveries"),
+    path("partners/route/", views.agent_route, name="partner-route"),
+    path("partners/location/", views.partner_location, name="partner-location"),
     path("partners/deliveries/<int:delivery_id>/mark-delivered/", views.agent_mark_delivered, name="partner-mark-delivered"),
     path("partners/register/", views.register_agent, name="partners-register"),
+    # Status push (server-sent events)
+    path("events/", views.event_stream, name="event-stream"),
+    path("events/status/", views.event_stream_status, name="event-stream-status"),
 
     # --- Utilities ---
     path("utils/parse-shopping-list/", views.parse_shopping_list, name="parse-shopping-list"),
@@ -23,3 +23,11 @@ def fetch_product_image(query):
 
     # fallback placeholder
     return "https://via.placeholder.com/150"
+
+
+def ensure_product_image(product):
+    """Populate and persist ``product.image_url`` the first time it is needed."""
+    if not product.image_url:
+        product.image_url = fetch_product_image(product.name) or f"https://via.placeholder.com/150?text={product.name}"
+        product.save(update_fields=["image_url"])
+    return product
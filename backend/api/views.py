@@ -3,11 +3,8 @@ import os
 import hmac
 import secrets
 import random
-import math
 import re
 import hashlib
-import json
-import requests
 import traceback
 import sys
 
@@ -15,14 +12,16 @@ from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
 from rest_framework import status
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.decorators import api_view, authentication_classes, permission_classes, renderer_classes
+from rest_framework.renderers import JSONRenderer
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from decimal import Decimal
 from typing import Iterable, Optional, Tuple, List, Dict
 
-from django.http import JsonResponse
-from django.db.models import Q
+from django.http import JsonResponse, StreamingHttpResponse
+from django.db.models import Count, Max, Prefetch, Q
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.contrib.auth.hashers import make_password, check_password
 from django.core.mail import send_mail, get_connection, EmailMessage
 from django.conf import settings
@@ -38,12 +37,14 @@ from rest_framework.permissions import IsAuthenticated
 from django.db import transaction
 
 from geopy.geocoders import Nominatim
-from geopy.distance import geodesic
 
 from .authentication import CustomTokenAuthentication
-from . import models, serializers
+from .audit import log_event
+from .geo import distance_km_between, eta_minutes_from_distance
+from .checkout import calculate_delivery_charge
+from . import baskets, checkout, dispatch, events, inventory, lifecycle, locations, models, optimize_cache, payment_gateway, rollups, routing, serializers, shopping_list, webhooks
 from .agent_views import register_agent, admin_list_pending_agents, admin_approve_agent, admin_reject_agent
-from .utils import fetch_product_image
+from .utils import ensure_product_image
 from .serializers import PaymentSerializer
 
 # --- Admin endpoints: list orders and update product stock
@@ -87,18 +88,13 @@ def admin_update_stock(request):
         p = models.Product.objects.get(pk=product_id)
         # If current user is not superuser, enforce mart ownership check
         if not getattr(request.user, 'is_superuser', False):
-            # Try to match an Admin record to this user (by email or username)
-            admin_obj = None
-            try:
-                admin_obj = models.Admin.objects.filter(models.Q(email__iexact=getattr(request.user, 'email', '')) | models.Q(username__iexact=getattr(request.user, 'username', ''))).first()
-            except Exception:
-                admin_obj = None
-
-            if not admin_obj:
+            # Admin record + managed marts were resolved at authentication time
+            principal = getattr(request.user, 'admin_principal', None)
+            if not principal:
                 return Response({'error': 'Forbidden: not a recognized mart admin'}, status=403)
 
             # Ensure the product's mart is managed by this admin
-            if not p.mart or getattr(p.mart, 'admin_id', None) != getattr(admin_obj, 'admin_id', None):
+            if not principal.manages(p.mart_id):
                 return Response({'error': 'Forbidden: cannot modify product from another mart'}, status=403)
 
         p.stock = int(stock)
@@ -108,6 +104,92 @@ def admin_update_stock(request):
         return Response({'error': 'Product not found'}, status=404)
 
 
+@api_view(["POST"])
+@authentication_classes([CustomTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def admin_bulk_update_stock(request):
+    """
+    Body: { "updates": [ {"product_id": 1, "stock": 20} | {"product_id": 2, "delta": -3}, ... ] }
+    Superusers may update any product, mart admins only products of marts they manage.
+    Returns { updated, failed, results: [ {index, product_id, status, stock?, previous?, error?}, ... ] }
+    where status is updated / not_found / forbidden / invalid / rejected (api/inventory.py).
+    """
+    if not getattr(request.user, 'is_staff', False) and not getattr(request.user, 'is_superuser', False):
+        return Response({'error': 'Forbidden'}, status=403)
+    updates = (request.data or {}).get('updates')
+    if not isinstance(updates, list) or not updates:
+        return Response({'error': 'updates list required'}, status=400)
+    max_rows = getattr(settings, 'STOCK_BULK_MAX_ROWS', 10000)
+    if len(updates) > max_rows:
+        return Response({'error': f'at most {max_rows} updates per request'}, status=400)
+
+    mart_ids = inventory.managed_mart_ids(request.user)
+    if mart_ids is not None and not mart_ids:
+        return Response({'error': 'Forbidden: not a recognized mart admin'}, status=403)
+    return Response(inventory.apply_stock_updates(updates, mart_ids))
+
+
+def _analytics_scope(request):
+    """(day_from, day_to, mart_ids) for an analytics request, or an error Response."""
+    if not getattr(request.user, 'is_staff', False) and not getattr(request.user, 'is_superuser', False):
+        return Response({'error': 'Forbidden'}, status=403)
+    mart_ids = inventory.managed_mart_ids(request.user)
+    if mart_ids is not None and not mart_ids:
+        return Response({'error': 'Forbidden: not a recognized mart admin'}, status=403)
+    mart_id = request.query_params.get('mart_id')
+    if mart_id:
+        try:
+            mart_id = int(mart_id)
+        except ValueError:
+            return Response({'error': 'mart_id must be an integer'}, status=400)
+        if mart_ids is not None and mart_id not in mart_ids:
+            return Response({'error': 'Forbidden: mart not managed by you'}, status=403)
+        mart_ids = {mart_id}
+    try:
+        day_from, day_to = rollups.date_range(request.query_params.get('from'), request.query_params.get('to'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=400)
+    return day_from, day_to, mart_ids
+
+
+@api_view(["GET"])
+@authentication_classes([CustomTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def admin_sales_analytics(request):
+    """
+    Query: ?from=YYYY-MM-DD&to=YYYY-MM-DD&mart_id=
+    Returns { from, to, totals, days: [...], marts: [...] } for confirmed / shipped / delivered
+    orders, read from the sales rollups (api/rollups.py). Mart admins only see marts they manage.
+    """
+    scope = _analytics_scope(request)
+    if isinstance(scope, Response):
+        return scope
+    day_from, day_to, mart_ids = scope
+    return Response({'from': day_from.isoformat(), 'to': day_to.isoformat(), **rollups.sales_summary(day_from, day_to, mart_ids)})
+
+
+@api_view(["GET"])
+@authentication_classes([CustomTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def admin_top_products(request):
+    """Query: ?from=&to=&mart_id=&limit=20&sort=revenue|qty|orders. Best sellers in the range, from the rollups."""
+    scope = _analytics_scope(request)
+    if isinstance(scope, Response):
+        return scope
+    day_from, day_to, mart_ids = scope
+    sort = request.query_params.get('sort', 'revenue')
+    if sort not in ('revenue', 'qty', 'orders'):
+        return Response({'error': 'sort must be revenue, qty or orders'}, status=400)
+    try:
+        limit = max(1, min(int(request.query_params.get('limit', 20)), 100))
+    except ValueError:
+        return Response({'error': 'limit must be an integer'}, status=400)
+    return Response({
+        'from': day_from.isoformat(), 'to': day_to.isoformat(),
+        'products': rollups.top_products(day_from, day_to, mart_ids, limit=limit, sort=sort),
+    })
+
+
 # --- Delivery agent login
 @api_view(["POST"])
 @permission_classes([AllowAny])
@@ -208,7 +290,7 @@ class OfferViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 class ProductViewSet(viewsets.ReadOnlyModelViewSet):
-    queryset = models.Product.objects.all()
+    queryset = models.Product.objects.filter(is_active=True).select_related("mart", "rating")
     serializer_class = serializers.ProductSerializer
 
     def list(self, request, *args, **kwargs):
@@ -229,15 +311,9 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
 def get_google_image(query: str) -> str:
     return f"https://via.placeholder.com/150?text={query}"
 
-def ensure_product_image(product: models.Product) -> models.Product:
-    if not product.image_url:
-        product.image_url = fetch_product_image(product.name) or f"https://via.placeholder.com/150?text={product.name}"
-        product.save(update_fields=["image_url"])
-    return product
-
 @api_view(["GET"])
 def products_with_images(request):
-    products = list(models.Product.objects.all())
+    products = list(models.Product.objects.filter(is_active=True).select_related("mart", "rating"))
     for p in products:
         ensure_product_image(p)
     data = serializers.ProductSerializer(products, many=True, context={"request": request}).data
@@ -270,27 +346,6 @@ def get_lat_long_from_address(address: str) -> Tuple[Optional[Decimal], Optional
     return None, None
 
 
-def distance_km_between(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    return geodesic((lat1, lon1), (lat2, lon2)).km
-
-
-def eta_minutes_from_distance(distance_km: float) -> int:
-    """Very simple ETA: 20 km/h average → 3 min/km."""
-    return int(math.ceil((distance_km / 20.0) * 60.0))
-
-
-def calculate_delivery_charge(distance_km: float, total_weight_kg: float) -> int:
-    """
-    Pricing rule:
-      - ₹5 per km
-      - ₹5 per kg
-      - no base
-    """
-    distance_component = 5.0 * max(0.0, float(distance_km or 0.0))
-    weight_component = 5.0 * max(0.0, float(total_weight_kg or 0.0))
-    return int(math.ceil(distance_component + weight_component))
-
-
 def marts_with_distances_to(address_lat: Decimal, address_long: Decimal, marts: Iterable[models.Mart],
                             weight_kg: float = 1.0) -> List[Dict]:
     """
@@ -394,10 +449,7 @@ def request_otp(request):
             [destination],
         )
         # audit log for OTP send
-        try:
-            models.AnalyticsLog.objects.create(admin=None, action_type="otp_sent", details=json.dumps({"destination": destination, "purpose": purpose}))
-        except Exception:
-            pass
+        log_event("otp_sent", {"destination": destination, "purpose": purpose})
     except Exception as e:
         # Print full traceback for debugging and return error to client.
         print(f"OTP email failed: {e}, Code: {code}")
@@ -439,10 +491,7 @@ def verify_otp(request):
         partner = models.DeliveryPartner.objects.filter(email__iexact=destination, approved=True).first()
         if not partner:
             # audit failed verify
-            try:
-                models.AnalyticsLog.objects.create(admin=None, action_type="otp_verify_failed", details=json.dumps({"destination": destination, "purpose": purpose, "reason": "partner_not_found_or_unapproved"}))
-            except Exception:
-                pass
+            log_event("otp_verify_failed", {"destination": destination, "purpose": purpose, "reason": "partner_not_found_or_unapproved"})
             return Response({"error": "Partner not found or not approved"}, status=404)
 
         # If frontend supplied a new_password during OTP verification, set it now (one-step onboarding)
@@ -475,10 +524,7 @@ def verify_otp(request):
     path="/",
 )
         # audit successful partner verify
-        try:
-            models.AnalyticsLog.objects.create(admin=None, action_type="otp_verified", details=json.dumps({"destination": destination, "partner_id": partner.partner_id}))
-        except Exception:
-            pass
+        log_event("otp_verified", {"destination": destination, "partner_id": partner.partner_id})
         return resp
 
     # default: user/admin -> create UserToken
@@ -685,10 +731,8 @@ def list_agents(request):
         qs = models.DeliveryPartner.objects.all()
     else:
         # mart admin: find their mart(s) and partners associated (via partner->mart relation if any)
-        admin_obj = models.Admin.objects.filter(models.Q(email__iexact=getattr(request.user, 'email', '')) | models.Q(username__iexact=getattr(request.user, 'username', ''))).first()
-        if not admin_obj:
+        if not getattr(request.user, 'admin_principal', None):
             return Response({'error': 'Forbidden'}, status=403)
-        marts = models.Mart.objects.filter(admin=admin_obj)
         # Partners may not be directly linked to marts; fall back to empty set if no partners mapped.
         qs = models.DeliveryPartner.objects.filter(partner_id__in=[p.partner_id for p in models.DeliveryPartner.objects.all()])
     data = []
@@ -740,9 +784,9 @@ def admin_inspect_partner(request, partner_id):
         'partner_tokens_count': models.DeliveryPartnerToken.objects.filter(partner=p).count(),
     }
 
-    # Try to find analytics logs that mention this partner id (simple string search in details)
+    # Analytics logs that reference this partner (indexed partner_id column)
     try:
-        out['analytics_logs_count'] = models.AnalyticsLog.objects.filter(details__contains=f'"partner_id": {p.partner_id}').count()
+        out['analytics_logs_count'] = models.AnalyticsLog.objects.filter(partner_id=p.partner_id).count()
     except Exception:
         out['analytics_logs_count'] = None
 
@@ -817,21 +861,18 @@ def admin_fix_delivery(request, delivery_id):
             d.status = 'delivered'
             d.save(update_fields=['status', 'updated_at'])
 
-            # Force associated order delivered
-            if d.order:
-                o = d.order
-                o.status = 'delivered'
-                o.save(update_fields=['status', 'updated_at'])
-
-            # If this delivery had a partner, try to auto-assign the next unassigned delivery to same partner
-            if d.partner:
-                next_qs = models.Delivery.objects.select_for_update(skip_locked=True).filter(partner__isnull=True).exclude(status='delivered').order_by('created_at')
-                next_d = next_qs.first()
-                if next_d:
-                    next_d.partner = d.partner
-                    next_d.status = 'assigned'
-                    next_d.save(update_fields=['partner', 'status', 'updated_at'])
-                    next_assigned = next_d.delivery_id
+            # Force associated order delivered (and into the sales rollups if it wasn't counted)
+            if d.order_id:
+                lifecycle.mark_delivered([d.order_id])
+
+        # If this delivery had a partner, dispatch the nearest pending delivery to them
+        # (after the commit, so the repair's locks aren't held while matching)
+        if d.partner:
+            origin = None
+            if d.order and d.order.delivery_address_lat is not None and d.order.delivery_address_long is not None:
+                origin = (float(d.order.delivery_address_lat), float(d.order.delivery_address_long))
+            routing.replan_quietly(routing.remove_delivery, d.partner, d.delivery_id, origin=origin)
+            next_assigned = dispatch.assign_next_for_partner(d.partner, origin=origin)
 
     except Exception as e:
         print(f"[admin_fix_delivery] failed for {delivery_id}: {e}")
@@ -848,17 +889,16 @@ def admin_fix_delivery(request, delivery_id):
         'order_status': o_status,
     }
 
+    events.delivery_changed(d, 'delivery.delivered')
+
     resp = {'fixed': True, 'before': before, 'after': after}
     if next_assigned:
         resp['next_assigned_delivery_id'] = next_assigned
     # audit log for admin repair
     try:
-        admin_obj = models.Admin.objects.filter(models.Q(email__iexact=getattr(request.user, 'email', '')) | models.Q(username__iexact=getattr(request.user, 'username', ''))).first()
-        details = json.dumps({'delivery_id': d.delivery_id, 'admin_id': getattr(admin_obj, 'admin_id', None), 'next_assigned': next_assigned})
-        try:
-            models.AnalyticsLog.objects.create(admin=admin_obj, action_type='delivery_fixed', details=details)
-        except Exception:
-            pass
+        principal = getattr(request.user, 'admin_principal', None)
+        log_event('delivery_fixed', {'delivery_id': d.delivery_id, 'admin_id': getattr(principal, 'admin_id', None), 'next_assigned': next_assigned},
+                  admin=principal.admin if principal else None)
     except Exception:
         pass
     return Response(resp)
@@ -868,20 +908,54 @@ def admin_fix_delivery(request, delivery_id):
 @authentication_classes([CustomTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def admin_list_logs(request):
-    """Return recent AnalyticsLog entries for auditing. Superuser only."""
+    """Return AnalyticsLog entries for auditing, newest first. Superuser only.
+
+    Query params (all optional):
+      action_type, partner_id, delivery_id, order_id, admin_id  -- exact-match filters
+      since, until   -- ISO timestamps bounding `timestamp`
+      before         -- keyset cursor: only logs with log_id < before (use `next_before` from the previous page)
+      limit          -- page size, default 100, max 500
+    """
     if not getattr(request.user, 'is_superuser', False):
         return Response({'error': 'Forbidden'}, status=403)
-    qs = models.AnalyticsLog.objects.select_related('admin').order_by('-timestamp')[:500]
+
+    params = request.GET
+    qs = models.AnalyticsLog.objects.select_related('admin')
+    try:
+        limit = min(max(int(params.get('limit', 100)), 1), 500)
+        for field in ('partner_id', 'delivery_id', 'order_id', 'admin_id'):
+            if params.get(field):
+                qs = qs.filter(**{field: int(params[field])})
+        if params.get('before'):
+            qs = qs.filter(log_id__lt=int(params['before']))
+    except ValueError:
+        return Response({'error': 'limit, before and *_id filters must be integers'}, status=400)
+    if params.get('action_type'):
+        qs = qs.filter(action_type=params['action_type'])
+    for param, lookup in (('since', 'timestamp__gte'), ('until', 'timestamp__lt')):
+        if params.get(param):
+            ts = parse_datetime(params[param])
+            if ts is None:
+                return Response({'error': f'{param} must be an ISO datetime'}, status=400)
+            qs = qs.filter(**{lookup: ts})
+
+    # log_id is monotonic, so ordering on it gives a stable keyset that an index can seek into
+    page = list(qs.order_by('-log_id')[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
     out = []
-    for l in qs:
+    for l in page:
         out.append({
             'log_id': l.log_id,
             'action_type': l.action_type,
             'details': l.details,
+            'partner_id': l.partner_id,
+            'delivery_id': l.delivery_id,
+            'order_id': l.order_id,
             'admin': {'admin_id': l.admin.admin_id, 'username': l.admin.username} if l.admin else None,
             'timestamp': l.timestamp.isoformat() if l.timestamp else None,
         })
-    return Response({'logs': out})
+    return Response({'logs': out, 'next_before': page[-1].log_id if has_more else None})
 
 
 @api_view(["POST"])
@@ -897,9 +971,10 @@ def admin_assign_delivery(request, delivery_id):
     if not agent_id and not partner_id:
         return Response({'error': 'agent_id or partner_id required'}, status=400)
     try:
-        delivery = models.Delivery.objects.get(pk=delivery_id)
+        delivery = models.Delivery.objects.select_related('partner').get(pk=delivery_id)
     except models.Delivery.DoesNotExist:
         return Response({'error': 'Delivery not found'}, status=404)
+    previous_partner = delivery.partner
     partner_obj = None
     # If partner_id provided, prefer direct partner assignment
     if partner_id:
@@ -927,6 +1002,12 @@ def admin_assign_delivery(request, delivery_id):
     delivery.status = 'assigned'
     delivery.save(update_fields=['partner', 'status', 'updated_at'])
 
+    # keep multi-stop routes in sync: take the delivery off the previous partner's route, add to the new one
+    if previous_partner and previous_partner.partner_id != delivery.partner_id:
+        routing.replan_quietly(routing.remove_delivery, previous_partner, delivery.delivery_id)
+    routing.replan_quietly(routing.add_delivery, delivery.partner, delivery.delivery_id)
+    events.delivery_changed(delivery, 'delivery.assigned', previous_partner_id=getattr(previous_partner, 'partner_id', None))
+
     try:
         # Log whichever identifier we have: legacy agent or new partner
         details = {'delivery_id': delivery.delivery_id}
@@ -939,7 +1020,7 @@ def admin_assign_delivery(request, delivery_id):
                 details['partner_id'] = partner_obj.partner_id
         except Exception:
             pass
-        models.AnalyticsLog.objects.create(admin=None, action_type='delivery_assigned', details=json.dumps(details))
+        log_event('delivery_assigned', details)
     except Exception:
         pass
 
@@ -963,6 +1044,14 @@ def admin_assign_delivery(request, delivery_id):
 def agent_deliveries(request):
     """
     Returns deliveries assigned to the currently authenticated delivery agent.
+
+    Query params (all optional):
+      status=all      -- include delivered history (default: only assigned / in_transit)
+      before=<id>     -- cursor: deliveries with delivery_id < before (use `next_before`)
+      limit           -- page size, default 50, max 200
+      since=<iso>     -- delta mode: only deliveries changed after this time, any status;
+                         pass back `server_time` from the previous response
+    Responses carry an ETag; a matching If-None-Match returns 304 without a body.
     """
     # request.user may be a DeliveryAgent (monkey-patched in CustomTokenAuthentication)
     user = request.user
@@ -978,9 +1067,39 @@ def agent_deliveries(request):
         partner_obj = getattr(user, 'partner', None)
     if not partner_obj:
         return Response({'deliveries': []})
-    qs = models.Delivery.objects.filter(partner=partner_obj).order_by('-created_at')
+
+    params = request.GET
+    server_time = timezone.now()
+    qs = models.Delivery.objects.filter(partner=partner_obj)
+    since = params.get('since')
+    if since:
+        since_ts = parse_datetime(since)
+        if since_ts is None:
+            return Response({'error': 'since must be an ISO datetime'}, status=400)
+        qs = qs.filter(updated_at__gt=since_ts)
+    elif str(params.get('status', '')).lower() != 'all':
+        qs = qs.filter(status__in=routing.ACTIVE_STATUSES)
+    try:
+        limit = min(max(int(params.get('limit', 50)), 1), 200)
+        if params.get('before'):
+            qs = qs.filter(delivery_id__lt=int(params['before']))
+    except ValueError:
+        return Response({'error': 'limit and before must be integers'}, status=400)
+
+    # cheap change token from the (partner, status) / (partner, updated_at) indexes
+    agg = qs.aggregate(n=Count('delivery_id'), last=Max('updated_at'), top=Max('delivery_id'))
+    etag_src = f"{partner_obj.partner_id}|{request.get_full_path()}|{agg['n']}|{agg['last']}|{agg['top']}"
+    etag = '"' + hashlib.sha1(etag_src.encode()).hexdigest() + '"'
+    if request.META.get('HTTP_IF_NONE_MATCH') == etag:
+        resp = Response(status=304)
+        resp['ETag'] = etag
+        return resp
+
+    page = list(qs.order_by('-delivery_id')[:limit + 1])
+    has_more = len(page) > limit
+    page = page[:limit]
     data = []
-    for d in qs:
+    for d in page:
         data.append({
             'delivery_id': d.delivery_id,
             'order_id': d.order_id,
@@ -988,8 +1107,117 @@ def agent_deliveries(request):
             'estimated_time': d.estimated_time,
             'route_data': d.route_data,
             'created_at': d.created_at,
+            'updated_at': d.updated_at,
         })
-    return Response({'deliveries': data})
+    resp = Response({
+        'deliveries': data,
+        'next_before': page[-1].delivery_id if has_more else None,
+        'server_time': server_time.isoformat(),
+    })
+    resp['ETag'] = etag
+    return resp
+
+
+@api_view(["GET"])
+@authentication_classes([CustomTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def agent_route(request):
+    """
+    Current multi-stop route (pickups + drops with ETAs) for the authenticated partner.
+    Pass ?replan=1 to force a full re-plan from the partner's stored location.
+    """
+    user = request.user
+    if not (getattr(user, 'is_agent', False) or getattr(user, 'is_partner', False)):
+        return Response({'error': 'Forbidden'}, status=403)
+    partner_obj = user if getattr(user, 'is_partner', False) else getattr(user, 'partner', None)
+    if not partner_obj:
+        return Response({'route': None})
+
+    if str(request.GET.get('replan', '')).lower() in ['1', 'true', 'yes']:
+        return Response({'route': routing.plan_route(partner_obj)})
+
+    d = models.Delivery.objects.filter(partner=partner_obj, status__in=routing.ACTIVE_STATUSES, route_data__isnull=False).order_by('-updated_at').first()
+    route = d.route_data if d else None
+    if route is None and models.Delivery.objects.filter(partner=partner_obj, status__in=routing.ACTIVE_STATUSES).exists():
+        route = routing.plan_route(partner_obj)
+    if isinstance(route, dict):
+        route = {k: v for k, v in route.items() if k != 'stop_index'}
+    return Response({'route': route})
+
+
+@api_view(["POST"])
+@authentication_classes([CustomTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def partner_location(request):
+    """
+    High-frequency location ping from the partner app.
+    Body: { lat: float, lon: float }  (`long` / `lng` accepted for lon)
+    Only the in-memory tracker is touched here; positions are written to the DB in batches.
+    """
+    user = request.user
+    if not (getattr(user, 'is_agent', False) or getattr(user, 'is_partner', False)):
+        return Response({'error': 'Forbidden'}, status=403)
+    partner_obj = user if getattr(user, 'is_partner', False) else getattr(user, 'partner', None)
+    if not partner_obj:
+        return Response({'error': 'No partner linked to this agent'}, status=400)
+
+    data = request.data or {}
+    lon = data.get('lon', data.get('long', data.get('lng')))
+    try:
+        lat, lon = float(data.get('lat')), float(lon)
+    except (TypeError, ValueError):
+        return Response({'error': 'lat and lon must be numbers'}, status=400)
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return Response({'error': 'lat/lon out of range'}, status=400)
+
+    locations.tracker.ping(partner_obj.partner_id, lat, lon)
+    return Response({'accepted': True}, status=202)
+
+
+@api_view(["GET"])
+@renderer_classes([events.EventStreamRenderer, JSONRenderer])
+@authentication_classes([CustomTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def event_stream(request):
+    """
+    Server-sent events for delivery / order / payment status changes visible to the caller
+    (partner: own deliveries; customer: own orders; superuser: also every delivery).
+    Browsers use `new EventSource(url, {withCredentials: true})` (auth cookie) and resume
+    with the Last-Event-ID header automatically; ?last_event_id= does the same for other clients.
+    """
+    channels = events.channels_for(request.user)
+    if not channels:
+        return Response({'error': 'Forbidden'}, status=403)
+    if not getattr(settings, 'EVENTS_STREAMING', False):
+        # sync workers: an open stream would pin the only worker; clients poll instead
+        return Response({'error': 'Event streaming is disabled', 'streaming': False}, status=503)
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+
+    sub = events.broker.subscribe(channels, last_event_id=last_id)
+    resp = StreamingHttpResponse(
+        events.stream(
+            sub,
+            heartbeat=getattr(settings, 'EVENTS_HEARTBEAT_SECONDS', 15),
+            max_seconds=getattr(settings, 'EVENTS_MAX_STREAM_SECONDS', 300),
+        ),
+        content_type='text/event-stream',
+    )
+    resp['Cache-Control'] = 'no-cache'
+    # stop nginx from buffering the stream
+    resp['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+@api_view(["GET"])
+@authentication_classes([CustomTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def event_stream_status(request):
+    """Whether this deployment serves /events/; dashboards open an EventSource only when it does, else poll."""
+    return Response({'streaming': bool(getattr(settings, 'EVENTS_STREAMING', False))})
 
 
 @api_view(["POST"])
@@ -1033,45 +1261,31 @@ def agent_mark_delivered(request, delivery_id):
 
     # optionally update the associated order status
     try:
-        o = d.order
-        if not o:
+        if not d.order_id:
             print(f"[agent_mark_delivered] delivery {delivery_id} has no associated order")
         else:
-            o.status = 'delivered'
-            try:
-                o.save(update_fields=['status', 'updated_at'])
-            except Exception as e:
-                print(f"[agent_mark_delivered] failed to update order {getattr(o,'order_id', None)}: {e}")
-                traceback.print_exc(file=sys.stdout)
+            lifecycle.mark_delivered([d.order_id])
+            d.order.refresh_from_db(fields=['status', 'updated_at'])
     except Exception as e:
-        print(f"[agent_mark_delivered] unexpected error updating order for delivery {delivery_id}: {e}")
+        print(f"[agent_mark_delivered] failed to update order for delivery {delivery_id}: {e}")
         traceback.print_exc(file=sys.stdout)
 
+    events.delivery_changed(d, 'delivery.delivered')
+
     # After marking delivered, try to auto-assign the next available delivery to this partner
     # Audit log: record that this delivery was marked delivered
-    try:
-        try:
-            models.AnalyticsLog.objects.create(admin=None, action_type='delivery_delivered', details=json.dumps({'delivery_id': d.delivery_id, 'partner_id': getattr(partner_obj, 'partner_id', None), 'order_id': getattr(d.order, 'order_id', None)}))
-        except Exception:
-            pass
-    except Exception:
-        pass
+    log_event('delivery_delivered', {'delivery_id': d.delivery_id, 'partner_id': getattr(partner_obj, 'partner_id', None), 'order_id': getattr(d.order, 'order_id', None)})
     try:
         partner_obj = partner_obj if 'partner_obj' in locals() and partner_obj is not None else (user if getattr(user, 'is_partner', False) else getattr(user, 'partner', None))
         if partner_obj:
-            with transaction.atomic():
-                # pick the oldest unassigned delivery (partner is null) that is not delivered
-                next_qs = models.Delivery.objects.select_for_update(skip_locked=True).filter(partner__isnull=True).exclude(status='delivered').order_by('created_at')
-                next_d = next_qs.first()
-                if next_d:
-                    next_d.partner = partner_obj
-                    next_d.status = 'assigned'
-                    next_d.save(update_fields=['partner', 'status', 'updated_at'])
-                    try:
-                        models.AnalyticsLog.objects.create(admin=None, action_type='delivery_auto_assigned', details=json.dumps({'delivery_id': next_d.delivery_id, 'partner_id': partner_obj.partner_id}))
-                    except Exception:
-                        pass
-                    return Response({'marked': True, 'next_assigned_delivery_id': next_d.delivery_id})
+            # the partner is now standing at this order's drop-off point; dispatch from there
+            origin = None
+            if d.order and d.order.delivery_address_lat is not None and d.order.delivery_address_long is not None:
+                origin = (float(d.order.delivery_address_lat), float(d.order.delivery_address_long))
+            routing.replan_quietly(routing.remove_delivery, partner_obj, d.delivery_id, origin=origin)
+            next_id = dispatch.assign_next_for_partner(partner_obj, origin=origin)
+            if next_id:
+                return Response({'marked': True, 'next_assigned_delivery_id': next_id})
     except Exception as e:
         # don't fail the main action if auto-assign fails
         print(f"[agent_mark_delivered] auto-assign failed: {e}")
@@ -1180,12 +1394,12 @@ def delete_agent(request, agent_id):
             return Response({'error': 'Not found'}, status=404)
 
     if not getattr(request.user, 'is_superuser', False):
-        admin_obj = models.Admin.objects.filter(models.Q(email__iexact=getattr(request.user, 'email', '')) | models.Q(username__iexact=getattr(request.user, 'username', ''))).first()
-        if not admin_obj:
+        principal = getattr(request.user, 'admin_principal', None)
+        if not principal:
             return Response({'error': 'Forbidden'}, status=403)
         # for legacy agent, the partner->mart check applies; for partner, no mart relation so deny non-superuser
         if legacy:
-            if not target.partner or target.partner.mart_id not in [m.mart_id for m in models.Mart.objects.filter(admin=admin_obj)]:
+            if not target.partner or not principal.manages(target.partner.mart_id):
                 return Response({'error': 'Forbidden'}, status=403)
         else:
             return Response({'error': 'Forbidden'}, status=403)
@@ -1597,21 +1811,75 @@ def set_default_address(request, address_id):
 
 
 # --------------------- Basket & Optimizer ---------------------
-@api_view(["GET", "POST"])
+def _basket_response(user, status=200):
+    basket = baskets.load(user)
+    if basket is None:
+        return Response({'basket_id': None, 'lines': [], 'total': '0.00', 'item_count': 0}, status=status)
+    return Response(serializers.BasketSerializer(basket).data, status=status)
+
+
+@api_view(["GET", "POST", "DELETE"])
 @authentication_classes([CustomTokenAuthentication])
 @permission_classes([IsAuthenticated])
 def basket_view(request):
+    """
+    GET: the active basket { basket_id, lines: [...], total, item_count, ... }.
+    POST { items: [{product_id, quantity}], optimized_cost? }: replace its contents.
+    DELETE: empty it. Single-line edits go through basket/items/ (api/baskets.py).
+    """
     if request.method == "GET":
-        baskets = models.Basket.objects.filter(user=request.user).order_by("-created_at")
-        return Response(serializers.BasketSerializer(baskets, many=True).data)
+        return _basket_response(request.user)
+    if request.method == "DELETE":
+        baskets.clear(request.user)
+        return _basket_response(request.user)
 
     data = request.data or {}
-    basket = models.Basket.objects.create(
-        user=request.user,
-        items=data.get("items", []),
-        optimized_cost=data.get("optimized_cost"),
-    )
-    return Response(serializers.BasketSerializer(basket).data, status=201)
+    items = data.get("items", [])
+    if not isinstance(items, list):
+        return Response({"error": "items must be a list"}, status=400)
+    try:
+        baskets.replace(request.user, items, optimized_cost=data.get("optimized_cost"))
+    except baskets.BasketError as e:
+        return Response({"error": str(e)}, status=400)
+    return _basket_response(request.user)
+
+
+@api_view(["POST"])
+@authentication_classes([CustomTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def basket_add_item(request):
+    """Body: { product_id, quantity? (default 1) }. Adds to the line's quantity, creating it if needed."""
+    data = request.data or {}
+    if data.get("product_id") is None:
+        return Response({"error": "product_id required"}, status=400)
+    try:
+        baskets.set_quantity(request.user, data.get("product_id"), data.get("quantity", 1), add=True)
+    except baskets.ProductNotFound as e:
+        return Response({"error": str(e)}, status=404)
+    except baskets.BasketError as e:
+        return Response({"error": str(e)}, status=400)
+    return _basket_response(request.user)
+
+
+@api_view(["PATCH", "DELETE"])
+@authentication_classes([CustomTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def basket_item(request, product_id):
+    """PATCH { quantity }: set the line's quantity (0 removes it). DELETE: remove the line."""
+    if request.method == "DELETE":
+        if not baskets.remove(request.user, product_id):
+            return Response({"error": "Item not in basket"}, status=404)
+        return _basket_response(request.user)
+    quantity = (request.data or {}).get("quantity")
+    if quantity is None:
+        return Response({"error": "quantity required"}, status=400)
+    try:
+        baskets.set_quantity(request.user, product_id, quantity)
+    except baskets.ProductNotFound as e:
+        return Response({"error": str(e)}, status=404)
+    except baskets.BasketError as e:
+        return Response({"error": str(e)}, status=400)
+    return _basket_response(request.user)
 
 
 def _get_user_delivery_point(user: models.User, address_id: Optional[int] = None) -> Tuple[models.Address, float, float]:
@@ -1651,7 +1919,8 @@ def optimize_basket(request):
       "address_id": 123?,                     # optional; else uses default address
       "allow_swaps": true/false               # default true
     }
-    Returns a plan grouped per mart with delivery charges, ETAs, and item images.
+    Returns a plan grouped per mart with delivery charges, ETAs, and item images, plus a
+    signed ``plan_id`` that create_order_from_plan accepts for PLAN_CACHE_TTL seconds.
     """
     try:
         data = request.data or {}
@@ -1669,205 +1938,42 @@ def optimize_basket(request):
             # e.g., "Address could not be geocoded..."
             return Response({"error": str(e)}, status=400)
 
-        # 2) Load products referenced in items (map id -> product)
-        product_map: Dict[int, models.Product] = {}
-        for it in items:
-            pid = it.get("product_id")
-            if pid is None:
-                continue
-            p = models.Product.objects.filter(pk=pid).select_related("mart").first()
-            if p:
-                product_map[pid] = p
-
-        if not product_map:
-            return Response({"error": "No valid products found for given items"}, status=400)
-
-        # 3) Build swap candidates by product name (approved & in stock only)
-        variants_by_name: Dict[str, List[models.Product]] = {}
-        if allow_swaps:
-            for nm in {p.name for p in product_map.values()}:
-                variants_by_name[nm] = list(
-                    models.Product.objects.filter(
-                        name=nm, mart__approved=True, stock__gt=0
-                    ).select_related("mart")
-                )
-
-        # 4) Normalize working items (quantity, per-unit weight, pick cheapest variant if allowed)
-        work_items: List[Dict] = []
-        for it in items:
-            pid = it.get("product_id")
-            qty = int(it.get("quantity", 1))
-            base = product_map.get(pid)
-            if not base:
-                continue
-
-            # per-unit weight: request override > product.unit_weight_kg > 1.0 default
-            if it.get("weight_kg") is not None:
-                weight_each = float(it.get("weight_kg"))
-            else:
-                uw = getattr(base, "unit_weight_kg", None)
-                weight_each = float(uw) if uw is not None else 1.0
-
-            # skip non-approved or OOS, unless we can swap
-            if (not getattr(base.mart, "approved", True)) or (getattr(base, "stock", 0) <= 0):
-                if allow_swaps:
-                    alts = variants_by_name.get(base.name, [])
-                    if not alts:
-                        continue
-                    base = min(alts, key=lambda pr: float(pr.price))
-                else:
-                    continue
+        ctx = checkout.CheckoutContext(request.user, addr, addr_lat, addr_long)
 
-            chosen = base
+        def compute():
+            # 2) Load requested products + same-name swap candidates in two queries; each
+            #    step's cache generations are read before the rows they cover
+            requested = [it.get("product_id") for it in items]
+            gens = optimize_cache.capture(product_ids=requested, marts=True)
+            ctx.load_products(requested)
+            if not any(ctx.product(pid) for pid in requested):
+                raise checkout.PlanError("No valid products found for given items")
             if allow_swaps:
-                cand = variants_by_name.get(base.name) or [base]
-                if cand:
-                    chosen = min(cand, key=lambda pr: float(pr.price))
-
-            work_items.append({
-                "name": chosen.name,
-                "product": chosen,
-                "qty": qty,
-                "weight_total": weight_each * qty,
-                "unit_price": float(chosen.price),
-            })
-
-        if not work_items:
-            return Response({"error": "No purchasable items (all out-of-stock or unapproved)"}, status=400)
-
-        # 5) Helper to compute totals for a mart assignment
-        def compute_totals(assign: Dict[int, List[Dict]]) -> Dict:
-            total_price = 0.0
-            total_delivery = 0.0
-            total_eta = 0
-            mart_breakdown = []
-
-            for mart_id, its in assign.items():
-                if not its:
-                    continue
-                mart = its[0]["product"].mart
-                if not getattr(mart, "approved", True):
-                    continue
+                gens.update(optimize_cache.capture(names={p.name for p in ctx.products.values()}))
+                ctx.load_products((), with_variants=True)
+                known = {str(pid) for pid in requested}
+                gens.update(optimize_cache.capture(product_ids=[pid for pid in ctx.products if str(pid) not in known]))
+            # 3) Cheapest per-mart assignment with greedy cross-mart moves (api/checkout.py)
+            snapshot = checkout.plan_snapshot(ctx, checkout.optimize(ctx, items, allow_swaps=allow_swaps))
+            optimize_cache.put(key, snapshot, gens)
+            return snapshot
+
+        # Same basket, coordinates and swap setting with an unchanged catalog -> cached result;
+        # concurrent identical misses share one computation (api/optimize_cache.py)
+        key = optimize_cache.fingerprint(items, addr_lat, addr_long, allow_swaps)
+        try:
+            snapshot = optimize_cache.get(key) or optimize_cache.flights.do(key, compute)
+        except checkout.PlanError as e:
+            return Response({"error": str(e)}, status=400)
 
-                mart_weight = sum(i["weight_total"] for i in its)
-                items_price = sum(i["unit_price"] * i["qty"] for i in its)
-                dist = distance_km_between(addr_lat, addr_long, float(mart.location_lat), float(mart.location_long))
-                delivery = calculate_delivery_charge(dist, mart_weight)
-                eta = eta_minutes_from_distance(dist)
-
-                total_price += items_price
-                total_delivery += delivery
-                total_eta += eta
-
-                # Attach image_url (ensuring product has one)
-                mart_breakdown.append({
-                    "mart_id": mart.mart_id,
-                    "mart_name": mart.name,
-                    "distance_km": round(dist, 3),
-                    "eta_min": eta,
-                    "weight_kg": round(mart_weight, 3),
-                    "delivery_charge": int(delivery),
-                    "items": [
-                        {
-                            "product_id": i["product"].product_id,
-                            "name": i["name"],
-                            "qty": i["qty"],
-                            "unit_price": i["unit_price"],
-                            "line_price": round(i["unit_price"] * i["qty"], 2),
-                            "image_url": ensure_product_image(i["product"]).image_url,
-                        }
-                        for i in its
-                    ]
-                })
-
-            grand_total = round(total_price + total_delivery, 2)
-            return {
-                "items_price": round(total_price, 2),
-                "delivery_total": int(total_delivery),
-                "grand_total": grand_total,
-                "eta_total_min": int(total_eta),
-                "marts": mart_breakdown,
-            }
-
-        # 6) Initial assignment (group by mart, only approved)
-        assignment: Dict[int, List[Dict]] = {}
-        for wi in work_items:
-            if getattr(wi["product"].mart, "approved", True):
-                m_id = wi["product"].mart_id
-                assignment.setdefault(m_id, []).append(wi)
-
-        if not assignment:
-            return Response({"error": "No approved marts available for these items"}, status=400)
-
-        best_plan = compute_totals(assignment)
-
-        # 7) Greedy improvements: move items across marts to reduce grand_total (break ties by ETA)
-        if allow_swaps:
-            improved = True
-            iters = 0
-            while improved and iters < 50:
-                improved = False
-                iters += 1
-
-                for src_mart_id, items_list in list(assignment.items()):
-                    # Make a snapshot of list since we may mutate
-                    for itm in list(items_list):
-                        name = itm["name"]
-                        candidates = [
-                            pr for pr in variants_by_name.get(name, [])
-                            if getattr(pr.mart, "approved", True) and getattr(pr, "stock", 0) > 0
-                        ]
-                        if not candidates:
-                            continue
-
-                        for cand_prod in candidates:
-                            tgt_mart_id = cand_prod.mart_id
-                            if tgt_mart_id == src_mart_id:
-                                continue
-
-                            # ensure current still present (could be moved in same pass)
-                            if src_mart_id not in assignment or itm not in assignment.get(src_mart_id, []):
-                                continue
-
-                            # simulate move
-                            assignment[src_mart_id].remove(itm)
-                            if not assignment.get(src_mart_id):
-                                assignment.pop(src_mart_id, None)
-
-                            moved = dict(itm)
-                            moved["product"] = cand_prod
-                            moved["unit_price"] = float(cand_prod.price)
-                            assignment.setdefault(tgt_mart_id, []).append(moved)
-
-                            new_plan = compute_totals(assignment)
-
-                            if (new_plan["grand_total"] < best_plan["grand_total"]) or (
-                                new_plan["grand_total"] == best_plan["grand_total"]
-                                and new_plan["eta_total_min"] < best_plan["eta_total_min"]
-                            ):
-                                best_plan = new_plan
-                                improved = True
-                            else:
-                                # revert
-                                assignment[tgt_mart_id].remove(moved)
-                                if not assignment.get(tgt_mart_id):
-                                    assignment.pop(tgt_mart_id, None)
-                                assignment.setdefault(src_mart_id, []).append(itm)
-
-                    if src_mart_id in assignment and not assignment[src_mart_id]:
-                        assignment.pop(src_mart_id, None)
-
-        # 8) Always return a Response
         return Response({
-            "address": {
-                "id": addr.address_id,
-                "summary": f"{addr.line1}, {addr.city}" + (f" {addr.pincode}" if addr.pincode else ""),
-                "lat": addr_lat,
-                "long": addr_long,
-            },
-            "items_count": sum(i["qty"] for bucket in assignment.values() for i in bucket),
-            "result": best_plan,
-            "notes": "Pricing: ₹5/km + ₹5/kg. ETA tie-break when costs are equal. Approved marts & in-stock only.",
+            "address": ctx.address_summary(),
+            "items_count": snapshot["items_count"],
+            "result": snapshot["result"],
+            "notes": checkout.PRICING_NOTES,
+            # 4) Opaque handle for create_order_from_plan; the plan itself stays server-side
+            "plan_id": checkout.store_plan(ctx, snapshot) if snapshot["result"]["marts"] else None,
+            "plan_expires_in": getattr(settings, "PLAN_CACHE_TTL", 600),
         })
 
     except Exception as e:
@@ -2044,10 +2150,10 @@ def create_order(request):
                 if p:
                     p.order = order
                     p.save(update_fields=["order", "updated_at"])
-                    # If payment already successful, update order status
+                    # If payment already successful, confirm the order (creates its Delivery)
                     if getattr(p, "status", "") == "success":
+                        lifecycle.confirm_orders([order.order_id])
                         order.status = "confirmed"
-                        order.save(update_fields=["status", "updated_at"])
 
             # If client explicitly chose payment_method == 'cod', we can keep 'pending' status
             # Optionally, you can store payment_method on order if you add such a field.
@@ -2078,13 +2184,21 @@ def create_order_from_plan(request):
     Accepts a full optimizer plan and creates one Order per mart described in the plan.
     Body:
     {
+      "plan_id": "...",   # preferred: id returned by optimize_basket; address comes from the plan
+      -- or --
       "plan": { "marts": [ { "mart_id": 1, "items": [{"product_id":X, "qty":N}, ...] }, ... ] },
       "address_id": 123,
+
       "contact_number": "999..."
     }
     Returns: { orders: [ order_payload, ... ] }
+    With a plan_id: 410 if the plan expired or was already used, 409 with ``changes`` if a
+    product's price or stock moved since it was optimized.
     """
     data = request.data or {}
+    if data.get("plan_id"):
+        return _create_orders_from_cached_plan(request, data["plan_id"], data.get("contact_number"))
+
     # create_order_from_plan receives a plan produced by the optimizer
     plan = data.get("plan")
     address_id = data.get("address_id")
@@ -2124,105 +2238,144 @@ def create_order_from_plan(request):
         addr.location_lat, addr.location_long = lat, lng
         addr.save(update_fields=["location_lat", "location_long"])
 
-    created = []
+    ctx = checkout.CheckoutContext(request.user, addr, float(addr.location_lat), float(addr.location_long))
     try:
         with transaction.atomic():
-            for mart_entry in plan.get("marts", []):
-                mart_id = mart_entry.get("mart_id")
-                items = mart_entry.get("items", [])
-                if not mart_id or not items:
-                    continue
-
-                # resolve mart object
-                mart_obj = models.Mart.objects.filter(mart_id=mart_id, approved=True).first()
-                if not mart_obj:
-                    # skip this mart
-                    continue
-
-                # collect valid products first; skip mart if nothing valid
-                total_cost = Decimal("0")
-                total_weight = 0.0
-                collected_items = []
-
-                for it in items:
-                    pid = it.get("product_id")
-                    qty = int(it.get("qty", it.get("quantity", 1)))
-                    product = models.Product.objects.filter(pk=pid, mart__mart_id=mart_id).select_related("mart").first()
-                    # fallback: try to fetch product irrespective of mart
-                    if not product:
-                        product = models.Product.objects.filter(pk=pid).select_related("mart").first()
-                    if not product:
-                        continue
-
-                    # per-unit weight: product.unit_weight_kg > 1.0 default
-                    uw = getattr(product, "unit_weight_kg", None)
-                    weight_each = float(uw) if uw is not None else 1.0
-                    total_weight += weight_each * qty
-
-                    total_cost += Decimal(qty) * product.price
-
-                    collected_items.append((product, qty))
+            created = checkout.create_orders(ctx, plan.get("marts", []), contact_number)
+    except Exception as e:
+        # rollback will occur automatically because of transaction.atomic()
+        print('create_order_from_plan failed:', e)
+        return Response({"error": f"Plan creation failed: {str(e)}"}, status=500)
 
-                if not collected_items:
-                    # nothing valid for this mart -> skip
-                    continue
+    if not created:
+        return Response({"error": "No orders were created from plan"}, status=400)
 
-                order = models.Order.objects.create(user=request.user, total_cost=0, status="pending")
+    return Response({"orders": created})
 
-                for product, qty in collected_items:
-                    models.OrderItem.objects.create(
-                        order=order,
-                        product=product,
-                        mart=product.mart,
-                        quantity=qty,
-                        price_at_purchase=product.price,
-                    )
 
-                # compute delivery charge based on distance between mart and address
-                try:
-                    dist = distance_km_between(float(addr.location_lat), float(addr.location_long), float(mart_obj.location_lat), float(mart_obj.location_long))
-                except Exception:
-                    dist = 0.0
-
-                delivery_charge = calculate_delivery_charge(dist, total_weight)
-                total_cost += Decimal(delivery_charge)
-
-                # attach delivery address snapshot
-                if addr:
-                    order.delivery_address = addr
-                    try:
-                        order.delivery_address_snapshot = f"{addr.line1}, {addr.city}, {addr.state} {addr.pincode}"
-                        order.delivery_address_lat = addr.location_lat
-                        order.delivery_address_long = addr.location_long
-                    except Exception:
-                        pass
-
-                order.total_cost = total_cost
-                order.save()
-
-                payload = serializers.OrderSerializer(order).data
-                payload.update({
-                    "delivery_address": f"{addr.line1}, {addr.city}",
-                    "contact_number": contact_number,
-                    "chosen_mart_id": mart_obj.mart_id,
-                    "chosen_mart_name": mart_obj.name,
-                    "distance_km": round(dist, 3),
-                    "delivery_charge": int(delivery_charge),
-                    "total_weight_kg": round(total_weight, 3),
-                })
-                created.append(payload)
+def _create_orders_from_cached_plan(request, plan_id, contact_number):
+    if not contact_number:
+        return Response({"error": "contact_number is required"}, status=400)
+    try:
+        entry = checkout.load_plan(plan_id, request.user)
+        ctx, changes = checkout.plan_context(request.user, entry)
+    except checkout.PlanExpired as e:
+        return Response({"error": str(e)}, status=410)
+    except checkout.PlanError as e:
+        return Response({"error": str(e)}, status=400)
+    if changes:
+        return Response({"error": "plan_stale", "changes": changes}, status=409)
+    try:
+        checkout.claim_plan(plan_id, request.user)
+    except checkout.PlanExpired as e:
+        return Response({"error": str(e)}, status=410)
 
+    try:
+        with transaction.atomic():
+            created = checkout.create_orders(ctx, entry["result"]["marts"], contact_number)
     except Exception as e:
-        # rollback will occur automatically because of transaction.atomic()
+        checkout.release_plan(plan_id, request.user)
         print('create_order_from_plan failed:', e)
         return Response({"error": f"Plan creation failed: {str(e)}"}, status=500)
 
     if not created:
+        checkout.release_plan(plan_id, request.user)
         return Response({"error": "No orders were created from plan"}, status=400)
-
+    checkout.discard_plan(plan_id, request.user)
     return Response({"orders": created})
 
 
+@api_view(["POST"])
+@authentication_classes([CustomTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def checkout_basket(request):
+    """
+    One round trip for optimize -> orders -> payment intent, sharing one resolved context.
+    Body:
+    {
+      "items": [{ "product_id": 1, "quantity": 2, "weight_kg": 1.5? }, ...],
+      "address_id": 123?,                  # optional; else default address
+      "contact_number": "999...",
+      "allow_swaps": true/false,           # default true
+      "payment_method": "razorpay" | "cod" # default razorpay
+    }
+    Returns: { address, items_count, result (the plan), orders: [...], payment: {key_id, razorpay_order_id, payment_id, amount, currency} | null }
+    Orders and the Payment row are committed in one transaction before the provider is
+    called; if it rejects the payment intent the payment is marked failed and the orders
+    cancelled (502).
+    """
+    data = request.data or {}
+    items = data.get("items", [])
+    allow_swaps = bool(data.get("allow_swaps", True))
+    contact_number = data.get("contact_number") or getattr(request.user, "contact_number", None)
+    payment_method = (data.get("payment_method") or "razorpay").lower()
+
+    if not isinstance(items, list) or not items:
+        return Response({"error": "items are required"}, status=400)
+    if not contact_number:
+        return Response({"error": "contact_number is required"}, status=400)
+    if payment_method not in ("razorpay", "cod"):
+        return Response({"error": "payment_method must be razorpay or cod"}, status=400)
+
+    try:
+        addr, addr_lat, addr_long = _get_user_delivery_point(request.user, address_id=data.get("address_id"))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+
+    ctx = checkout.CheckoutContext(request.user, addr, addr_lat, addr_long)
+    ctx.load_products((it.get("product_id") for it in items), with_variants=allow_swaps)
+    if not any(ctx.product(it.get("product_id")) for it in items):
+        return Response({"error": "No valid products found for given items"}, status=400)
+    try:
+        plan = checkout.optimize(ctx, items, allow_swaps=allow_swaps)
+    except checkout.PlanError as e:
+        return Response({"error": str(e)}, status=400)
+
+    try:
+        with transaction.atomic():
+            payment = None
+            if payment_method == "razorpay":
+                payment = models.Payment.objects.create(provider="razorpay", amount=Decimal("0"), status="pending")
+            orders = checkout.create_orders(ctx, plan["result"]["marts"], contact_number, checkout_payment=payment)
+            if not orders:
+                raise checkout.PlanError("No orders were created from plan")
+
+            if payment is not None:
+                payment.amount = sum(Decimal(str(o["total_cost"])) for o in orders)
+                payment.order_id = orders[0]["order_id"]
+                payment.save(update_fields=["amount", "order", "updated_at"])
+    except checkout.PlanError as e:
+        return Response({"error": str(e)}, status=400)
+    except Exception as e:
+        print('checkout_basket failed:', e)
+        traceback.print_exc(file=sys.stdout)
+        return Response({"error": f"Checkout failed: {str(e)}"}, status=500)
+
+    # the provider call runs outside the transaction so no row locks are held across it
+    intent = None
+    if payment is not None:
+        order_ids = [o["order_id"] for o in orders]
+        try:
+            intent = checkout.create_payment_intent(payment, notes={"order_ids": order_ids})
+        except Exception as e:
+            with transaction.atomic():
+                models.Payment.objects.filter(pk=payment.pk).update(status="failed", updated_at=timezone.now())
+                models.Order.objects.filter(order_id__in=order_ids, status="pending").update(status="cancelled", updated_at=timezone.now())
+            if isinstance(e, payment_gateway.GatewayError):
+                return Response({"error": "Failed to create razorpay order", "detail": e.body or str(e)}, status=502)
+            print('checkout_basket payment intent failed:', e)
+            traceback.print_exc(file=sys.stdout)
+            return Response({"error": f"Checkout failed: {str(e)}"}, status=500)
+
+    return Response({
+        "address": ctx.address_summary(),
+        "items_count": plan["items_count"],
+        "result": plan["result"],
+        "notes": checkout.PRICING_NOTES,
+        "orders": orders,
+        "payment": intent,
+    }, status=201)
+
 # --------------------- Nearby marts (by free-form address string) ---------------------
 @api_view(["POST"])
 def nearby_marts(request):
@@ -2258,12 +2411,19 @@ def nearby_marts(request):
 
 
 @api_view(["POST"])
+@authentication_classes([CustomTokenAuthentication])
+@permission_classes([IsAuthenticated])
 def parse_shopping_list(request):
+    """
+    Body: { "text": "2 kg rice, milk x3\nhalf dozen eggs" }
+    Returns { items: [raw lines], lines: [{raw, name, quantity, weight_kg, candidates: [...]}],
+              basket_items: [{product_id, quantity}] (ready for optimize_basket), unmatched: [raw lines] }
+    All lines are matched against the product name index in one pass (api/shopping_list.py).
+    """
     text = (request.data or {}).get("text", "")
-    if not text:
+    if not text or not isinstance(text, str):
         return Response({"error": "text required"}, status=400)
-    items = [i.strip() for i in text.replace("\n", ",").split(",") if i.strip()]
-    return Response({"items": items})
+    return Response(shopping_list.resolve(text))
 
 @api_view(["GET"])
 @authentication_classes([CustomTokenAuthentication])
@@ -2271,7 +2431,9 @@ def parse_shopping_list(request):
 def list_orders(request):
     qs = models.Order.objects.filter(user=request.user).order_by("-created_at")
     # optimize queries
-    qs = qs.select_related("delivery_address").prefetch_related("orderitem_set__product__mart")
+    qs = qs.select_related("user", "delivery_address").prefetch_related(
+        Prefetch("orderitem_set", queryset=models.OrderItem.objects.select_related("product__mart", "product__rating"))
+    )
     data = serializers.OrderSerializer(qs, many=True).data
     return Response(data)
 
@@ -2307,35 +2469,33 @@ def create_razorpay_order(request):
         # convert to paise (integer)
         amount_paise = int(round(float(amount) * 100))
 
-        key_id = getattr(settings, "RAZORPAY_KEY_ID", os.environ.get("RAZORPAY_KEY_ID"))
-        key_secret = getattr(settings, "RAZORPAY_KEY_SECRET", os.environ.get("RAZORPAY_KEY_SECRET"))
-        if not key_id or not key_secret:
+        try:
+            client = payment_gateway.get_client()
+        except payment_gateway.GatewayError:
             return Response({"error": "Razorpay credentials not configured"}, status=500)
 
-        payload = {
-            "amount": amount_paise,
-            "currency": currency,
-            "receipt": receipt or f"savr_rcpt_{payment.payment_id}",
-            "payment_capture": 1,
-            "notes": notes or {},
-        }
-
-        r = requests.post("https://api.razorpay.com/v1/orders", auth=(key_id, key_secret), json=payload, timeout=10)
-        if r.status_code not in (200, 201):
+        try:
+            # pooled keep-alive session with split connect/read timeouts (api/payment_gateway.py)
+            rz = client.create_order(
+                amount_paise,
+                currency=currency,
+                receipt=receipt or f"savr_rcpt_{payment.payment_id}",
+                notes=notes,
+            )
+        except payment_gateway.GatewayError as e:
             # store error payload and mark payment failed
-            payment.raw_payload = {"rzp_error": r.text}
+            payment.raw_payload = {"rzp_error": e.body or str(e)}
             payment.status = "failed"
             payment.save(update_fields=["raw_payload", "status", "updated_at"])
-            return Response({"error": "Failed to create razorpay order", "detail": r.text}, status=500)
+            return Response({"error": "Failed to create razorpay order", "detail": e.body or str(e)}, status=500)
 
-        rz = r.json()
         provider_order_id = rz.get("id")
         payment.provider_order_id = provider_order_id
         payment.raw_payload = {"razorpay_order": rz}
         payment.save(update_fields=["provider_order_id", "raw_payload", "updated_at"])
 
         return Response({
-            "key_id": key_id,
+            "key_id": client.key_id,
             "razorpay_order_id": provider_order_id,
             "payment_id": payment.payment_id,
             "amount": float(payment.amount),
@@ -2344,6 +2504,15 @@ def create_razorpay_order(request):
     except Exception as exc:
         return Response({"error": "server_error", "detail": str(exc)}, status=500)
 
+@api_view(["GET"])
+@authentication_classes([CustomTokenAuthentication])
+@permission_classes([IsAuthenticated])
+def admin_payment_gateway_metrics(request):
+    """Per-operation latency of outbound payment provider calls in this process. Superuser only."""
+    if not getattr(request.user, 'is_superuser', False):
+        return Response({'error': 'Forbidden'}, status=403)
+    return Response({'metrics': payment_gateway.metrics.snapshot()})
+
 # --- Razorpay verify endpoint ---
 @api_view(["POST"])
 @authentication_classes([CustomTokenAuthentication])
@@ -2376,13 +2545,18 @@ def verify_razorpay_payment(request):
             return Response({"error": "Payment not found"}, status=404)
 
         if hmac.compare_digest(generated, rz_signature):
+            was_failed = payment.status == "failed"
             payment.status = "success"
             payment.provider_payment_id = rz_payment_id
             payment.save(update_fields=["status", "provider_payment_id", "updated_at"])
+            # order already linked (order created before payment) -> confirm + queue delivery
+            lifecycle.confirm_orders_for_payments([payment], reopen_cancelled=was_failed)
+            events.payment_changed(payment)
             return Response({"success": True})
         else:
             payment.status = "failed"
             payment.save(update_fields=["status", "updated_at"])
+            events.payment_changed(payment)
             return Response({"success": False, "error": "Invalid signature"}, status=400)
     except Exception as e:
         return Response({"error": "server_error", "detail": str(e)}, status=500)
@@ -2405,27 +2579,10 @@ def razorpay_webhook(request):
     if not hmac.compare_digest(expected, signature):
         return JsonResponse({"error": "Invalid signature"}, status=400)
 
-    event = json.loads(body.decode())
-    ev_type = event.get("event")
-
-    if ev_type == "payment.captured":
-        pay = event["payload"]["payment"]["entity"]
-        rz_payment_id = pay["id"]
-        amt = pay["amount"] / 100.0
-        # update Payment row
-        p = models.Payment.objects.filter(provider_payment_id=rz_payment_id).first()
-        if p:
-            p.status = "success"
-            p.amount = amt
-            p.raw_payload = pay
-            p.save(update_fields=["status", "amount", "raw_payload", "updated_at"])
-    elif ev_type == "payment.failed":
-        pay = event["payload"]["payment"]["entity"]
-        rz_payment_id = pay["id"]
-        p = models.Payment.objects.filter(provider_payment_id=rz_payment_id).first()
-        if p:
-            p.status = "failed"
-            p.raw_payload = pay
-            p.save(update_fields=["status", "raw_payload", "updated_at"])
-
-    return JsonResponse({"ok": True})
+    # store and acknowledge; api/webhooks.py applies the event off the request path
+    try:
+        _, created = webhooks.record(body, webhooks.event_id_for(request.headers, body))
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    return JsonResponse({"ok": True, "duplicate": not created})
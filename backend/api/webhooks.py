@@ -0,0 +1,166 @@
+# api/webhooks.py
+"""
+Queued, idempotent Razorpay webhook processing.
+
+``razorpay_webhook`` only verifies the signature and calls ``record()``, which
+stores the raw event keyed by Razorpay's ``X-Razorpay-Event-Id`` (falling back to
+a hash of the body). A retried delivery of the same event hits the unique key and
+is acknowledged without doing anything else, so the 200 goes back as soon as
+one INSERT has committed.
+
+Stored events are applied by ``process_pending()``: from a background thread
+woken after each new event (``WEBHOOK_ASYNC``), from the
+``process_webhook_events`` management command, or inline under tests. Applying
+is idempotent in its own right too: a captured payment that is already
+``success`` is left alone and a late ``payment.failed`` never downgrades it. A
+capture for a payment already marked ``failed`` wins: the payment becomes
+``success`` and the orders cancelled with it are re-opened and confirmed.
+"""
+import hashlib
+import json
+import threading
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import events, lifecycle, models
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def event_id_for(headers, body: bytes) -> str:
+    return headers.get("X-Razorpay-Event-Id") or "sha256:" + hashlib.sha256(body).hexdigest()
+
+
+def record(body: bytes, event_id: str) -> Tuple[models.PaymentWebhookEvent, bool]:
+    """Store the raw event once. Returns (event, created); created is False for a retry."""
+    payload = json.loads(body.decode())
+    ev, created = models.PaymentWebhookEvent.objects.get_or_create(
+        event_id=event_id,
+        defaults={"provider": "razorpay", "event_type": payload.get("event") or "", "payload": payload},
+    )
+    if created:
+        transaction.on_commit(worker.kick)
+    return ev, created
+
+
+def _find_payment(entity) -> Optional[models.Payment]:
+    qs = models.Payment.objects.select_for_update()
+    p = qs.filter(provider_payment_id=entity.get("id")).first() if entity.get("id") else None
+    if p is None and entity.get("order_id"):
+        # payment id is only stored once the client verifies; the order id exists from checkout
+        p = qs.filter(provider_order_id=entity["order_id"]).order_by("-payment_id").first()
+    return p
+
+
+def apply_event(ev: models.PaymentWebhookEvent) -> str:
+    """Apply one event to its Payment. Returns the resulting event status ('processed' / 'ignored')."""
+    if ev.event_type not in ("payment.captured", "payment.failed"):
+        return "ignored"
+    entity = ((ev.payload.get("payload") or {}).get("payment") or {}).get("entity") or {}
+    p = _find_payment(entity)
+    if p is None:
+        return "ignored"
+
+    if ev.event_type == "payment.captured":
+        if p.status == "success":
+            return "processed"
+        was_failed = p.status == "failed"  # a retried capture after reconciliation gave up on it
+        p.status = "success"
+        if entity.get("amount") is not None:
+            p.amount = entity["amount"] / 100.0
+        p.provider_payment_id = p.provider_payment_id or entity.get("id")
+        p.raw_payload = entity
+        p.save(update_fields=["status", "amount", "provider_payment_id", "raw_payload", "updated_at"])
+        lifecycle.confirm_orders_for_payments([p], reopen_cancelled=was_failed)
+    else:
+        if p.status in ("success", "refunded", "failed"):
+            return "processed"
+        p.status = "failed"
+        p.raw_payload = entity
+        p.save(update_fields=["status", "raw_payload", "updated_at"])
+    events.payment_changed(p)
+    return "processed"
+
+
+def process_pending(limit: Optional[int] = None, after_id: int = 0) -> List[int]:
+    """Apply one batch of pending events (id > after_id) in receipt order. Returns the ids handled."""
+    limit = limit or _setting("WEBHOOK_BATCH_SIZE", 100)
+    max_attempts = _setting("WEBHOOK_MAX_ATTEMPTS", 5)
+    with transaction.atomic():
+        batch = list(
+            models.PaymentWebhookEvent.objects.select_for_update(skip_locked=True)
+            .filter(status="pending", id__gt=after_id)
+            .order_by("id")[:limit]
+        )
+        for ev in batch:
+            ev.attempts += 1
+            try:
+                with transaction.atomic():
+                    ev.status = apply_event(ev)
+                ev.processed_at = timezone.now()
+                ev.last_error = None
+            except Exception as e:
+                print(f"[webhooks] event {ev.event_id} failed (attempt {ev.attempts}): {e}")
+                ev.last_error = str(e)
+                if ev.attempts >= max_attempts:
+                    ev.status = "failed"
+            ev.save(update_fields=["status", "attempts", "last_error", "processed_at"])
+    return [ev.id for ev in batch]
+
+
+def drain() -> int:
+    """Work through everything pending once; events that failed wait for the next drain."""
+    total, after_id = 0, 0
+    while True:
+        ids = process_pending(after_id=after_id)
+        if not ids:
+            return total
+        total += len(ids)
+        after_id = ids[-1]
+
+
+class WebhookWorker:
+    """Background drain, woken when a new event commits and otherwise every WEBHOOK_POLL_INTERVAL seconds."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def kick(self):
+        if not _setting("WEBHOOK_ASYNC", True):
+            try:
+                drain()
+            except Exception as e:
+                print(f"[webhooks] inline processing failed: {e}")
+            return
+        self._ensure_worker()
+        self._wake.set()
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="payment-webhook-worker", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=_setting("WEBHOOK_POLL_INTERVAL", 5.0))
+            self._wake.clear()
+            try:
+                drain()
+            except Exception as e:
+                print(f"[webhooks] worker drain failed: {e}")
+            finally:
+                close_old_connections()
+
+
+worker = WebhookWorker()
@@ -1,5 +1,6 @@
 # settings.py — modified for safe dev CORS + cookie handling
 import os
+import sys
 from pathlib import Path
 import dj_database_url
 from datetime import timedelta
@@ -286,6 +287,108 @@ RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
 RAZORPAY_WEBHOOK_SECRET = os.getenv("RAZORPAY_WEBHOOK_SECRET")
 
+# ---------- Audit log buffering (api/audit.py) ----------
+# AnalyticsLog events are queued in-process and written with bulk_create.
+# Buffering is off under `manage.py test` so assertions see rows immediately.
+TESTING = len(sys.argv) > 1 and sys.argv[1] == "test"
+AUDIT_LOG_BUFFERED = os.getenv("AUDIT_LOG_BUFFERED", "True").lower() in ("1", "true", "yes") and not TESTING
+AUDIT_LOG_BATCH_SIZE = int(os.getenv("AUDIT_LOG_BATCH_SIZE", "200"))
+AUDIT_LOG_FLUSH_INTERVAL = float(os.getenv("AUDIT_LOG_FLUSH_INTERVAL", "2.0"))
+AUDIT_LOG_MAX_QUEUE = int(os.getenv("AUDIT_LOG_MAX_QUEUE", "10000"))
+
+# ---------- Delivery dispatch (api/dispatch.py) ----------
+DISPATCH_BATCH_SIZE = int(os.getenv("DISPATCH_BATCH_SIZE", "200"))          # pending deliveries per batch
+DISPATCH_PARTNER_CAPACITY = int(os.getenv("DISPATCH_PARTNER_CAPACITY", "3"))  # active deliveries per partner (batched into one route)
+DISPATCH_CANDIDATES = int(os.getenv("DISPATCH_CANDIDATES", "8"))             # nearest partners scored per delivery
+DISPATCH_MAX_PICKUP_KM = float(os.getenv("DISPATCH_MAX_PICKUP_KM", "25"))
+DISPATCH_GRID_CELL_KM = float(os.getenv("DISPATCH_GRID_CELL_KM", "2"))
+ROUTE_STOP_SERVICE_MIN = int(os.getenv("ROUTE_STOP_SERVICE_MIN", "3"))       # minutes spent at each pickup/drop (api/routing.py)
+DISPATCH_ON_CONFIRM = os.getenv("DISPATCH_ON_CONFIRM", "True").lower() in ("1", "true", "yes")  # run a dispatch batch when orders are confirmed (api/lifecycle.py)
+
+# Partner location pings (api/locations.py): coalesced in memory, written in batches
+LOCATION_BUFFERED = os.getenv("LOCATION_BUFFERED", "True").lower() in ("1", "true", "yes") and not TESTING
+LOCATION_FLUSH_INTERVAL = float(os.getenv("LOCATION_FLUSH_INTERVAL", "5"))       # seconds between batched UPDATEs
+LOCATION_FLUSH_BATCH_SIZE = int(os.getenv("LOCATION_FLUSH_BATCH_SIZE", "500"))
+LOCATION_STALE_SECONDS = int(os.getenv("LOCATION_STALE_SECONDS", "300"))         # ignore live positions older than this
+
+# Outbound payment provider client (api/payment_gateway.py)
+RAZORPAY_API_BASE = os.getenv("RAZORPAY_API_BASE", "https://api.razorpay.com/v1")
+PAYMENT_HTTP_CONNECT_TIMEOUT = float(os.getenv("PAYMENT_HTTP_CONNECT_TIMEOUT", "3.05"))
+PAYMENT_HTTP_READ_TIMEOUT = float(os.getenv("PAYMENT_HTTP_READ_TIMEOUT", "10"))
+PAYMENT_HTTP_RETRIES = int(os.getenv("PAYMENT_HTTP_RETRIES", "2"))               # connect errors always; read/5xx only for GETs
+PAYMENT_HTTP_BACKOFF = float(os.getenv("PAYMENT_HTTP_BACKOFF", "0.3"))
+PAYMENT_HTTP_POOL_SIZE = int(os.getenv("PAYMENT_HTTP_POOL_SIZE", "10"))
+
+# Pending payment reconciliation (api/reconciliation.py, `manage.py reconcile_payments`)
+PAYMENT_RECONCILE_AFTER_MINUTES = int(os.getenv("PAYMENT_RECONCILE_AFTER_MINUTES", "30"))        # only look at payments pending this long
+PAYMENT_RECONCILE_EXPIRE_MINUTES = int(os.getenv("PAYMENT_RECONCILE_EXPIRE_MINUTES", "1440"))    # no provider payment by then -> failed
+PAYMENT_RECONCILE_BATCH_SIZE = int(os.getenv("PAYMENT_RECONCILE_BATCH_SIZE", "200"))
+PAYMENT_RECONCILE_LOOKAHEAD_MINUTES = int(os.getenv("PAYMENT_RECONCILE_LOOKAHEAD_MINUTES", "360"))
+PAYMENT_RECONCILE_MAX_PAGES = int(os.getenv("PAYMENT_RECONCILE_MAX_PAGES", "50"))
+
+# Payment webhooks (api/webhooks.py): stored on receipt, applied by a worker thread
+WEBHOOK_ASYNC = os.getenv("WEBHOOK_ASYNC", "True").lower() in ("1", "true", "yes") and not TESTING
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "100"))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL", "5"))            # also retries failed events
+
+# Status push over server-sent events (api/events.py, /api/v1/events/). Each open stream
+# holds a worker thread, so only enable it behind a worker class that can hold streams
+# (gthread/gevent, see Procfile); runserver is threaded. Clients ask /events/status/ first.
+# With more than one worker process, events must travel through Redis (EVENTS_REDIS_URL,
+# defaulting to CACHE_URL) so a stream on one worker sees changes made on another.
+EVENTS_STREAMING = os.getenv("EVENTS_STREAMING", str(DEBUG)).lower() in ("1", "true", "yes")
+EVENTS_REDIS_URL = os.getenv("EVENTS_REDIS_URL", os.getenv("CACHE_URL", ""))
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))     # keepalive comment interval
+EVENTS_MAX_STREAM_SECONDS = float(os.getenv("EVENTS_MAX_STREAM_SECONDS", "300"))  # close and let EventSource reconnect
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", "3000"))
+EVENTS_HISTORY_SIZE = int(os.getenv("EVENTS_HISTORY_SIZE", "500"))                # replay buffer for Last-Event-ID
+EVENTS_SUBSCRIBER_QUEUE = int(os.getenv("EVENTS_SUBSCRIBER_QUEUE", "100"))
+
+# Shared cache. Server-side checkout plans (api/checkout.py) live here, so point CACHE_URL
+# at Redis when running more than one worker process; otherwise a per-process memory cache.
+CACHE_URL = os.getenv("CACHE_URL")
+CACHES = {
+    "default": (
+        {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": CACHE_URL}
+        if CACHE_URL else
+        {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "savr-default",
+         "OPTIONS": {"MAX_ENTRIES": int(os.getenv("LOCMEM_CACHE_MAX_ENTRIES", "10000"))}}
+    )
+}
+PLAN_CACHE_TTL = int(os.getenv("PLAN_CACHE_TTL", "600"))   # seconds a plan_id from optimize_basket stays orderable
+OPTIMIZE_CACHE_TTL = int(os.getenv("OPTIMIZE_CACHE_TTL", "120"))       # memoized optimize results (api/optimize_cache.py)
+OPTIMIZE_COALESCE_WAIT = float(os.getenv("OPTIMIZE_COALESCE_WAIT", "10"))  # max wait on an identical in-flight optimize
+
+# In-process catalog snapshot read by basket optimization (api/catalog.py)
+CATALOG_SNAPSHOT = os.getenv("CATALOG_SNAPSHOT", "True").lower() in ("1", "true", "yes") and not TESTING
+CATALOG_REFRESH_INTERVAL = float(os.getenv("CATALOG_REFRESH_INTERVAL", "5"))       # seconds between incremental refreshes
+CATALOG_FULL_RELOAD_SECONDS = int(os.getenv("CATALOG_FULL_RELOAD_SECONDS", "300"))  # full reload drops rows deleted elsewhere
+CATALOG_REFRESH_ASYNC = os.getenv("CATALOG_REFRESH_ASYNC", "True").lower() in ("1", "true", "yes") and not TESTING  # incremental refresh off the request thread
+
+# Bulk stock updates for mart admins (api/inventory.py)
+STOCK_BULK_MAX_ROWS = int(os.getenv("STOCK_BULK_MAX_ROWS", "10000"))
+STOCK_BULK_BATCH_SIZE = int(os.getenv("STOCK_BULK_BATCH_SIZE", "500"))   # products locked + updated per transaction
+
+# Staff User -> Admin + managed mart ids, resolved at authentication (api/authentication.py)
+# Admin/Mart changes invalidate it through the default cache, which only reaches every worker when
+# that cache is shared (CACHE_URL); with the per-process memory cache keep the TTL short instead.
+ADMIN_PRINCIPAL_CACHE_TTL = int(os.getenv("ADMIN_PRINCIPAL_CACHE_TTL", "300" if CACHE_URL else "15"))
+
+# Admin sales analytics, answered from the rollup tables (api/rollups.py)
+ANALYTICS_DEFAULT_DAYS = int(os.getenv("ANALYTICS_DEFAULT_DAYS", "30"))
+ANALYTICS_MAX_DAYS = int(os.getenv("ANALYTICS_MAX_DAYS", "366"))
+
+# Offline review sentiment scoring, run by `manage.py score_review_sentiment` (api/sentiment.py)
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "500"))
+SENTIMENT_WORKERS = int(os.getenv("SENTIMENT_WORKERS", "0"))            # 0 = one process per CPU
+SENTIMENT_LEXICON_PATH = os.getenv("SENTIMENT_LEXICON_PATH", "")        # optional word<TAB>score file
+
+# Shopping-list parsing + product matching (api/shopping_list.py)
+SHOPPING_LIST_MAX_LINES = int(os.getenv("SHOPPING_LIST_MAX_LINES", "200"))
+SHOPPING_LIST_MIN_SCORE = float(os.getenv("SHOPPING_LIST_MIN_SCORE", "0.55"))   # fuzzy-match cutoff, 0..1
+SHOPPING_LIST_INDEX_TTL = int(os.getenv("SHOPPING_LIST_INDEX_TTL", "60"))        # name index rebuild interval (seconds)
+
 # django-axes configuration (basic sensible defaults)
 AXES_ENABLED = True
 AXES_FAILURE_LIMIT = int(os.getenv("AXES_FAILURE_LIMIT", "5"))
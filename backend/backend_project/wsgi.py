@@ -3,3 +3,8 @@ from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend_project.settings')
 application = get_wsgi_application()
+
+# load the in-memory catalog in the background at startup so no request waits for it
+from api import catalog, events  # noqa: E402
+catalog.warm()
+events.warm()
@@ -125,10 +125,24 @@ const AdminDashboard: React.FC = () => {
         // ignore polling errors
       }
     };
-    // immediately run once then every 10s
+    // run once, then refresh on pushed delivery/order events (slow poll as a safety net)
+    // when the server streams them; otherwise poll every 10s
     tick();
-    const id = setInterval(() => { if (!stopped) tick(); }, 10000);
-    return () => { stopped = true; clearInterval(id); };
+    let es: EventSource | null = null;
+    let id: ReturnType<typeof setInterval> | null = null;
+    const poll = (ms: number) => { id = setInterval(() => { if (!stopped) tick(); }, ms); };
+    fetch('/api/v1/events/status/', { credentials: 'include' })
+      .then((r) => (r.ok ? r.json() : { streaming: false }))
+      .catch(() => ({ streaming: false }))
+      .then((j) => {
+        if (stopped) return;
+        if (!j.streaming) { poll(10000); return; }
+        es = new EventSource('/api/v1/events/', { withCredentials: true });
+        const onChange = () => { if (!stopped) tick(); };
+        ['delivery.assigned', 'delivery.delivered', 'order.confirmed'].forEach((t) => es!.addEventListener(t, onChange));
+        poll(60000);
+      });
+    return () => { stopped = true; es?.close(); if (id) clearInterval(id); };
   }, [activeTab]);
 
   const fetchDeliveries = async () => {
@@ -37,10 +37,42 @@ const AgentDashboard: React.FC = () => {
 
   useEffect(() => { load(); }, []);
 
-  // optional polling every 30s while mounted
+  // reload when the server pushes an assignment/status change (slow poll as a safety net)
+  // if it streams events; otherwise poll every 30s
   useEffect(() => {
-    const id = setInterval(() => { load(); }, 30000);
-    return () => clearInterval(id);
+    let stopped = false;
+    let es: EventSource | null = null;
+    let id: ReturnType<typeof setInterval> | null = null;
+    fetch('/api/v1/events/status/', { credentials: 'include' })
+      .then((r) => (r.ok ? r.json() : { streaming: false }))
+      .catch(() => ({ streaming: false }))
+      .then((j) => {
+        if (stopped) return;
+        if (j.streaming) {
+          es = new EventSource('/api/v1/events/', { withCredentials: true });
+          const onChange = () => { load(); };
+          es.addEventListener('delivery.assigned', onChange);
+          es.addEventListener('delivery.delivered', onChange);
+        }
+        id = setInterval(() => { load(); }, j.streaming ? 120000 : 30000);
+      });
+    return () => { stopped = true; es?.close(); if (id) clearInterval(id); };
+  }, []);
+
+  // report our position so dispatch can pick the nearest partner (server coalesces pings)
+  useEffect(() => {
+    if (!('geolocation' in navigator)) return;
+    let last = 0;
+    const watchId = navigator.geolocation.watchPosition((pos) => {
+      const now = Date.now();
+      if (now - last < 10000) return;
+      last = now;
+      fetch('/api/v1/partners/location/', {
+        method: 'POST', credentials: 'include', headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ lat: pos.coords.latitude, lon: pos.coords.longitude }),
+      }).catch(() => { /* best effort */ });
+    }, () => { /* permission denied or unavailable */ }, { enableHighAccuracy: true, maximumAge: 10000 });
+    return () => navigator.geolocation.clearWatch(watchId);
   }, []);
 
   const { toast } = useToast();